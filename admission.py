@@ -0,0 +1,99 @@
+"""
+admission.py
+
+Load shedding. Each worker process counts the requests it is handling and, once a budget is
+used up, answers new ones right away with 503 and Retry-After instead of letting them pile up
+behind the busy ones. The budgets, per worker process, 0 turns one off:
+
+    ADMISSION_MAX_IN_FLIGHT         every request (off by default)
+    ADMISSION_MAX_WRITES_IN_FLIGHT  POST/PUT/PATCH/DELETE (off by default)
+    ADMISSION_MAX_AUTH_IN_FLIGHT    handlers decorated with @ADMISSION.limit("auth"), i.e. the
+                                    pbkdf2 ones, /login and /register (4)
+
+Keep the writes and auth budgets smaller than the threads of a worker (GUNICORN_THREADS in
+gunicorn.conf.py), so however many logins or bulk writes come in, some threads are always
+left for the cheap GETs. Only the auth budget is on by default, shedding ordinary writes is
+something to turn on once you know how many your workers handle. Logins past the auth budget
+would only wait for the password hashing pool (passwords.py) anyway. GET /metrics and the
+other Stats routes are never shed, so we can still see what is going on. Counting is per
+process, requests gunicorn has accepted but not handed to a thread yet are not seen here.
+
+ratelimit.py is the other half: that one is per client and answers 429.
+"""
+import threading
+from functools import wraps
+
+from flask import g, request
+from flask_smorest import abort
+
+from metrics import ADMISSION_REJECTED
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+EXEMPT_BLUEPRINTS = ("Stats",)
+
+
+class AdmissionControl:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.budgets = {}
+        self.in_flight = {}
+        self.retry_after = 1
+
+    def init_app(self, app):
+        #Register after metrics.init_app(), a shed request skips the before_request functions after this one
+        self.budgets = {
+            "all": app.config["ADMISSION_MAX_IN_FLIGHT"],
+            "writes": app.config["ADMISSION_MAX_WRITES_IN_FLIGHT"],
+            "auth": app.config["ADMISSION_MAX_AUTH_IN_FLIGHT"],
+        }
+        self.retry_after = app.config["ADMISSION_RETRY_AFTER"]
+        with self.lock:
+            self.in_flight = {budget: 0 for budget in self.budgets}
+        app.before_request(self._admit_request)
+        app.teardown_request(self._request_done) #runs even when the view raised
+
+    def enter(self, *budgets):
+        #Counts the request in every one of budgets, or answers 503 if one of them is used up
+        with self.lock:
+            full = [budget for budget in budgets if self.budgets[budget] and self.in_flight[budget] >= self.budgets[budget]]
+            if not full:
+                for budget in budgets:
+                    self.in_flight[budget] += 1
+                return
+        ADMISSION_REJECTED.labels(full[0]).inc()
+        abort(
+            503,
+            message="The server is busy, try again later.",
+            headers={"Retry-After": str(self.retry_after)}
+        )
+
+    def leave(self, *budgets):
+        with self.lock:
+            for budget in budgets:
+                self.in_flight[budget] -= 1
+
+    def _admit_request(self):
+        if request.blueprint in EXEMPT_BLUEPRINTS:
+            return
+        budgets = ("all",) if request.method in SAFE_METHODS else ("all", "writes")
+        self.enter(*budgets)
+        g.admitted = budgets
+
+    def _request_done(self, exception):
+        self.leave(*g.pop("admitted", ()))
+
+    def limit(self, budget):
+        #For the handlers that have a budget of their own
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                self.enter(budget)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.leave(budget)
+            return wrapper
+        return decorator
+
+
+ADMISSION = AdmissionControl()
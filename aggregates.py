@@ -0,0 +1,95 @@
+"""
+aggregates.py
+
+The numbers behind GET /store/<id>/stats, all computed by the database: the items of the
+store never get loaded into Python.
+
+count/min/max/avg are plain SQL aggregates over the (store_id, price) index. Percentiles use
+percentile_cont where the database has it (Postgres). SQLite doesn't, so there we number the
+prices of the store in order with ROW_NUMBER() and read the one or two prices around every
+percentile in that same pass, then interpolate between them exactly like percentile_cont does.
+One query for all the percentiles asked for, however many there are.
+"""
+import math
+
+from sqlalchemy import func, select
+
+from db import db
+from models import ItemModel, ItemTags, TagModel
+
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0)
+
+
+def percentile_key(percentile):
+    return f"p{percentile:g}" #p50, p99.9
+
+
+def _percentiles_by_rank(store_id, fractions, count):
+    #The positions percentile_cont interpolates at, 0 based, and the ranks around them
+    positions = [fraction * (count - 1) for fraction in fractions]
+    ranks = {rank for position in positions for rank in (math.floor(position), math.ceil(position))}
+
+    numbered = select(
+        ItemModel.price, (func.row_number().over(order_by=ItemModel.price) - 1).label("rank")
+    ).where(ItemModel.store_id == store_id).subquery()
+    prices = dict(db.session.execute(
+        select(numbered.c.rank, numbered.c.price).where(numbered.c.rank.in_(sorted(ranks)))
+    ).all())
+
+    values = []
+    for position in positions:
+        lower, upper = math.floor(position), math.ceil(position)
+        if lower not in prices: #items deleted since we counted them
+            values.append(None)
+        elif upper not in prices or upper == lower:
+            values.append(prices[lower])
+        else:
+            values.append(prices[lower] + (prices[upper] - prices[lower]) * (position - lower))
+    return values
+
+
+def price_stats(store_id, percentiles):
+    columns = [func.count(ItemModel.id), func.min(ItemModel.price), func.max(ItemModel.price), func.avg(ItemModel.price)]
+    in_database = db.engine.dialect.name == "postgresql"
+    if in_database:
+        columns += [func.percentile_cont(percentile / 100).within_group(ItemModel.price) for percentile in percentiles]
+
+    row = db.session.execute(select(*columns).where(ItemModel.store_id == store_id)).one()
+    count, minimum, maximum, mean = row[:4]
+    if in_database:
+        values = row[4:]
+    elif count:
+        values = _percentiles_by_rank(store_id, [percentile / 100 for percentile in percentiles], count)
+    else:
+        values = [None] * len(percentiles)
+
+    return count, {
+        "min": minimum,
+        "max": maximum,
+        "mean": mean,
+        "percentiles": {percentile_key(percentile): value for percentile, value in zip(percentiles, values)},
+    }
+
+
+def tag_item_counts(store_id):
+    #Every tag of the store with how many items it is linked to, tags without items included
+    rows = db.session.execute(
+        select(TagModel.id, TagModel.name, func.count(ItemTags.item_id))
+        .outerjoin(ItemTags, ItemTags.tag_id == TagModel.id)
+        .where(TagModel.store_id == store_id)
+        .group_by(TagModel.id, TagModel.name)
+        .order_by(TagModel.id)
+    ).all()
+    return [{"id": tag_id, "name": name, "item_count": item_count} for tag_id, name, item_count in rows]
+
+
+def store_stats(store_id, percentiles=DEFAULT_PERCENTILES):
+    item_count, price = price_stats(store_id, percentiles)
+    tags = tag_item_counts(store_id)
+    return {
+        "store_id": store_id,
+        "item_count": item_count,
+        "tag_count": len(tags),
+        "price": price,
+        "tags": tags,
+    }
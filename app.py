@@ -7,18 +7,31 @@ from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
 from dotenv import load_dotenv
 
-from db import db
+from db import db, engine_options, configure_engine, all_engines, POOL_STATS
+from replicas import REPLICAS
+from shards import SHARDS
 from blocklist import BLOCKLIST
+from passwords import PASSWORDS
+from ratelimit import RATE_LIMITS
+from admission import ADMISSION
+from cache import RESPONSE_CACHE
+from seed import seed_command
+from importer import import_command
+from timing import REQUEST_TIMING
+from serializers import FAST_SERIALIZER
+import metrics
+import search
 import models #Its similar as doing models.__init__ and inside it we have StoreModel and ItemModel
 
 from resources.item import blp as ItemBlueprint #Importing blueprint of item from resources -> item.py
 from resources.store import blp as StoreBlueprint #Importing blueprint of store from resources -> store.py
 from resources.tag import blp as TagBlueprint #Importing blueprint of tag from resources -> tag.py
 from resources.user import blp as UserBlueprint
+from resources.stats import blp as StatsBlueprint
 
 
 #A factory pattern
-def create_app(db_url=None):
+def create_app(db_url=None, replica_urls=None, shard_urls=None):
     app = Flask(__name__) 
     load_dotenv() #This will find a .env file existing at the root of the project and load its content
 
@@ -34,9 +47,41 @@ def create_app(db_url=None):
     #Define database URL
     app.config["SQLALCHEMY_DATABASE_URI"] = db_url or os.getenv("DATABASE_URL","sqlite:///data.db") #Now os.getenv will be able to access the value stored in .env
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"]) #pool sizing from DB_POOL_* in .env, see db.py
+    #Read replicas for the GET handlers, a list here or comma separated in .env, see replicas.py
+    if replica_urls is None:
+        replica_urls = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    app.config["DATABASE_REPLICA_URLS"] = list(replica_urls)
+    app.config["REPLICA_RETRY_SECONDS"] = float(os.getenv("REPLICA_RETRY_SECONDS", 30)) #how long a failed replica is left out
+    app.config["REPLICA_STICKY_SECONDS"] = float(os.getenv("REPLICA_STICKY_SECONDS", 5)) #reads of a client go to the primary for this long after it wrote
+    #More databases to spread the stores (and their items and tags) over, DATABASE_URL is shard 0, see shards.py
+    if shard_urls is None:
+        shard_urls = [url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+    app.config["DATABASE_SHARD_URLS"] = list(shard_urls)
+    #Response cache for the single resource GETs, off unless RESPONSE_CACHE_ENABLED is set, see cache.py
+    app.config["RESPONSE_CACHE_ENABLED"] = os.getenv("RESPONSE_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+    app.config["RESPONSE_CACHE_BACKEND"] = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+    app.config["RESPONSE_CACHE_TTL"] = float(os.getenv("RESPONSE_CACHE_TTL", 60)) #seconds
+    app.config["RESPONSE_CACHE_MAX_SIZE"] = int(os.getenv("RESPONSE_CACHE_MAX_SIZE", 10000)) #entries per process
+    RESPONSE_CACHE.init_app(app)
+    app.config["BULK_INSERT_BATCH_SIZE"] = int(os.getenv("BULK_INSERT_BATCH_SIZE", 1000)) #how many rows POST /item/bulk inserts per statement and transaction
+    app.config["BULK_MAX_ITEMS"] = int(os.getenv("BULK_MAX_ITEMS", 10000)) #rows per POST/PUT /item/bulk request, more is a 422
+    app.config["IMPORT_CHUNK_SIZE"] = int(os.getenv("IMPORT_CHUNK_SIZE", 1000)) #rows per transaction of flask import-items and POST /item/import
+    app.config["FAST_SERIALIZER_MIN_ROWS"] = int(os.getenv("FAST_SERIALIZER_MIN_ROWS", 100)) #dumps with at least this many rows skip marshmallow, 0 turns it off, see serializers.py
+    FAST_SERIALIZER.init_app(app)
     db.init_app(app) #Initializes the flask sqlalchemy extension, giving it our flask app so that it connects our flask app to sqlalchemy
-
-    migrate = Migrate(app,db,compare_type=True) #We are migrating app and db. So this has to be created after db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine) #WAL and friends when we are on SQLite
+    POOL_STATS.reset()
+    REPLICAS.init_app(app)
+    SHARDS.init_app(app) #also adds flask shards init/status
+    with app.app_context():
+        metrics.init_app(app, all_engines()) #request counts and latencies for /metrics
+
+    migrate = Migrate(app,db,compare_type=True,include_name=search.include_name) #include_name keeps autogenerate away from the full-text search tables, see search.py
+    #We are migrating app and db. So this has to be created after db.init_app(app)
+    app.cli.add_command(seed_command) #flask seed, generates data for benchmarks and load tests
+    app.cli.add_command(import_command) #flask import-items catalog.csv, see importer.py
     
     api = Api(app) #This basically connects the flask smorest extension to the flask app.
 
@@ -44,13 +89,44 @@ def create_app(db_url=None):
     app.config["JWT_SECRET_KEY"] = "317024441450319040335035063301171231192" #used to verify whether this app generated the JWT when the user sends a request with JWT and check if its valid JWT that our API generated.
     #secrets.SystemRandom().getrandbits(128) generates a long and random secret key
 
+    #Where revoked tokens are kept, see blocklist.py. "database" is shared by all the gunicorn workers, "memory" is per process.
+    app.config["JWT_BLOCKLIST_BACKEND"] = os.getenv("JWT_BLOCKLIST_BACKEND", "database")
+    app.config["JWT_BLOCKLIST_CACHE_SECONDS"] = float(os.getenv("JWT_BLOCKLIST_CACHE_SECONDS", 5)) #how long a "not revoked" answer is reused by this worker
+    BLOCKLIST.init_app(app)
+
+    #pbkdf2 cost and how many threads may hash passwords at the same time, see passwords.py
+    app.config["PASSWORD_HASH_ROUNDS"] = int(os.getenv("PASSWORD_HASH_ROUNDS", 29000))
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    PASSWORDS.init_app(app)
+    #Token buckets for /login and /register, "<attempts>/<seconds>" or 0 for off, see ratelimit.py
+    app.config["LOGIN_LIMIT_PER_USERNAME"] = os.getenv("LOGIN_LIMIT_PER_USERNAME", "10/60")
+    app.config["LOGIN_LIMIT_PER_IP"] = os.getenv("LOGIN_LIMIT_PER_IP", "30/60")
+    app.config["REGISTER_LIMIT_PER_IP"] = os.getenv("REGISTER_LIMIT_PER_IP", "10/60")
+    app.config["RATE_LIMIT_BACKEND"] = os.getenv("RATE_LIMIT_BACKEND", "memory") #"file" shares the buckets between the workers of a machine
+    app.config["RATE_LIMIT_FILE"] = os.getenv("RATE_LIMIT_FILE", "/tmp/ratelimit.db")
+    RATE_LIMITS.init_app(app)
+
     #Create an instance of JWT Manager
     jwt = JWTManager(app)
 
+    #Server-Timing header and a log line with query count, DB, serialization and JWT time per request, see timing.py
+    app.config["REQUEST_TIMING_ENABLED"] = os.getenv("REQUEST_TIMING_ENABLED", "0").lower() in ("1", "true", "yes")
+    with app.app_context():
+        REQUEST_TIMING.init_app(app, jwt, all_engines()) #the replicas and shards too, a routed request counts its queries
+
+    #Requests in flight per worker before we answer 503, 0 for no limit, see admission.py
+    app.config["ADMISSION_MAX_IN_FLIGHT"] = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 0))
+    app.config["ADMISSION_MAX_WRITES_IN_FLIGHT"] = int(os.getenv("ADMISSION_MAX_WRITES_IN_FLIGHT", 0))
+    app.config["ADMISSION_MAX_AUTH_IN_FLIGHT"] = int(os.getenv("ADMISSION_MAX_AUTH_IN_FLIGHT", 4))
+    app.config["ADMISSION_RETRY_AFTER"] = int(os.getenv("ADMISSION_RETRY_AFTER", 1)) #seconds, for the Retry-After header
+    ADMISSION.init_app(app) #after the other before_request functions, it may answer before them
+
     #To check if token in blocklist
     @jwt.token_in_blocklist_loader
     def check_if_token_in_blocklist(jwt_header, jwt_payload):
-        return jwt_payload["jti"] in BLOCKLIST
+        revoked = BLOCKLIST.is_revoked(jwt_payload["jti"], jwt_payload.get("exp"))
+        REQUEST_TIMING.jwt_verified()
+        return revoked
     
     #What error messagethe user get specifically
     @jwt.revoked_token_loader
@@ -78,7 +154,7 @@ def create_app(db_url=None):
     @jwt.additional_claims_loader  #This lets you add extra information to JWT
     def add_claims_to_jwt(identity):
         # Look in the database and see whether the user is an admin
-        if identity == 1:
+        if identity == "1": #identities are the user id as a string, PyJWT wants a string "sub"
             return {"is_admin": True}
         return {"is_admin": False}
 
@@ -119,6 +195,7 @@ def create_app(db_url=None):
     api.register_blueprint(StoreBlueprint)
     api.register_blueprint(TagBlueprint)
     api.register_blueprint(UserBlueprint)
+    api.register_blueprint(StatsBlueprint)
 
     return app
 
@@ -0,0 +1,43 @@
+"""
+Compare two reports written by benchmarks/http_suite.py.
+
+    python benchmarks/compare.py before.json after.json
+
+Prints every route with the old and new value of each metric and the change in percent.
+"""
+import json
+import sys
+
+METRICS = ["throughput_rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request", "errors"]
+
+
+def change(old, new):
+    if old is None or new is None:
+        return ""
+    if old == 0:
+        return "" if new == 0 else "new"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit(__doc__.strip())
+    with open(sys.argv[1]) as f:
+        before = json.load(f)
+    with open(sys.argv[2]) as f:
+        after = json.load(f)
+
+    print(f"{before['meta'].get('commit')} -> {after['meta'].get('commit')}")
+    rows = [("TOTAL", before["total"], after["total"])]
+    for route in sorted(set(before["routes"]) | set(after["routes"])):
+        rows.append((route, before["routes"].get(route, {}), after["routes"].get(route, {})))
+
+    for route, old, new in rows:
+        print(route)
+        for metric in METRICS:
+            old_value, new_value = old.get(metric), new.get(metric)
+            print(f"    {metric:20} {str(old_value):>10} -> {str(new_value):<10} {change(old_value, new_value)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+HTTP benchmark suite.
+
+Builds the app with create_app(db_url=...), seeds it with a deterministic dataset, serves it
+from a threaded local server and replays a seeded mix of requests over every blueprint from
+several client threads. Prints (or writes with --output) JSON with throughput, p50/p95/p99
+latency and SQL queries per request for every route, so two runs can be compared with
+benchmarks/compare.py.
+
+    python benchmarks/http_suite.py --output before.json
+    python benchmarks/http_suite.py --output after.json
+    python benchmarks/compare.py before.json after.json
+
+By default the database is a throwaway SQLite file. Pass --db-url to run against something
+else, e.g. a local Postgres (it must be empty, the suite creates the tables itself).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#route name -> weight, per mix
+MIXES = {
+    "read": {
+        "GET /item": 15, "GET /item/<id>": 20, "GET /store": 5, "GET /store/<id>": 20,
+        "GET /store/<id>/tag": 15, "GET /tag/<id>": 15, "GET /user/<id>": 10,
+    },
+    "mixed": {
+        "GET /item": 15, "GET /item/<id>": 20, "GET /store": 5, "GET /store/<id>": 15,
+        "GET /store/<id>/tag": 10, "GET /tag/<id>": 10, "GET /user/<id>": 5,
+        "POST /item": 5, "PUT /item/<id>": 5, "POST /item/<id>/tag/<id>": 3,
+        "POST /login": 2, "POST /refresh": 3, "POST /logout": 2,
+    },
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 3)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed_dataset(db, args):
+    #Same generator as `flask seed`, plus the user the suite logs in with
+    from sqlalchemy import insert
+    from models import UserModel
+    from passwords import PASSWORDS
+    from seed import generate
+
+    generate(args.stores, args.items_per_store, args.tags_per_store, args.tags_per_item, seed=args.seed)
+    db.session.execute(insert(UserModel.__table__), [{"id": 1, "username": "bench", "password": PASSWORDS.hash("bench-password")}])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP benchmark suite for the stores API")
+    parser.add_argument("--db-url", help="database to run against (default: a throwaway SQLite file)")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--requests", type=int, default=2000, help="total requests to send")
+    parser.add_argument("--concurrency", type=int, default=4, help="client threads")
+    parser.add_argument("--stores", type=int, default=50)
+    parser.add_argument("--items-per-store", type=int, default=100)
+    parser.add_argument("--tags-per-store", type=int, default=10)
+    parser.add_argument("--tags-per-item", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    os.environ.setdefault("JWT_BLOCKLIST_BACKEND", "memory")
+    #One user logs in over and over from 127.0.0.1, the login rate limits (ratelimit.py) would answer 429,
+    #and with enough --concurrency admission.py would shed requests, we want them all measured
+    for limit in ("LOGIN_LIMIT_PER_USERNAME", "LOGIN_LIMIT_PER_IP", "ADMISSION_MAX_WRITES_IN_FLIGHT", "ADMISSION_MAX_AUTH_IN_FLIGHT"):
+        os.environ.setdefault(limit, "0")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    from flask import g
+    from flask_jwt_extended import create_access_token, create_refresh_token
+    from sqlalchemy import event
+    from werkzeug.serving import make_server
+
+    from app import create_app
+    from db import db
+
+    db_file = None
+    db_url = args.db_url
+    if db_url is None:
+        db_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        db_url = f"sqlite:///{db_file.name}"
+
+    app = create_app(db_url)
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.create_all()
+        seed_dataset(db, args)
+        dialect = db.engine.dialect.name
+
+        #Count the SQL statements of every request and send the number back in a header
+        queries = threading.local()
+        event.listen(db.engine, "before_cursor_execute", lambda *a: setattr(queries, "count", getattr(queries, "count", 0) + 1))
+
+    @app.before_request
+    def reset_query_count():
+        queries.count = 0
+
+    @app.after_request
+    def send_query_count(response):
+        response.headers["X-Query-Count"] = str(getattr(queries, "count", 0))
+        return response
+
+    def tokens(kind):
+        with app.app_context():
+            if kind == "refresh":
+                return create_refresh_token(identity="1")
+            return create_access_token(identity="1", fresh=True)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    item_count = args.stores * args.items_per_store
+    tag_count = args.stores * args.tags_per_store
+    access = tokens("access")
+    credentials = {"username": "bench", "password": "bench-password"}
+
+    def build(route, number):
+        #Turns a route name into (method, path, body, token) with ids picked from the seeded rows
+        pick = random.Random(args.seed * 1000003 + number)
+        if route == "GET /item":
+            return "GET", "/item?limit=50", None, access
+        if route == "GET /item/<id>":
+            return "GET", f"/item/{pick.randint(1, item_count)}", None, access
+        if route == "GET /store":
+            return "GET", "/store?limit=20", None, None
+        if route == "GET /store/<id>":
+            return "GET", f"/store/{pick.randint(1, args.stores)}", None, None
+        if route == "GET /store/<id>/tag":
+            return "GET", f"/store/{pick.randint(1, args.stores)}/tag", None, None
+        if route == "GET /tag/<id>":
+            return "GET", f"/tag/{pick.randint(1, tag_count)}", None, None
+        if route == "GET /user/<id>":
+            return "GET", "/user/1", None, None
+        if route == "POST /item":
+            body = {"name": f"bench-new-{number}", "price": 9.99, "store_id": pick.randint(1, args.stores)}
+            return "POST", "/item", body, access
+        if route == "PUT /item/<id>":
+            item_id = pick.randint(1, item_count)
+            return "PUT", f"/item/{item_id}", {"name": f"item-{item_id}", "price": round(pick.uniform(1, 500), 2)}, None
+        if route == "POST /item/<id>/tag/<id>":
+            item_id = pick.randint(1, item_count)
+            store_id = (item_id - 1) // args.items_per_store + 1
+            tag_id = (store_id - 1) * args.tags_per_store + pick.randint(1, args.tags_per_store)
+            return "POST", f"/item/{item_id}/tag/{tag_id}", None, None
+        if route == "POST /login":
+            return "POST", "/login", credentials, None
+        if route == "POST /refresh":
+            return "POST", "/refresh", None, tokens("refresh") #refreshing revokes the token, so every call needs a new one
+        if route == "POST /logout":
+            return "POST", "/logout", None, tokens("access")
+        raise ValueError(route)
+
+    mix = MIXES[args.mix]
+    plan = rng.choices(list(mix), weights=list(mix.values()), k=args.requests)
+    results = {route: {"latencies": [], "queries": [], "errors": 0} for route in mix}
+    next_request = [0]
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                number = next_request[0]
+                next_request[0] += 1
+            if number >= len(plan):
+                return
+            route = plan[number]
+            method, path, body, token = build(route, number)
+            headers = {"Content-Type": "application/json"}
+            if token:
+                headers["Authorization"] = f"Bearer {token}"
+            data = json.dumps(body).encode() if body is not None else None
+            request = urllib.request.Request(base + path, data=data, headers=headers, method=method)
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    query_count = int(response.headers.get("X-Query-Count", 0))
+                    failed = False
+            except urllib.error.HTTPError as error:
+                error.read()
+                query_count = int(error.headers.get("X-Query-Count", 0))
+                failed = True
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                result = results[route]
+                result["latencies"].append(elapsed)
+                result["queries"].append(query_count)
+                result["errors"] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    server.shutdown()
+    if db_file is not None:
+        os.unlink(db_file.name)
+
+    def summary(latencies, queries, errors, seconds):
+        latencies = sorted(latencies)
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / seconds, 2) if seconds else None,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        }
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "database": dialect,
+            "mix": args.mix,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "dataset": {
+                "stores": args.stores, "items": item_count, "tags": tag_count,
+                "tags_per_item": args.tags_per_item,
+            },
+            "wall_seconds": round(wall, 3),
+        },
+        "total": summary(
+            [l for r in results.values() for l in r["latencies"]],
+            [q for r in results.values() for q in r["queries"]],
+            sum(r["errors"] for r in results.values()),
+            wall,
+        ),
+        #per route throughput is that route's share of the run, not what it would do on its own
+        "routes": {
+            route: summary(r["latencies"], r["queries"], r["errors"], wall)
+            for route, r in sorted(results.items()) if r["latencies"]
+        },
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
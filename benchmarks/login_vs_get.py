@@ -0,0 +1,130 @@
+"""
+Login throughput versus GET latency.
+
+Starts the app in a threaded local server on a throwaway SQLite file, measures GET /store
+latency on its own, then again while several threads keep calling /login, and prints the
+numbers as JSON. Run it with different PASSWORD_HASH_WORKERS / PASSWORD_HASH_ROUNDS to see
+how the hashing pool protects the cheap requests, e.g.
+
+    python benchmarks/login_vs_get.py --login-threads 16 --hash-workers 2
+
+The login rate limits are off so every login really hashes. --max-auth-in-flight sets
+ADMISSION_MAX_AUTH_IN_FLIGHT (admission.py), logins shed with a 503 are counted apart.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def request(url, data=None):
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req) as response:
+        return response.read()
+
+
+def get_latencies(url, seconds):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        request(url)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        "max_ms": round(latencies[-1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--login-threads", type=int, default=8)
+    parser.add_argument("--hash-workers", type=int, default=2)
+    parser.add_argument("--rounds", type=int, default=29000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--max-auth-in-flight", type=int, default=0, help="0: no admission control on /login")
+    args = parser.parse_args()
+
+    os.environ["PASSWORD_HASH_WORKERS"] = str(args.hash_workers)
+    os.environ["PASSWORD_HASH_ROUNDS"] = str(args.rounds)
+    os.environ["JWT_BLOCKLIST_BACKEND"] = "memory"
+    os.environ["LOGIN_LIMIT_PER_USERNAME"] = os.environ["LOGIN_LIMIT_PER_IP"] = os.environ["REGISTER_LIMIT_PER_IP"] = "0"
+    os.environ["ADMISSION_MAX_AUTH_IN_FLIGHT"] = str(args.max_auth_in_flight)
+    os.environ["ADMISSION_MAX_WRITES_IN_FLIGHT"] = "0" #logins are POSTs, only the auth budget should shed them here
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR) #no access log lines in the output
+    from werkzeug.serving import make_server
+    from app import create_app
+    from db import db
+
+    db_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+    app = create_app(f"sqlite:///{db_file.name}")
+    with app.app_context():
+        db.create_all()
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    credentials = {"username": "bench", "password": "bench-password"}
+    request(base + "/register", credentials)
+    request(base + "/store", {"name": "bench store"})
+
+    idle = get_latencies(base + "/store", args.seconds)
+
+    logins = [0]
+    shed = [0]
+    stop = threading.Event()
+
+    def login_loop():
+        while not stop.is_set():
+            try:
+                request(base + "/login", credentials)
+                logins[0] += 1
+            except urllib.error.HTTPError as error:
+                if error.code != 503:
+                    raise
+                shed[0] += 1
+                time.sleep(float(error.headers.get("Retry-After", 1)) / 10) #a real client would wait the whole Retry-After
+
+    threads = [threading.Thread(target=login_loop) for _ in range(args.login_threads)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    loaded = get_latencies(base + "/store", args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    server.shutdown()
+    os.unlink(db_file.name)
+
+    print(json.dumps({
+        "config": vars(args),
+        "get_store_idle": summary(idle),
+        "get_store_during_logins": summary(loaded),
+        "logins_per_second": round(logins[0] / elapsed, 2),
+        "logins_shed_per_second": round(shed[0] / elapsed, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Marshmallow versus the compiled serializer (serializers.py).
+
+Seeds a throwaway SQLite file, loads the rows the list endpoints return and dumps them with
+both paths: schema.dump() alone, and the full jsonify of the response body. Checks that the
+bytes are identical and prints the timings as JSON, e.g.
+
+    python benchmarks/serializer.py --rows 500 --repeat 50
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, round(statistics.median(timings), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500, help="items (and stores) per dump, like ?limit=")
+    parser.add_argument("--tags-per-item", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    os.environ.setdefault("JWT_BLOCKLIST_BACKEND", "memory")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    from flask import jsonify
+
+    from app import create_app
+    from db import db
+    from models import ItemModel, StoreModel
+    from resources.item import ITEM_LOAD_OPTIONS
+    from resources.store import STORE_LOADERS
+    from schemas import ItemSchema, ItemPageSchema, StorePageSchema
+    from seed import generate
+    from serializers import FAST_SERIALIZER
+
+    db_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+    app = create_app(f"sqlite:///{db_file.name}")
+    results = {}
+    try:
+        with app.app_context(), app.test_request_context():
+            db.create_all()
+            generate(args.rows, 10, tags_per_store=10, tags_per_item=args.tags_per_item, seed=1)
+            items = ItemModel.query.options(*ITEM_LOAD_OPTIONS).order_by(ItemModel.id).limit(args.rows).all()
+            stores = StoreModel.query.options(*STORE_LOADERS.values()).order_by(StoreModel.id).limit(args.rows).all()
+
+            cases = {
+                "ItemSchema(many=True)": (ItemSchema(many=True), items),
+                "ItemPageSchema": (ItemPageSchema(), {"items": items, "next": None}),
+                "StorePageSchema": (StorePageSchema(), {"stores": stores, "next": None}),
+            }
+            for name, (schema, obj) in cases.items():
+                case = {}
+                for path, min_rows in (("marshmallow", 0), ("compiled", 1)):
+                    FAST_SERIALIZER.min_rows = min_rows
+                    _, case[f"{path}_dump_ms"] = timed(lambda: schema.dump(obj), args.repeat)
+                    body, case[f"{path}_response_ms"] = timed(lambda: jsonify(schema.dump(obj)).get_data(), args.repeat)
+                    case[f"{path}_bytes"] = body
+                case["identical"] = case.pop("marshmallow_bytes") == case.pop("compiled_bytes")
+                case["speedup"] = round(case["marshmallow_response_ms"] / case["compiled_response_ms"], 2)
+                results[name] = case
+    finally:
+        os.unlink(db_file.name)
+
+    print(json.dumps({"rows": args.rows, "tags_per_item": args.tags_per_item, "results": results}, indent=2))
+    if not all(case["identical"] for case in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,134 @@
 """
 blocklist.py
 
-This file just contains the blocklist of the JWT tokens. It will be imported by the app
+This file contains the blocklist of the JWT tokens. It will be imported by the app
 and the logout resource so that tokens can be added to the blocklist when the user logs out.
 
+The revoked tokens are kept in a backend that is picked with JWT_BLOCKLIST_BACKEND:
+  - "database" (default): a table shared by every gunicorn worker
+  - "memory": a dict inside this process, fine for development and tests
+Either way an entry is dropped once the token's "exp" has passed, after that the token
+is rejected for being expired anyway.
+
+Every authenticated request asks the blocklist, so BLOCKLIST keeps two small caches in
+front of the backend: tokens it knows are revoked (safe to keep until they expire) and
+tokens it checked recently and found not revoked. The second one means a logout done
+in another worker can take up to JWT_BLOCKLIST_CACHE_SECONDS to be seen here, set it to 0
+to always ask the backend.
 """
+import threading
+import time
+
+from sqlalchemy import exists
+
+from db import db
+from metrics import BLOCKLIST_CHECKS, BLOCKLIST_REVOCATIONS
+from models import BlocklistModel
+
+
+def _expired(expires_at, now):
+    return expires_at is not None and expires_at < now #tokens without "exp" never expire
+
+
+class MemoryBlocklist:
+    def __init__(self):
+        self.tokens = {} #jti -> exp
+        self.lock = threading.Lock() #gunicorn runs several threads per worker
+
+    def add(self, jti, expires_at):
+        now = time.time()
+        with self.lock:
+            for old_jti, old_expires_at in list(self.tokens.items()):
+                if _expired(old_expires_at, now):
+                    del self.tokens[old_jti]
+            self.tokens[jti] = expires_at
+
+    def contains(self, jti):
+        expires_at = self.tokens.get(jti, False)
+        return expires_at is not False and not _expired(expires_at, time.time())
+
+
+class DatabaseBlocklist:
+    def add(self, jti, expires_at):
+        now = int(time.time())
+        BlocklistModel.query.filter(BlocklistModel.expires_at < now).delete() #clean up while we are writing anyway
+        db.session.merge(BlocklistModel(jti=jti, expires_at=expires_at))
+        db.session.commit()
+
+    def contains(self, jti):
+        now = int(time.time())
+        query = exists().where(
+            BlocklistModel.jti == jti,
+            (BlocklistModel.expires_at == None) | (BlocklistModel.expires_at >= now)
+        )
+        return db.session.query(query).scalar()
+
+
+BACKENDS = {"memory": MemoryBlocklist, "database": DatabaseBlocklist}
+
+
+class Blocklist:
+    max_cached = 10000 #upper bound for each cache, we sweep (and if needed clear) when it is reached
+
+    def __init__(self):
+        self.backend = MemoryBlocklist()
+        self.cache_seconds = 0
+        self.revoked = {} #jti -> exp
+        self.not_revoked = {} #jti -> time we asked the backend
+        self.lock = threading.Lock() #for _remember() and _sweep(), the request threads share the caches
+
+    def init_app(self, app):
+        self.backend = BACKENDS[app.config["JWT_BLOCKLIST_BACKEND"]]()
+        self.cache_seconds = app.config["JWT_BLOCKLIST_CACHE_SECONDS"]
+        self.revoked = {}
+        self.not_revoked = {}
+
+    def add(self, jti, expires_at=None):
+        self.backend.add(jti, expires_at)
+        BLOCKLIST_REVOCATIONS.inc()
+        self._remember(self.revoked, jti, expires_at)
+        with self.lock:
+            self.not_revoked.pop(jti, None)
+
+    def is_revoked(self, jti, expires_at=None):
+        now = time.time()
+        if jti in self.revoked:
+            BLOCKLIST_CHECKS.labels("cache", "revoked").inc()
+            return True
+        checked_at = self.not_revoked.get(jti)
+        if checked_at is not None and now - checked_at < self.cache_seconds:
+            BLOCKLIST_CHECKS.labels("cache", "valid").inc()
+            return False
+
+        if self.backend.contains(jti):
+            BLOCKLIST_CHECKS.labels("backend", "revoked").inc()
+            self._remember(self.revoked, jti, expires_at)
+            return True
+        BLOCKLIST_CHECKS.labels("backend", "valid").inc()
+        if self.cache_seconds:
+            self._remember(self.not_revoked, jti, now)
+        return False
+
+    def __contains__(self, jti):
+        return self.is_revoked(jti)
+
+    def _remember(self, cache, jti, value):
+        with self.lock:
+            if len(cache) >= self.max_cached:
+                self._sweep()
+                if len(cache) >= self.max_cached:
+                    cache.clear() #they are only caches, the backend still knows everything
+            cache[jti] = value
+
+    def _sweep(self):
+        #Called with self.lock held. Lookups in is_revoked() don't take it, a single dict get is atomic.
+        now = time.time()
+        for jti, expires_at in list(self.revoked.items()):
+            if _expired(expires_at, now):
+                del self.revoked[jti]
+        for jti, checked_at in list(self.not_revoked.items()):
+            if now - checked_at >= self.cache_seconds:
+                del self.not_revoked[jti]
+
 
-BLOCKLIST = set() #you might want to use something like Redis for Blocklist
\ No newline at end of file
+BLOCKLIST = Blocklist()
@@ -0,0 +1,161 @@
+"""
+cache.py
+
+An opt-in read-through cache for the hot GET endpoints (Item.get, Store.get, Tag.get and
+TagsInStore.get). On a hit we send back the JSON body we produced last time, so neither the
+database nor marshmallow is touched. Turn it on with RESPONSE_CACHE_ENABLED=1.
+
+Entries are keyed per resource, e.g. "store:3" or "store_tags:3", and the POST/PUT/DELETE
+handlers in resources/ call RESPONSE_CACHE.invalidate() with the keys their write affects,
+right after the commit.
+
+The default "memory" backend is an LRU inside each process (RESPONSE_CACHE_MAX_SIZE entries,
+each living RESPONSE_CACHE_TTL seconds). With several gunicorn workers a write only clears
+the cache of the worker that handled it, the others catch up when the TTL runs out. To share
+the cache (and the invalidations) between workers set RESPONSE_CACHE_BACKEND to
+"package.module:ClassName" of a class with the same get/set/delete/clear/__len__ methods as
+MemoryCache, e.g. one backed by Redis.
+"""
+import functools
+import importlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, request
+
+from metrics import CACHE_REQUESTS, CACHE_INVALIDATIONS
+
+
+class MemoryCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict() #key -> (expires_at, value), oldest used first
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False) #throw away the least recently used entry
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def _load_backend(name):
+    if name == "memory":
+        return MemoryCache
+    module_name, class_name = name.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class ResponseCache:
+    def __init__(self):
+        self.enabled = False
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        self.enabled = app.config["RESPONSE_CACHE_ENABLED"]
+        backend_class = _load_backend(app.config["RESPONSE_CACHE_BACKEND"])
+        self.backend = backend_class(app.config["RESPONSE_CACHE_MAX_SIZE"], app.config["RESPONSE_CACHE_TTL"])
+        self.hits = self.misses = self.invalidations = 0
+
+    def cached(self, resource):
+        #Put it between @jwt_required (so auth still runs) and @blp.response (so we keep the serialized body)
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.args: #e.g. ?fields=, those variants are not cached
+                    return func(*args, **kwargs)
+
+                key = ":".join([resource] + [str(kwargs[name]) for name in sorted(kwargs)])
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    CACHE_REQUESTS.labels("hit").inc()
+                    body, mimetype, etag = entry
+                    response = Response(body, status=200, mimetype=mimetype)
+                    response.set_etag(etag) #so a conditional GET doesn't have to hash the body again
+                    response.headers["X-Cache"] = "HIT"
+                    return response
+
+                self.misses += 1
+                CACHE_REQUESTS.labels("miss").inc()
+                response = func(*args, **kwargs)
+                if response.status_code == 200: #404s and errors are not cached
+                    response.add_etag()
+                    self.backend.set(key, (response.get_data(), response.mimetype, response.get_etag()[0]))
+                response.headers["X-Cache"] = "MISS"
+                return response
+            return wrapper
+        return decorator
+
+    def invalidate(self, *keys):
+        if self.enabled and keys:
+            self.backend.delete(*keys)
+            self.invalidations += len(keys)
+            CACHE_INVALIDATIONS.inc(len(keys))
+
+    def clear(self):
+        #Drops everything, for writes too wide to list their keys (POST /item/import)
+        if self.enabled:
+            self.backend.clear()
+            CACHE_INVALIDATIONS.inc()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "size": len(self.backend) if self.backend is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+#Keys of every cached response that shows the given row. Call these before deleting the row,
+#afterwards its relationships are gone.
+def item_cache_keys(item):
+    keys = [f"item:{item.id}", f"store:{item.store_id}"]
+    for tag in item.tags:
+        keys += [f"tag:{tag.id}", f"store_tags:{tag.store_id}"]
+    return keys
+
+def tag_cache_keys(tag):
+    keys = [f"tag:{tag.id}", f"store:{tag.store_id}", f"store_tags:{tag.store_id}"]
+    keys += [f"item:{item.id}" for item in tag.items]
+    return keys
+
+def store_cache_keys(store):
+    keys = [f"store:{store.id}", f"store_tags:{store.id}"]
+    keys += [f"item:{item.id}" for item in store.items]
+    keys += [f"tag:{tag.id}" for tag in store.tags]
+    return keys
+
+
+RESPONSE_CACHE = ResponseCache()
@@ -1,4 +1,197 @@
 #We will write simple SQLAlchemy model
+import os
+import threading
+import time
+
+from flask import current_app, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, insert, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Mapper
+from sqlalchemy.pool import QueuePool
+
+from metrics import DB_POOL_CHECKOUTS, DB_POOL_TIMEOUTS, DB_POOL_WAIT
+
+
+
+def _shards():
+    return current_app.extensions["shards"] #the router of shards.py
+
+
+class RoutingSession(ShardedSession, Session):
+    #Picks the database of every statement. The rows of stores, items and tags are on the shard the router of
+    #shards.py picks. Everything else, and everything when there is only one shard, is on the primary, or inside
+    #a @REPLICAS.read_only handler on the replica it picked (replicas.py), flushes excepted.
+    def __init__(self, db, **kwargs):
+        super().__init__(
+            shard_chooser=lambda *args, **kw: _shards().shard_for_instance(*args, **kw),
+            identity_chooser=lambda *args, **kw: _shards().shards_for_identity(*args, **kw),
+            execute_chooser=lambda orm_context: _shards().shards_for_statement(orm_context),
+            db=db,
+            **kwargs
+        )
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        if shard_id is None:
+            mapper = inspect(mapper, raiseerr=False) if mapper is not None else None
+            if isinstance(mapper, Mapper):
+                shard_id = self._choose_shard_and_assign(mapper, instance, clause=clause)
+            else: #plain SQL, e.g. text(): the shard we are on
+                shard_id = _shards().current() or 0
+        if shard_id:
+            return _shards().engine(shard_id)
+
+        if not self._flushing and has_request_context():
+            engine = g.get("read_engine")
+            if engine is not None:
+                return engine
+        return Session.get_bind(self, mapper=mapper, clause=clause, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+class PoolStats:
+    #Counters for the connection pool of this worker process
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0 #every time a request took a connection from the pool
+        self.wait_seconds = 0.0 #total time spent waiting for one (includes opening new connections)
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0 #times the pool was exhausted for longer than DB_POOL_TIMEOUT
+
+    def record(self, seconds, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        (DB_POOL_TIMEOUTS if timed_out else DB_POOL_CHECKOUTS).inc() #the same numbers for /metrics
+        DB_POOL_WAIT.observe(seconds)
+
+
+POOL_STATS = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    #The normal QueuePool, it just measures how long getting a connection takes
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            POOL_STATS.record(time.perf_counter() - start, timed_out=True)
+            raise
+        POOL_STATS.record(time.perf_counter() - start)
+        return connection
+
+
+def _is_memory_sqlite(db_url):
+    return db_url.startswith("sqlite") and (db_url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in db_url)
+
+
+def engine_options(db_url):
+    #Pool settings from the environment. An in-memory SQLite database lives in a single connection, so no pool for it.
+    if _is_memory_sqlite(db_url):
+        return {}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)), #connections kept open
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)), #extra connections allowed when all of those are busy
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)), #seconds to wait for a free connection before giving up
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)), #reconnect connections older than this (seconds)
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes"), #check a connection is alive before using it
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    #WAL lets readers carry on while somebody writes, NORMAL is safe with WAL and much faster than FULL,
+    #and busy_timeout makes a writer wait for the lock instead of failing straight away with "database is locked".
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+    cursor.close()
+
+
+def configure_engine(engine):
+    if engine.dialect.name == "sqlite" and not _is_memory_sqlite(str(engine.url)):
+        event.listen(engine, "connect", set_sqlite_pragmas)
+
+
+def all_engines():
+    #The primary, the replicas (replicas.py) and the shards (shards.py), for the listeners that have to see every query
+    return [db.engine, *current_app.extensions["replicas"], *current_app.extensions["shard_engines"]]
+
+
+def pool_status(engine):
+    pool = engine.pool
+    status = {
+        "pool": type(pool).__name__,
+        "checkouts": POOL_STATS.checkouts,
+        "timeouts": POOL_STATS.timeouts,
+        "wait_seconds_total": round(POOL_STATS.wait_seconds, 6),
+        "wait_seconds_max": round(POOL_STATS.max_wait_seconds, 6),
+    }
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+        })
+    return status
+
+
+def insert_ignoring_conflicts(model):
+    #INSERT ... ON CONFLICT DO NOTHING on SQLite and Postgres, rows that would break a unique constraint are skipped.
+    #Other databases get a plain INSERT, so the caller still has to handle IntegrityError there.
+    #model can also be a Table, which is what an executemany needs (see shards.py)
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing()
+    return insert(model)
+
+
+def upsert(model, index_elements, update_columns, **also_set):
+    #model or Table, like insert_ignoring_conflicts
+    #INSERT ... ON CONFLICT (index_elements) DO UPDATE SET each of update_columns to the value that was sent,
+    #plus also_set (column=SQL expression, e.g. version=ItemModel.version + 1), on SQLite and Postgres.
+    #None on other databases, the caller has to read then write there.
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(model)
+    elif dialect == "sqlite":
+        statement = sqlite.insert(model)
+    else:
+        return None
+    return statement.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={**{column: statement.excluded[column] for column in update_columns}, **also_set}
+    )
+
 
-db = SQLAlchemy()
\ No newline at end of file
+def advance_id_sequence(model, inserted_id):
+    #Rows inserted with an explicit id don't move a Postgres sequence, so the next INSERT without one would be
+    #handed that id again. SQLite carries on from the largest id by itself.
+    if db.engine.dialect.name != "postgresql":
+        return
+    db.session.execute(
+        text(
+            "SELECT setval(seq, :id) FROM (SELECT pg_get_serial_sequence(:table, 'id') AS seq) AS sequence "
+            "WHERE :id > coalesce(pg_sequence_last_value(seq::regclass), 0)"
+        ),
+        {"id": inserted_id, "table": model.__tablename__}
+    )
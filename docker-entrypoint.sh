@@ -2,4 +2,12 @@
 
  flask db upgrade
 
+ #Every gunicorn worker writes its metrics in here and /metrics adds them up, see metrics.py
+ export PROMETHEUS_MULTIPROC_DIR=/tmp/prometheus
+ rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+ #The login rate limits are shared by the workers through this file, see ratelimit.py
+ export RATE_LIMIT_BACKEND=file RATE_LIMIT_FILE=/tmp/ratelimit.db
+ rm -f "$RATE_LIMIT_FILE" "$RATE_LIMIT_FILE-wal" "$RATE_LIMIT_FILE-shm"
+
  exec gunicorn --bind 0.0.0.0:80 "app:create_app()"
\ No newline at end of file
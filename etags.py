@@ -0,0 +1,142 @@
+"""
+etags.py
+
+Conditional requests for the resources.
+
+Every GET response gets a strong ETag. When the client sends it back in If-None-Match and
+nothing changed we answer 304 Not Modified with no body.
+
+By default the ETag is the sha1 of the JSON body, so it is only known once the handler has
+loaded and dumped everything: a 304 saves the bandwidth but costs the server as much as a
+200. The exception is a response from the response cache (cache.py), its ETag was stored with
+it. GET /item/<id>, /store/<id> and /tag/<id> pass etag= to @conditional instead: one narrow
+query for the columns their body is made of (item_etag, store_etag, tag_etag below), run
+before the handler. A matching If-None-Match then answers 304 without loading the ORM objects
+or running marshmallow, and a miss costs that one query on top of the GET.
+
+PUT and DELETE accept If-Match: the ETag the client got from the GET of that resource.
+If the resource has changed since then we refuse with 412 instead of overwriting somebody
+else's change. Without If-Match they behave like before.
+
+The If-Match check of those three uses the same functions, so a DELETE of a store doesn't
+dump all its items just to compare an ETag.
+
+Comparing the ETag and then writing is a read then a write, another request can write in
+between. Items, the one resource that gets updated, have a version column for that: the
+handlers remember the version they checked the ETag against and their UPDATE/DELETE only
+touches the row while it still has that version, 412 when it doesn't.
+"""
+import functools
+import hashlib
+
+from flask import Response, jsonify, request
+from flask_smorest import abort
+from sqlalchemy import literal, null, select, union_all
+
+from db import db
+from models import ItemModel, ItemTags, StoreModel, TagModel
+from shards import SHARDS
+
+
+def conditional(func=None, *, etag=None):
+    #Goes right under @jwt_required (or first if there is none), above @RESPONSE_CACHE.cached and @blp.response
+    #etag: a function of the URL arguments giving the ETag of the resource before the handler runs, None if it doesn't exist
+    if func is None:
+        return functools.partial(conditional, etag=etag)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        current = etag(**kwargs) if etag else None
+        if current is not None:
+            current = _with_query_string(current) #?fields= and ?exclude= give another body
+            if request.if_none_match.contains(current):
+                response = Response(status=304)
+                response.set_etag(current)
+                return response
+        response = func(*args, **kwargs)
+        if response.status_code == 200:
+            if current is not None:
+                response.set_etag(current) #read before the handler: if the row changed in between, the next request just gets a 200
+            response.add_etag() #does nothing if the cache or etag= already set it
+            response.make_conditional(request) #turns it into a 304 when If-None-Match matches
+        return response
+    return wrapper
+
+
+def current_etag(obj, schema):
+    #The ETag a GET of obj would have, the body is built exactly like @blp.response does it
+    response = jsonify(schema.dump(obj))
+    response.add_etag()
+    return response.get_etag()[0]
+
+
+def check_if_match(current):
+    #current: a function giving the ETag the resource has now (None when it's gone), only called when there is an If-Match
+    if not request.if_match: #no header, nothing to check
+        return
+    etag = current()
+    if etag is None or not request.if_match.contains(etag):
+        abort(412, message="The resource has changed since you fetched it. Get it again and retry.")
+
+
+def _with_query_string(etag):
+    if not request.query_string:
+        return etag
+    return hashlib.sha1(etag.encode() + b"?" + request.query_string).hexdigest()
+
+
+def _digest(rows):
+    return hashlib.sha1(repr([tuple(row) for row in rows]).encode()).hexdigest()
+
+
+def _on_shard_of(row_id, query):
+    #Runs query() on the shard of a store, item or tag id, None when no shard has that id
+    shard = SHARDS.of_id(row_id)
+    if shard is None:
+        return None
+    with SHARDS.use(shard):
+        return query()
+
+
+def item_etag(item_id):
+    #Everything GET /item/<id> shows, in one row per tag: the item, its store and its tags. version makes
+    #every write change the ETag, even one that writes the same values.
+    statement = (
+        select(ItemModel.name, ItemModel.price, ItemModel.version, StoreModel.id, StoreModel.name, TagModel.id, TagModel.name)
+        .join(StoreModel, StoreModel.id == ItemModel.store_id)
+        .outerjoin(ItemTags, ItemTags.item_id == ItemModel.id)
+        .outerjoin(TagModel, TagModel.id == ItemTags.tag_id)
+        .where(ItemModel.id == item_id)
+        .order_by(TagModel.id)
+    )
+    rows = _on_shard_of(item_id, lambda: db.session.execute(statement).all())
+    return _digest(rows) if rows else None
+
+
+def store_etag(store_id):
+    #The store, the name, price and version of its items and its tags, in one UNION ALL instead of the ORM loads
+    statement = union_all(
+        select(literal("store"), StoreModel.id, StoreModel.name, null(), null()).where(StoreModel.id == store_id),
+        select(literal("item"), ItemModel.id, ItemModel.name, ItemModel.price, ItemModel.version).where(ItemModel.store_id == store_id),
+        select(literal("tag"), TagModel.id, TagModel.name, null(), null()).where(TagModel.store_id == store_id),
+    )
+    return _union_etag(store_id, statement, "store")
+
+
+def tag_etag(tag_id):
+    #The tag with its store, and the name, price and version of its items
+    statement = union_all(
+        select(literal("tag"), TagModel.id, TagModel.name, null(), StoreModel.id, StoreModel.name)
+        .join(StoreModel, StoreModel.id == TagModel.store_id).where(TagModel.id == tag_id),
+        select(literal("item"), ItemModel.id, ItemModel.name, ItemModel.price, ItemModel.version, null())
+        .join(ItemTags, ItemTags.item_id == ItemModel.id).where(ItemTags.tag_id == tag_id),
+    )
+    return _union_etag(tag_id, statement, "tag")
+
+
+def _union_etag(row_id, statement, kind):
+    #The rows of a UNION ALL come in no particular order, None when the resource itself isn't there
+    rows = _on_shard_of(row_id, lambda: sorted(db.session.execute(statement).all(), key=lambda row: (row[0], row[1])))
+    if not rows or not any(row[0] == kind for row in rows):
+        return None
+    return _digest(rows)
@@ -0,0 +1,39 @@
+"""
+fieldsets.py
+
+Sparse fieldsets: GET /item?fields=id,name or GET /store/1?exclude=items. The names are the
+fields of the response schema, nested ones with a dot (fields=id,store.name). Only what was
+asked for is dumped, and only what is needed for it is loaded: the columns of the requested
+fields and the relationships that are actually dumped. So ?fields=id,name on /store never
+touches the items or tags of the stores.
+"""
+from flask_smorest import abort
+from sqlalchemy.orm import load_only
+
+
+def fieldset_schema(schema_class, fieldset, many=False):
+    #None when the client didn't ask for a fieldset, then the handler carries on as usual
+    if not fieldset:
+        return None
+    try:
+        return schema_class(only=fieldset.get("only"), exclude=fieldset.get("exclude", ()), many=many)
+    except ValueError as error: #marshmallow's "Invalid fields for <Schema>: ..."
+        abort(400, message=str(error))
+
+
+def fieldset_load_options(model, schema, loaders):
+    #loaders maps relationship name -> loader option (selectinload...). Without a schema we load everything.
+    if schema is None:
+        return tuple(loaders.values())
+
+    mapper = model.__mapper__
+    columns = {model.id} #always needed, keyset pagination orders by it
+    options = []
+    for name in schema.dump_fields:
+        if name in loaders:
+            options.append(loaders[name])
+            for column in mapper.relationships[name].local_columns: #e.g. store_id for the store of an item
+                columns.add(getattr(model, mapper.get_property_by_column(column).key))
+        elif name in mapper.column_attrs:
+            columns.add(getattr(model, name))
+    return (load_only(*columns), *options)
@@ -0,0 +1,14 @@
+#gunicorn reads this file by itself when it starts in this folder
+import os
+
+from prometheus_client import multiprocess
+
+#Threads per worker. More than 1 makes gunicorn use its gthread worker instead of the sync one (see README.md).
+#admission.py keeps some of them free for the GETs, with the sync worker (one request at a time) it has nothing to work with.
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+
+def child_exit(server, worker):
+    #A worker is gone, take its live gauges (requests in flight, connections checked out) out of /metrics
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
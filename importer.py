@@ -0,0 +1,290 @@
+"""
+importer.py
+
+Bulk import of a supplier catalog: `flask import-items catalog.csv` or POST /item/import.
+
+CSV columns: name, price, store (the store's name) or store_id, and tags (tag names separated
+by |). NDJSON: one object per line with the same keys, tags as a list. Other columns are
+ignored.
+
+The file goes through a chain of generators, read -> resolve + validate -> chunk, so only one
+chunk of rows is in memory whatever the size of the file. Store and tag names are turned
+into ids with dicts loaded once at the start; stores and tags that don't exist yet are created
+(unless create_missing is off, then those rows are rejected). Every row is validated with
+ItemSchema like a POST /item would be.
+
+Each chunk is one transaction: its items, their tag links and the progress of the job
+(import_jobs) are committed together. Running the same file again (same sha256) carries on
+after the last committed chunk, and a file that was imported completely is not imported twice.
+With shards (shards.py) the items of a chunk go to the shards of their stores and the commit
+is one per database, a crash in the middle of one can leave rows whose progress wasn't saved;
+the run that resumes reports them as names that already exist instead of importing them twice.
+A chunk that clashes with a concurrent write (somebody created one of its names in between) is
+rolled back and the run stops there, unfinished, with the lines in the errors.
+"""
+import csv
+import hashlib
+import io
+import itertools
+import json
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from marshmallow import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from shards import SHARDS
+from models import ItemModel, ItemTags, ImportJobModel, StoreModel, TagModel
+from schemas import ItemSchema
+
+FORMATS = ("csv", "ndjson")
+TAG_SEPARATOR = "|"
+MAX_REPORTED_ERRORS = 100 #the first errors are returned with their line number, the rest are only counted
+
+ITEM_SCHEMA = ItemSchema()
+
+
+def file_format(filename, fmt=None):
+    if fmt:
+        return fmt
+    extension = filename.rsplit(".", 1)[-1].lower()
+    if extension == "csv":
+        return "csv"
+    if extension in ("ndjson", "jsonl"):
+        return "ndjson"
+    raise ValueError(f"Can't tell the format of {filename!r}, say csv or ndjson.")
+
+
+def file_key(binary):
+    digest = hashlib.sha256()
+    for block in iter(lambda: binary.read(1 << 20), b""):
+        digest.update(block)
+    binary.seek(0)
+    return digest.hexdigest()
+
+
+def read_rows(binary, fmt):
+    #(line number, row) for every row of the file, row is None when the line isn't a JSON object
+    text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+class Lookups:
+    #name -> id for the stores and name -> (id, store id) for the tags (tag names are unique across stores),
+    #new ones are added as we create them
+    def __init__(self, create_missing):
+        self.create_missing = create_missing
+        self.stores = dict(db.session.execute(select(StoreModel.name, StoreModel.id)).all())
+        self.store_ids = set(self.stores.values())
+        self.tags = {name: (tag_id, store_id) for tag_id, store_id, name in db.session.execute(select(TagModel.id, TagModel.store_id, TagModel.name))}
+
+    def store_id(self, row):
+        if row.get("store_id") not in (None, ""):
+            try:
+                store_id = int(row["store_id"])
+            except (TypeError, ValueError):
+                return None
+            return store_id if store_id in self.store_ids else None
+        name = (row.get("store") or "").strip()
+        if not name:
+            return None
+        if name not in self.stores and self.create_missing:
+            #flushed, not committed: it goes in with the chunk this row belongs to
+            store = StoreModel(name=name)
+            db.session.add(store)
+            db.session.flush()
+            self.stores[name] = store.id
+            self.store_ids.add(store.id)
+        return self.stores.get(name)
+
+    def tag_ids(self, store_id, names):
+        #The ids, or an error message
+        ids = []
+        for name in names:
+            if name not in self.tags:
+                if not self.create_missing:
+                    return f"Tag {name!r} not found."
+                tag = TagModel(name=name, store_id=store_id)
+                db.session.add(tag)
+                db.session.flush()
+                self.tags[name] = (tag.id, store_id)
+            tag_id, tag_store_id = self.tags[name]
+            if tag_store_id != store_id:
+                return f"Tag {name!r} belongs to another store."
+            ids.append(tag_id)
+        return ids
+
+
+def _tag_names(row):
+    tags = row.get("tags") or []
+    if isinstance(tags, str):
+        tags = tags.split(TAG_SEPARATOR)
+    return list(dict.fromkeys(str(tag).strip() for tag in tags if str(tag).strip())) #unique, in order
+
+
+def validate_rows(rows, lookups):
+    #(line number, item data, tag ids, error message), item data is None for a rejected row
+    for line_number, row in rows:
+        if row is None:
+            yield line_number, None, None, "Not a JSON object."
+            continue
+        store_id = lookups.store_id(row)
+        if store_id is None:
+            yield line_number, None, None, "Store not found."
+            continue
+        try:
+            item_data = ITEM_SCHEMA.load({"name": row.get("name"), "price": row.get("price"), "store_id": store_id})
+        except ValidationError as error:
+            yield line_number, None, None, json.dumps(error.messages, sort_keys=True)
+            continue
+        tag_ids = lookups.tag_ids(store_id, _tag_names(row))
+        if isinstance(tag_ids, str):
+            yield line_number, None, None, tag_ids
+            continue
+        yield line_number, item_data, tag_ids, None
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+def write_chunk(job, chunk, errors):
+    #One transaction: the items of the chunk, their tag links and the job's progress
+    names = {item_data["name"] for _, item_data, _, _ in chunk if item_data}
+    taken = set(db.session.scalars(select(ItemModel.name).where(ItemModel.name.in_(names)))) if names else set()
+
+    rows, rejected = [], 0
+    for line_number, item_data, tag_ids, error in chunk:
+        if item_data and item_data["name"] in taken:
+            error = "An item with that name already exists."
+        if error:
+            rejected += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": line_number, "message": error})
+            continue
+        taken.add(item_data["name"])
+        rows.append((item_data, tag_ids))
+
+    created = 0
+    #The tables and not the models: the ORM can't run an executemany on a ShardedSession (shards.py)
+    items = ItemModel.__table__
+    for shard, shard_rows in SHARDS.split(rows, lambda row: row[0]["store_id"]):
+        with SHARDS.use(shard):
+            ids = db.session.scalars(
+                insert(items).returning(items.c.id, sort_by_parameter_order=True),
+                [item_data for item_data, _ in shard_rows]
+            ).all()
+            links = [{"item_id": item_id, "tag_id": tag_id} for item_id, (_, tag_ids) in zip(ids, shard_rows) for tag_id in tag_ids]
+            if links:
+                db.session.execute(insert(ItemTags.__table__), links)
+        created += len(ids)
+
+    job.rows_done += len(chunk)
+    job.items_created += created
+    job.errors += rejected
+    db.session.commit()
+
+
+def import_items(binary, source, fmt, chunk_size=None, create_missing=True, progress=None):
+    #binary: the file opened in binary mode (it is read twice, once for the sha256). Returns a summary dict.
+    chunk_size = chunk_size or current_app.config["IMPORT_CHUNK_SIZE"]
+    key = file_key(binary)
+    job = ImportJobModel.query.filter_by(key=key).first()
+    if job is None:
+        job = ImportJobModel(key=key, source=source[:255], rows_done=0, items_created=0, errors=0, finished=False)
+        db.session.add(job)
+        db.session.commit()
+
+    already_imported = job.finished
+    resumed_from = job.rows_done
+    errors = []
+    start = time.perf_counter()
+    if not job.finished:
+        try:
+            rows = itertools.islice(read_rows(binary, fmt), resumed_from, None) #skip what earlier runs committed
+            lookups = Lookups(create_missing)
+            for chunk in chunks(rows, chunk_size):
+                try:
+                    write_chunk(job, list(validate_rows(chunk, lookups)), errors)
+                except IntegrityError:
+                    #Another request wrote one of the names of this chunk (an item, store or tag) after we looked.
+                    #Stop here like an interrupted run: the next import of the file starts again from this chunk.
+                    db.session.rollback()
+                    errors.append({"line": chunk[0][0], "message": (
+                        f"Lines {chunk[0][0]} to {chunk[-1][0]} clashed with a concurrent write and were not imported, "
+                        "import the file again to resume from them."
+                    )})
+                    break
+                if progress:
+                    progress(job, job.rows_done - resumed_from, time.perf_counter() - start)
+            else:
+                job.finished = True
+                db.session.commit()
+        except Exception:
+            db.session.rollback() #the chunk in progress is lost, the next run starts again from it
+            raise
+
+    seconds = time.perf_counter() - start
+    rows = job.rows_done - resumed_from
+    return {
+        "job_id": job.id,
+        "source": job.source,
+        "finished": job.finished,
+        "already_imported": already_imported, #nothing was done, the same file was imported completely before
+        "resumed_from_row": resumed_from,
+        "rows": rows, #read by this run
+        "items_created": job.items_created, #the totals below include earlier runs of the same file
+        "errors": job.errors,
+        "error_samples": errors,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds) if seconds else 0,
+    }
+
+
+@click.command("import-items")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(FORMATS), help="Default: from the file extension (.csv, .ndjson, .jsonl).")
+@click.option("--chunk-size", type=int, help="Rows per transaction. Default: IMPORT_CHUNK_SIZE.")
+@click.option("--create-missing/--no-create-missing", default=True, show_default=True, help="Create stores and tags that don't exist yet.")
+@with_appcontext
+def import_command(path, fmt, chunk_size, create_missing):
+    """Import items from a CSV or NDJSON file, resuming if it was interrupted."""
+    try:
+        fmt = file_format(path, fmt)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+
+    def progress(job, rows, seconds):
+        click.echo(f"{job.rows_done} rows done, {job.items_created} items, {job.errors} errors ({rows / seconds if seconds else 0:.0f} rows/s)")
+
+    with open(path, "rb") as binary:
+        summary = import_items(binary, path, fmt, chunk_size, create_missing, progress)
+
+    if summary["already_imported"]:
+        click.echo(f"{path} was already imported (job {summary['job_id']}).")
+    elif summary["resumed_from_row"]:
+        click.echo(f"Resumed after row {summary['resumed_from_row']}.")
+    for error in summary["error_samples"]:
+        click.echo(f"line {error['line']}: {error['message']}", err=True)
+    click.echo(
+        f"{summary['rows']} rows in {summary['seconds']:.2f}s ({summary['rows_per_second']} rows/s), "
+        f"{summary['items_created']} items imported, {summary['errors']} rows rejected"
+    )
@@ -0,0 +1,88 @@
+"""
+metrics.py
+
+Prometheus metrics, served at GET /metrics (resources/stats.py).
+
+Under gunicorn every worker is its own process with its own counters, and a scrape only
+reaches one of them. So when PROMETHEUS_MULTIPROC_DIR is set (docker-entrypoint.sh does it)
+prometheus_client writes the values of every worker to files in that directory and /metrics
+adds them all up. gunicorn.conf.py cleans up after workers that exit.
+
+Requests are labelled with the smorest blueprint (Items, stores, Tags, Users, Stats) and the
+route rule, e.g. "/item/<int:item_id>", not the actual path, so there is one series per route.
+"""
+import os
+import time
+
+from flask import g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+
+REQUESTS = Counter(
+    "http_requests_total", "Requests handled", ["blueprint", "route", "method", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to handle a request", ["blueprint", "route", "method"]
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being handled right now", ["blueprint", "route"], multiprocess_mode="livesum"
+)
+
+DB_POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Connections taken from the pool")
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Times nobody got a connection within DB_POOL_TIMEOUT")
+DB_POOL_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent getting a connection from the pool")
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections in use right now", multiprocess_mode="livesum")
+
+CACHE_REQUESTS = Counter("response_cache_requests_total", "Response cache lookups", ["result"]) #hit or miss
+CACHE_INVALIDATIONS = Counter("response_cache_invalidations_total", "Response cache keys invalidated")
+
+BLOCKLIST_CHECKS = Counter(
+    "jwt_blocklist_checks_total", "Blocklist checks", ["source", "result"] #source: cache or backend, result: revoked or valid
+)
+BLOCKLIST_REVOCATIONS = Counter("jwt_blocklist_revocations_total", "Tokens added to the blocklist")
+
+RATE_LIMITED = Counter("rate_limited_total", "Requests answered 429 by ratelimit.py", ["limit"])
+ADMISSION_REJECTED = Counter("admission_rejected_total", "Requests shed with a 503 by admission.py", ["budget"]) #the budget that was used up
+
+
+def _labels():
+    rule = request.url_rule.rule if request.url_rule else "unmatched" #404s don't get one series per made up path
+    return request.blueprint or "", rule
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.labels(*_labels()).inc()
+
+
+def _finish_request(response):
+    blueprint, rule = _labels()
+    REQUESTS.labels(blueprint, rule, request.method, response.status_code).inc()
+    REQUEST_LATENCY.labels(blueprint, rule, request.method).observe(time.perf_counter() - g.metrics_start)
+    return response
+
+
+def _request_done(exception):
+    if "metrics_start" in g:
+        REQUESTS_IN_FLIGHT.labels(*_labels()).dec()
+
+
+def init_app(app, engines):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_request_done) #runs even when the view raised, so the gauge always goes back down
+    for engine in engines: #the primary, the replicas and the shards
+        event.listen(engine, "checkout", lambda *args: DB_POOL_CHECKED_OUT.inc())
+        event.listen(engine, "checkin", lambda *args: DB_POOL_CHECKED_OUT.dec())
+
+
+def render():
+    #Returns (body, content type) for the /metrics endpoint
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry) #sums up the files of every worker
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
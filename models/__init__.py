@@ -3,6 +3,8 @@ from models.item import ItemModel
 from models.tag import TagModel
 from models.item_tags import ItemTags
 from models.user import UserModel
+from models.blocklist import BlocklistModel
+from models.import_job import ImportJobModel
 
 #This here is going to help us import our models bit easily, anywhere that we want to use our 
 #model we can just say import models and thats gonna use the imports of __init__.py
\ No newline at end of file
@@ -0,0 +1,8 @@
+from db import db
+
+#Revoked JWTs live in the database so every gunicorn worker sees the same blocklist
+class BlocklistModel(db.Model):
+    __tablename__="blocklist"
+
+    jti = db.Column(db.String(36), primary_key=True) #the unique id of the revoked token
+    expires_at = db.Column(db.Integer, nullable=True, index=True) #the token's "exp" (unix time), after that the row can be deleted
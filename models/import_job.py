@@ -0,0 +1,14 @@
+from db import db
+
+#Progress of `flask import-items` / POST /item/import for one file, see importer.py.
+#It is updated in the same transaction as each chunk of items, so after a crash it says exactly where to resume.
+class ImportJobModel(db.Model):
+    __tablename__="import_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), unique=True, nullable=False) #sha256 of the file, the same file resumes the same job
+    source = db.Column(db.String(255), nullable=False) #file name, for humans
+    rows_done = db.Column(db.Integer, nullable=False, default=0) #rows of the file already committed (imported or rejected)
+    items_created = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Integer, nullable=False, default=0)
+    finished = db.Column(db.Boolean, nullable=False, default=False)
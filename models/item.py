@@ -1,4 +1,5 @@
 from db import db #To get the SQLAlchemy instance to item.py from db.py
+import search
 
 #This instance have a bunch of things inside it that we can use, to later on tell SQLAlchemy
 #what table we gonna use in our application and what columns those table we have
@@ -6,13 +7,22 @@ from db import db #To get the SQLAlchemy instance to item.py from db.py
 
 class ItemModel(db.Model): #this now becomes a mapping between a row in a table to a Python class and therefore Python object.
     __tablename__="items" #this tells SQL alchemy that we gonna use a table called items for this class and all the objects of the class
+    #GET /item/search?store_id=1&sort=price walks this index in order instead of sorting the items of the store,
+    #and it starts with store_id so it is also the index for the items of a store (no ix_items_store_id of its own)
+    #sqlite_autoincrement: ids never go back below the range of the shard the table is on, see shards.py
+    __table_args__ = (db.Index("ix_items_store_id_price", "store_id", "price"), {"sqlite_autoincrement": True})
 
     id = db.Column(db.Integer,primary_key=True) #This is how we define a column that will be a part of the items table (its gonna be a integer column and its a primary key of the table)
     name = db.Column(db.String(80), unique=True,nullable=False) #You can take unique=True away if you want to have different store can have same items of the same name
     description =db.Column(db.String)
-    price = db.Column(db.Float(precision=2),unique=False,nullable=False)
+    price = db.Column(db.Float(precision=2),unique=False,nullable=False,index=True) #price range filter and sort=price of /item/search
+    #+1 on every write. PUT and DELETE with If-Match only write while it is still the version they checked, see etags.py
+    version = db.Column(db.Integer, nullable=False, server_default="1")
     store_id = db.Column(db.Integer,db.ForeignKey("stores.id"),unique=False,nullable=False) #store_id is the link between items table and stores table, db.ForeignKey(<table_name>.<column_which_acts_as_foreignkey>)
     #Every item has one store associated with it.
 
     store = db.relationship("StoreModel",back_populates="items") #Grab me a storemodel object that has this store_id
-    tags = db.relationship("TagModel",back_populates="items",secondary="item_tags")
\ No newline at end of file
+    tags = db.relationship("TagModel",back_populates="items",secondary="item_tags")
+
+
+search.install(ItemModel.__table__) #full-text search on the names, FTS5 table on SQLite, GIN index on Postgres
@@ -2,9 +2,12 @@ from db import db
 
 class ItemTags(db.Model):
     __tablename__ = "item_tags"
+    #An item can be linked to a tag only once. The unique index on (item_id, tag_id) also serves every lookup by item_id,
+    #tag_id gets its own index for the "items of this tag" side.
+    __table_args__ = (db.UniqueConstraint("item_id", "tag_id", name="uq_item_tags_item_id_tag_id"),)
 
     id = db.Column(db.Integer,primary_key=True)
     item_id = db.Column(db.Integer,db.ForeignKey("items.id"))
-    tag_id = db.Column(db.Integer,db.ForeignKey("tags.id"))
+    tag_id = db.Column(db.Integer,db.ForeignKey("tags.id"),index=True)
 
 #We can use this in item and tag to relate each one to the other.
@@ -2,14 +2,18 @@ from db import db
 
 class StoreModel(db.Model): #this now becomes a mapping between a row in a table to a Python class and therefore Python object.
     __tablename__="stores"
+    __table_args__ = {"sqlite_autoincrement": True} #so a shard's id range holds on SQLite, see shards.py
 
     id = db.Column(db.Integer,primary_key=True) #This id value here maps to store_id in items table
     name = db.Column(db.String(80),unique=True,nullable=False)
 
     #relating to the items model
-    items = db.relationship("ItemModel",back_populates="store",lazy="dynamic", cascade="all, delete")
-    tags = db.relationship("TagModel",back_populates="store",lazy="dynamic")
+    items = db.relationship("ItemModel",back_populates="store", cascade="all, delete", order_by="ItemModel.id")
+    #order_by: without it the database picks the order, and with the (store_id, price) index that became price order
+    tags = db.relationship("TagModel",back_populates="store")
     #we use cascade above so that if a store is deleted, then all the items in that store is also deleted.
+    #These used to be lazy="dynamic", but a dynamic relationship can't be eager loaded, so listing stores did
+    #two extra SELECTs per store. Now they are plain lists and the resources ask for selectinload() when they need them.
     
 
 #But each store could have many items associated with it (One to Many relationship)
@@ -3,10 +3,11 @@ from db import db
 #Tag Model
 class TagModel(db.Model):
     __tablename__="tags"
+    __table_args__ = {"sqlite_autoincrement": True} #so a shard's id range holds on SQLite, see shards.py
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=True, nullable=False)
-    store_id = db.Column(db.Integer,db.ForeignKey("stores.id"),nullable=False)
+    store_id = db.Column(db.Integer,db.ForeignKey("stores.id"),nullable=False,index=True) #index, we look tags up by store a lot
 
     store = db.relationship("StoreModel",back_populates="tags")
     items = db.relationship("ItemModel",back_populates="tags",secondary="item_tags")
\ No newline at end of file
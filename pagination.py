@@ -0,0 +1,97 @@
+"""
+pagination.py
+
+Keyset (cursor) pagination for the list endpoints. Instead of OFFSET, which makes the
+database walk over every skipped row, we remember the id of the last row we returned and
+ask for rows with a bigger id next time. That way page 1000 costs the same as page 1.
+
+The cursor is opaque for the client, it just sends back whatever we gave it in "next".
+paginate_sorted does the same for another sort order: the cursor then holds the sort value
+and the id of the last row, the id breaks ties between rows with the same value.
+
+With shards (shards.py) the query runs on each of them, so we get up to a page from every
+shard and keep the first page of all of them together.
+"""
+import base64
+import binascii
+import json
+
+from flask_smorest import abort
+from sqlalchemy import tuple_
+from sqlalchemy.orm import undefer
+
+from shards import SHARDS
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4) #we strip the padding when encoding so put it back
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400, message="Invalid pagination cursor.")
+
+
+def paginate(query, model, limit, after=None, id_column=None):
+    #Returns one page of rows ordered by id and the cursor for the next page (None on the last page).
+    #id_column is for a joined table holding the same ids that is cheaper to order by, see search.py
+    id_column = model.id if id_column is None else id_column
+    if after:
+        query = query.filter(id_column > decode_cursor(after))
+
+    rows = query.order_by(id_column).limit(limit + 1).all() #one extra row tells us if there is a next page
+    rows = SHARDS.in_order(rows, key=lambda row: row.id)[:limit + 1] #with shards, a page from each of them
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].id)
+    return rows, None
+
+
+def encode_sort_cursor(value, last_id):
+    return base64.urlsafe_b64encode(json.dumps([value, last_id]).encode()).decode().rstrip("=")
+
+
+def decode_sort_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return value, int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        abort(400, message="Invalid pagination cursor.")
+
+
+def _cursor_value(value, column):
+    #A cursor of another sort order (a name replayed with sort=price) would compare as a string
+    #against the numbers and just give an empty page, so it is as invalid as bad base64
+    python_type = column.type.python_type
+    if python_type is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value) #json keeps 10.0 as 10.0 but accept a hand written 10 too
+    if type(value) is not python_type:
+        abort(400, message="Invalid pagination cursor.")
+    return value
+
+
+def paginate_sorted(query, model, column, descending, limit, after=None):
+    #Like paginate but ordered by column, then id. Needs an index on the column to be cheap.
+    #The cursor reads both from the last row, so they are loaded even when ?fields= leaves them out
+    query = query.options(undefer(column), undefer(model.id))
+    if after:
+        value, last_id = decode_sort_cursor(after)
+        value = _cursor_value(value, column)
+        position = tuple_(column, model.id)
+        last = tuple_(value, last_id)
+        query = query.filter(position < last if descending else position > last)
+
+    order = (column.desc(), model.id.desc()) if descending else (column, model.id)
+    rows = query.order_by(*order).limit(limit + 1).all()
+    rows = SHARDS.in_order(rows, key=lambda row: (getattr(row, column.key), row.id), reverse=descending)[:limit + 1]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_sort_cursor(getattr(rows[-1], column.key), rows[-1].id)
+    return rows, None
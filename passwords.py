@@ -0,0 +1,50 @@
+"""
+passwords.py
+
+Password hashing for the user resources. pbkdf2 is meant to be slow, so instead of running it
+on whatever request thread happens to get a /login or /register, every hash and verify goes
+through a small thread pool (PASSWORD_HASH_WORKERS threads). A burst of logins then waits its
+turn in the pool instead of taking every CPU away from the cheap GET requests.
+hashlib releases the GIL while it hashes, so the pool threads really do run in parallel.
+
+PASSWORD_HASH_ROUNDS sets the pbkdf2 cost. When a user logs in with a hash made with other
+settings (e.g. we raised the rounds) the password is hashed again with the current ones.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.hash import pbkdf2_sha256  #SHA 256 is a hashing algorithm, to hash the password that client sends us
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.hasher = pbkdf2_sha256
+        self.executor = None
+        self.workers = 0
+
+    def init_app(self, app):
+        self.hasher = pbkdf2_sha256.using(rounds=app.config["PASSWORD_HASH_ROUNDS"])
+        workers = app.config["PASSWORD_HASH_WORKERS"]
+        if self.executor is None or workers != self.workers:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+            self.workers = workers
+
+    def _run(self, func, *args):
+        if self.executor is None: #used outside of an app, e.g. from a shell
+            return func(*args)
+        return self.executor.submit(func, *args).result()
+
+    def hash(self, password):
+        return self._run(self.hasher.hash, password)
+
+    def verify(self, password, password_hash):
+        #Returns (matches, new_hash), new_hash is only set when the stored hash should be replaced
+        if not self._run(self.hasher.verify, password, password_hash):
+            return False, None
+        if self.hasher.needs_update(password_hash):
+            return True, self.hash(password)
+        return True, None
+
+
+PASSWORDS = PasswordHasher()
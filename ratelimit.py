@@ -0,0 +1,146 @@
+"""
+ratelimit.py
+
+Token buckets for the endpoints that run pbkdf2 (POST /login and POST /register). Every
+attempt takes a token from the bucket of the client's IP and, for /login, from the bucket of
+the username, whatever the outcome. An empty bucket answers 429 with Retry-After before any
+hashing is done, so a credential stuffing burst costs us a dict lookup per request instead
+of a pbkdf2. The limits are "<attempts>/<seconds>": "10/60" lets 10 attempts through at once
+and then one every 6 seconds. "0" turns a limit off.
+
+    LOGIN_LIMIT_PER_USERNAME   (10/60 by default)
+    LOGIN_LIMIT_PER_IP         (30/60)
+    REGISTER_LIMIT_PER_IP      (10/60)
+
+The buckets live in a backend picked with RATE_LIMIT_BACKEND:
+  - "memory" (default): a dict inside this process, every gunicorn worker has its own buckets
+  - "file": a SQLite file at RATE_LIMIT_FILE shared by every worker of the machine,
+    docker-entrypoint.sh uses this one
+
+The client IP is request.remote_addr. Behind a proxy that is the proxy, wrap the app in
+werkzeug's ProxyFix so it becomes the address from X-Forwarded-For.
+"""
+import math
+import sqlite3
+import threading
+import time
+
+from flask import request
+from flask_smorest import abort
+
+from metrics import RATE_LIMITED
+
+LIMITS = ("LOGIN_LIMIT_PER_USERNAME", "LOGIN_LIMIT_PER_IP", "REGISTER_LIMIT_PER_IP")
+
+
+def parse_limit(value):
+    #"10/60" -> (10, 60.0), "0" or "" -> None
+    if not value or value.strip() == "0":
+        return None
+    attempts, _, seconds = value.partition("/")
+    attempts, seconds = int(attempts), float(seconds)
+    if attempts < 1 or seconds <= 0:
+        raise ValueError(f"A rate limit is '<attempts>/<seconds>', got {value!r}")
+    return attempts, seconds
+
+
+def _take(tokens, updated, capacity, rate, now):
+    #One token bucket step: returns (tokens left, seconds until the next token, 0 when we got one)
+    tokens = capacity if tokens is None else min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    max_size = 100000 #buckets, we drop the full ones when there are more
+
+    def __init__(self):
+        self.buckets = {} #key -> (tokens, updated, full again at)
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated, _ = self.buckets.get(key, (None, now, now))
+            tokens, wait = _take(tokens, updated, capacity, rate, now)
+            self.buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self.buckets) > self.max_size:
+                #A full bucket is the same as no bucket
+                self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[2] > now}
+        return wait
+
+
+class FileBuckets:
+    sweep_every = 1000 #takes between two clean ups of the full buckets
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local() #a sqlite3 connection can't be shared between threads
+        self.takes = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)"
+        )
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None) #we BEGIN ourselves
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF") #losing the buckets in a crash is fine
+            self.local.connection = connection
+        return connection
+
+    def take(self, key, capacity, rate):
+        now = time.time() #not monotonic, the other processes have to agree on it
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE") #one writer at a time, so two workers can't both take the last token
+        try:
+            row = connection.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, wait = _take(*(row or (None, now)), capacity, rate, now)
+            connection.execute(
+                "INSERT INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated, full_at = excluded.full_at",
+                (key, tokens, now, now + (capacity - tokens) / rate)
+            )
+            self.takes += 1
+            if self.takes % self.sweep_every == 0:
+                connection.execute("DELETE FROM buckets WHERE full_at < ?", (now,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class RateLimiter:
+    def __init__(self):
+        self.backend = MemoryBuckets()
+        self.limits = {}
+
+    def init_app(self, app):
+        if app.config["RATE_LIMIT_BACKEND"] == "file":
+            self.backend = FileBuckets(app.config["RATE_LIMIT_FILE"])
+        else:
+            self.backend = MemoryBuckets()
+        self.limits = {name: parse_limit(app.config[name]) for name in LIMITS}
+
+    def hit(self, limit, key):
+        #Takes a token from the bucket of key under limit (one of LIMITS), or answers 429
+        if self.limits.get(limit) is None:
+            return
+        attempts, seconds = self.limits[limit]
+        wait = self.backend.take(f"{limit}:{key}", attempts, attempts / seconds)
+        if wait:
+            RATE_LIMITED.labels(limit).inc()
+            abort(
+                429,
+                message="Too many attempts, try again later.",
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+    def hit_client(self, limit):
+        self.hit(limit, request.remote_addr or "unknown")
+
+
+RATE_LIMITS = RateLimiter()
@@ -0,0 +1,129 @@
+"""
+replicas.py
+
+Read replicas. With DATABASE_REPLICA_URLS set (comma separated), the GET handlers decorated with
+@REPLICAS.read_only run their queries on a replica, picked round robin. Every other handler,
+the JWT blocklist check and anything flushed inside a read_only handler stay on the primary
+(DATABASE_URL). Copying the data to the replicas is the database's job (streaming replication
+on Postgres, Litestream or a plain copy on SQLite), this only decides where a query goes.
+
+Health: a replica that fails with an OperationalError or InterfaceError (down, unreachable,
+missing tables) is left out for REPLICA_RETRY_SECONDS and the handler runs again on the next
+one, or on the primary once none is left. Those handlers only read, so running one twice is
+harmless.
+
+Read your writes: replicas lag behind the primary. After a successful POST/PUT/DELETE the
+response sets a cookie that sends the same client's reads to the primary for the next
+REPLICA_STICKY_SECONDS. Clients that don't keep cookies can send "X-Read-Primary: 1" on the
+reads that have to see their own writes. Other clients may still read a slightly old row,
+and with RESPONSE_CACHE_ENABLED that row can be cached until its TTL runs out.
+
+Locally: DATABASE_URL=sqlite:///data.db DATABASE_REPLICA_URLS=sqlite:///replica.db, with
+replica.db a copy of data.db.
+"""
+import logging
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, request
+from sqlalchemy import create_engine
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from db import db, engine_options, configure_engine
+
+logger = logging.getLogger("replicas")
+
+STICKY_COOKIE = "read_primary_until"
+PRIMARY_HEADER = "X-Read-Primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turn = 0 #round robin position
+        self.down_until = {} #engine -> time.monotonic() when it may be tried again
+
+    def init_app(self, app):
+        self.retry_seconds = app.config["REPLICA_RETRY_SECONDS"]
+        self.sticky_seconds = app.config["REPLICA_STICKY_SECONDS"]
+        engines = []
+        for url in app.config["DATABASE_REPLICA_URLS"]:
+            engine = create_engine(url, **engine_options(url)) #same pool settings as the primary
+            configure_engine(engine)
+            engines.append(engine)
+        app.extensions["replicas"] = engines
+        with self.lock:
+            self.down_until.clear()
+        if engines:
+            app.after_request(self._stick_to_primary)
+
+    def engines(self):
+        return current_app.extensions.get("replicas", [])
+
+    def pick(self):
+        #The next healthy replica, None when they are all down
+        engines = self.engines()
+        now = time.monotonic()
+        with self.lock:
+            for _ in range(len(engines)):
+                engine = engines[self.turn % len(engines)]
+                self.turn += 1
+                if self.down_until.get(engine, 0) <= now:
+                    return engine
+        return None
+
+    def mark_down(self, engine, error):
+        with self.lock:
+            self.down_until[engine] = time.monotonic() + self.retry_seconds
+        engine.dispose() #its pooled connections are probably dead too
+        logger.warning("Replica %s failed, leaving it out for %ss: %s", engine.url.render_as_string(), self.retry_seconds, error)
+
+    def wants_primary(self):
+        #Read your writes, see the docstring at the top
+        if request.headers.get(PRIMARY_HEADER, "").lower() in ("1", "true", "yes"):
+            return True
+        try:
+            return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def _stick_to_primary(self, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            until = time.time() + self.sticky_seconds
+            response.set_cookie(STICKY_COOKIE, f"{until:.3f}", max_age=math.ceil(self.sticky_seconds), httponly=True, samesite="Lax")
+        return response
+
+    def read_only(self, view):
+        #For GET handlers that only read. The engine goes in g, db.RoutingSession.get_bind() picks it up from there.
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.engines() or self.wants_primary():
+                return view(*args, **kwargs)
+            try:
+                while True:
+                    g.read_engine = self.pick() #None: on the primary
+                    if g.read_engine is None:
+                        return view(*args, **kwargs)
+                    try:
+                        return view(*args, **kwargs)
+                    except (OperationalError, InterfaceError) as error: #the connection, not the query
+                        db.session.rollback()
+                        self.mark_down(g.read_engine, error)
+            finally:
+                g.pop("read_engine", None)
+        return wrapper
+
+    def status(self):
+        #For /db/stats
+        now = time.monotonic()
+        with self.lock:
+            return [
+                {"index": index, "healthy": self.down_until.get(engine, 0) <= now, "retry_in_seconds": max(0.0, round(self.down_until.get(engine, 0) - now, 3))}
+                for index, engine in enumerate(self.engines())
+            ]
+
+
+REPLICAS = ReplicaRouter()
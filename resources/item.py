@@ -1,21 +1,49 @@
+from flask import Response, current_app, jsonify, request, stream_with_context
 from flask.views import MethodView #used for creating a class and the methods of the class route to specific endpoint.
 from flask_smorest import Blueprint,abort
 from flask_jwt_extended import jwt_required,get_jwt
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.orm import selectinload
 
-from db import db
-from models import ItemModel
-from schemas import ItemSchema, ItemUpdateSchema
+from db import db, upsert, advance_id_sequence
+from cache import RESPONSE_CACHE, item_cache_keys
+from replicas import REPLICAS
+from shards import SHARDS
+from etags import conditional, check_if_match, item_etag
+from fieldsets import fieldset_schema, fieldset_load_options
+from models import ItemModel, StoreModel, TagModel, ItemTags
+from pagination import paginate, paginate_sorted
+from search import match_names, name_starts_with
+from schemas import ItemSchema, ItemUpdateSchema, ItemPageSchema, PageArgsSchema, ItemBulkResultSchema, FieldsetArgsSchema, ItemSearchArgsSchema
+from schemas import ImportFileSchema, ImportArgsSchema, ImportResultSchema, ItemBulkSchema, ItemUpsertBulkSchema, ItemUpsertBulkResultSchema
+from importer import import_items, file_format
 
 blp = Blueprint("Items",__name__,description="Operations on items")
 
+#ItemSchema dumps the store and the tags of every item, so we load them in batches (one SELECT ... WHERE id IN (...) each)
+#instead of letting each item lazy load them. GET /item and GET /item/<id> are always 3 queries: items, stores, tags
+#(plus the ETag query of GET /item/<id>, see etags.py).
+ITEM_LOADERS = {"store": selectinload(ItemModel.store), "tags": selectinload(ItemModel.tags)}
+ITEM_LOAD_OPTIONS = tuple(ITEM_LOADERS.values())
+
+EXPORT_CHUNK_SIZE = 1000 #how many rows GET /item/export reads from the database at a time
+
 @blp.route("/item/<int:item_id>")
 class Item(MethodView):
     @jwt_required()
+    @REPLICAS.read_only
+    @conditional(etag=item_etag) #a 304 without loading the item, see etags.py
+    @RESPONSE_CACHE.cached("item")
+    @SHARDS.route("item_id")
+    @blp.arguments(FieldsetArgsSchema, location="query")
     @blp.response(200,ItemSchema)
-    def get(self, item_id):
-        item = ItemModel.query.get_or_404(item_id) #it retrieves the item from the database using the items primary_key, if there is no item with this primary key then it will automatically abort with 404 status code.
+    def get(self, fieldset, item_id):
+        schema = fieldset_schema(ItemSchema, fieldset) #None unless ?fields= or ?exclude= was sent
+        item = ItemModel.query.options(*fieldset_load_options(ItemModel, schema, ITEM_LOADERS)).get_or_404(item_id) #it retrieves the item from the database using the items primary_key, if there is no item with this primary key then it will automatically abort with 404 status code.
         #no need to do any error handling,its all handled for you
+        if schema:
+            return jsonify(schema.dump(item))
         return item
     
         #We already have this code to get item based on item_id in app.py, so put it here.
@@ -28,6 +56,8 @@ class Item(MethodView):
         '''
 
     @jwt_required()
+    @SHARDS.route("item_id")
+    @blp.alt_response(412, description="Returned when If-Match doesn't match the current ETag of the item.")
     def delete(self, item_id):
         #Similarly we do it for delete as well, we gonna add ItemModel.query.get_or_404(item_id)
         jwt = get_jwt()
@@ -35,8 +65,13 @@ class Item(MethodView):
             abort(401,message="Admin privilege required.")
 
         item = ItemModel.query.get_or_404(item_id)
+        check_if_match(lambda: item_etag(item_id))
+        if request.if_match and not _claim_version(item_id, item.version):
+            abort(412, message="The resource has changed since you fetched it. Get it again and retry.")
+        cache_keys = item_cache_keys(item) #before the delete, afterwards the item has no tags
         db.session.delete(item)
         db.session.commit()
+        RESPONSE_CACHE.invalidate(*cache_keys)
         
         return {"message":"Item deleted."}
         
@@ -49,19 +84,36 @@ class Item(MethodView):
             abort(404, message="Item not found.")
         '''
 
+    @SHARDS.route("item_id") #outside blp.response: the store of the item is loaded while dumping it, that has to be on its shard too
     @blp.arguments(ItemUpdateSchema) #Order of decorators matters
     @blp.response(200,ItemSchema) #so make sure this is after the arguments decorator(i.e, deeper in the nesting of decorators)
+    @blp.alt_response(412, description="Returned when If-Match doesn't match the current ETag of the item.")
     def put(self,item_data,item_id):
-        item = ItemModel.query.get(item_id)
+        #A new item gets the id of the URL, and with shards that id has to be in the range of its store's shard.
+        #An existing item keeps its store, so a store_id of another shard only matters when the item has to be created.
+        other_shard = "store_id" in item_data and SHARDS.of_id(item_data["store_id"]) != SHARDS.current()
+        if other_shard:
+            item_data = {key: value for key, value in item_data.items() if key != "store_id"} #update only
+        version = None
+        if request.if_match: #the ETag needs the item as it is now, so only then do we read it first
+            item = db.session.get(ItemModel, item_id)
+            check_if_match(lambda: item_etag(item_id))
+            version = item.version #and the write only happens if it is still this one
         #If an item doesn't exist, you should create it. And if it exists you should update it.
-        if item: #If item exists, we need only price and name
-            item.price = item_data["price"]
-            item.name = item_data["name"]
-        else: #If it doesnt exist, then we need price, name, store_id to be passed
-            item = ItemModel(**item_data)
-
-        db.session.add(item)
-        db.session.commit()
+        #It used to be a get and then an add, two PUTs at the same time could both see "missing" and both insert.
+        try:
+            item = _put_item(item_id, item_data, version)
+            if item is None and version is not None:
+                abort(412, message="The resource has changed since you fetched it. Get it again and retry.")
+            if item is None and other_shard:
+                abort(400,message="That id is in the range of another shard than the store's.")
+            if item is None:
+                abort(404,message="Item not found. Send name, price and store_id to create it.")
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            abort(400,message="An item with that name already exists.")
+        RESPONSE_CACHE.invalidate(*item_cache_keys(item))
 
         return item 
         
@@ -85,20 +137,81 @@ class Item(MethodView):
         '''
 
 
+def _put_item(item_id, item_data, version=None):
+    #One statement where the database has it: INSERT ... ON CONFLICT (id) DO UPDATE when the body has all it takes to
+    #create the item, UPDATE ... RETURNING when it only has some of the fields. Returns the item as it is after the
+    #write, or None when it doesn't exist and the body can't create it.
+    #With a version (If-Match) the item must exist and only gets written while it still has that version, None if not.
+    changes = {key: item_data[key] for key in ("name", "price") if key in item_data} #an existing item keeps its store
+    creatable = version is None and len(changes) == 2 and "store_id" in item_data
+    statement = upsert(ItemModel, ["id"], changes, version=ItemModel.version + 1) if creatable else None
+    if statement is not None:
+        statement = statement.values(id=item_id, **item_data).returning(ItemModel)
+    elif changes and (db.engine.dialect.update_returning or version is not None):
+        statement = update(ItemModel).where(ItemModel.id == item_id).values(**changes, version=ItemModel.version + 1)
+        if version is not None:
+            statement = statement.where(ItemModel.version == version)
+        if not db.engine.dialect.update_returning:
+            if not db.session.execute(statement).rowcount:
+                return None
+            return db.session.get(ItemModel, item_id, populate_existing=True)
+        statement = statement.returning(ItemModel)
+    else: #nothing to change, or a database without either statement: read then write
+        item = db.session.get(ItemModel, item_id)
+        if item and changes:
+            for key, value in changes.items():
+                setattr(item, key, value)
+            item.version = ItemModel.version + 1
+        elif creatable:
+            item = ItemModel(id=item_id, **item_data) #at the id of the URL, so PUTting it again updates it
+            db.session.add(item)
+            db.session.flush()
+            advance_id_sequence(ItemModel, item_id)
+        return item
+
+    #populate_existing: if the item is already in the session (e.g. read for If-Match), it gets the values just written
+    item = db.session.scalars(statement, execution_options={"populate_existing": True}).one_or_none()
+    if item is not None and creatable:
+        advance_id_sequence(ItemModel, item_id)
+    return item
+
+
+def _claim_version(item_id, version):
+    #Bumps the version of the item if it still is version, in the transaction of the caller. False when another
+    #request wrote the item since. On Postgres the UPDATE also locks the row until the commit.
+    statement = update(ItemModel).where(ItemModel.id == item_id, ItemModel.version == version)
+    return db.session.execute(statement.values(version=version + 1).execution_options(synchronize_session=False)).rowcount == 1
+
+
 @blp.route("/item")
 class ItemList(MethodView):
     @jwt_required()
-    @blp.response(200,ItemSchema(many=True)) #instance of item schema that gets created 
-    def get(self):
+    @REPLICAS.read_only
+    @conditional
+    @blp.arguments(PageArgsSchema, location="query")
+    @blp.arguments(FieldsetArgsSchema, location="query")
+    @blp.response(200,ItemPageSchema) #a page of items plus the cursor for the next page
+    def get(self,page_args,fieldset):
         #return items.values() #and this will be turned into a list so just return items.values
-        return ItemModel.query.all()
+        #We no longer return ItemModel.query.all(), that loads the whole table on every request
+        schema = fieldset_schema(ItemSchema, fieldset, many=True)
+        query = ItemModel.query.options(*fieldset_load_options(ItemModel, schema, ITEM_LOADERS))
+        items, next_cursor = paginate(query, ItemModel, page_args["limit"], page_args.get("after"))
+        if schema:
+            return jsonify({"items":schema.dump(items),"next":next_cursor})
+        return {"items":items,"next":next_cursor}
 
     @jwt_required(fresh=True) #now you cannot call this endpoint unless we send a jwt, fresh=True means now it requires a fresh token
     @blp.arguments(ItemSchema)
     @blp.response(201, ItemSchema)
     def post(self,item_data):
         #Inserting data into database model using db.session.add(item) and db.session.commit()
-        item = ItemModel(**item_data)
+        if SHARDS.of_id(item_data["store_id"]) is None:
+            abort(404,message="Store not found.")
+        #With shards the unique index on name only covers one of them (shards.py), so look at all of them first
+        if SHARDS.count() > 1 and db.session.scalar(select(ItemModel.id).where(ItemModel.name == item_data["name"])):
+            abort(400,message="An item with that name already exists.")
+        item = ItemModel(**item_data) #goes to the shard of its store
 
         try:
             db.session.add(item) #you can add multiple things
@@ -107,6 +220,7 @@ class ItemList(MethodView):
         except SQLAlchemyError:
             abort(500,message="An error occured while inserting the item.")
 
+        RESPONSE_CACHE.invalidate(f"store:{item.store_id}") #the store page lists its items
         return item 
     
 
@@ -138,3 +252,269 @@ class ItemList(MethodView):
         '''
 
 
+@blp.route("/item/search")
+class ItemSearch(MethodView):
+    @jwt_required()
+    @REPLICAS.read_only
+    @conditional
+    @blp.arguments(ItemSearchArgsSchema, location="query")
+    @blp.arguments(FieldsetArgsSchema, location="query")
+    @blp.response(200,ItemPageSchema) #same page as GET /item, "next" carries the filters' sort position
+    def get(self,search_args,fieldset):
+        #e.g. /item/search?q=red shirt&min_price=10&max_price=50&store_id=3&tags=1,2&sort=-price
+        dialect = db.engine.dialect.name
+        schema = fieldset_schema(ItemSchema, fieldset, many=True)
+        query = ItemModel.query.options(*fieldset_load_options(ItemModel, schema, ITEM_LOADERS))
+        id_column = ItemModel.id
+        #With store_id only the shard of that store is searched, otherwise all of them
+        shard = SHARDS.of_id(search_args["store_id"]) if "store_id" in search_args else None
+        if "store_id" in search_args and shard is None:
+            return {"items":[],"next":None}
+
+        if "q" in search_args:
+            query, id_column = match_names(query, ItemModel, search_args["q"], dialect)
+        if "name" in search_args:
+            query = query.filter(name_starts_with(ItemModel.name, search_args["name"], dialect))
+        if "min_price" in search_args:
+            query = query.filter(ItemModel.price >= search_args["min_price"])
+        if "max_price" in search_args:
+            query = query.filter(ItemModel.price <= search_args["max_price"])
+        if "store_id" in search_args:
+            query = query.filter(ItemModel.store_id == search_args["store_id"])
+        for tag_id in set(search_args.get("tags", ())):
+            #IN and not EXISTS: the database can start from the few items of the tag (index on tag_id) instead of
+            #walking all the items in price order and checking each one
+            query = query.filter(ItemModel.id.in_(select(ItemTags.item_id).where(ItemTags.tag_id == tag_id)))
+
+        sort = search_args["sort"]
+        with SHARDS.use(shard):
+            if sort == "id":
+                items, next_cursor = paginate(query, ItemModel, search_args["limit"], search_args.get("after"), id_column)
+            else:
+                column = getattr(ItemModel, sort.lstrip("-"))
+                items, next_cursor = paginate_sorted(query, ItemModel, column, sort.startswith("-"), search_args["limit"], search_args.get("after"))
+
+        if schema:
+            return jsonify({"items":schema.dump(items),"next":next_cursor})
+        return {"items":items,"next":next_cursor}
+
+
+@blp.route("/item/bulk")
+class ItemBulk(MethodView):
+    @jwt_required(fresh=True)
+    @blp.arguments(ItemBulkSchema(many=True)) #the whole array is validated, a malformed row rejects the request with 422
+    @blp.response(201, ItemBulkResultSchema)
+    def post(self,items_data):
+        #Rows are inserted BULK_INSERT_BATCH_SIZE at a time, one INSERT statement and one commit per batch.
+        #Rows with a duplicate name or a store that doesn't exist are reported in "errors" and the rest still go in.
+        batch_size = current_app.config["BULK_INSERT_BATCH_SIZE"]
+        created, errors = [], []
+        names_in_request = set()
+        store_ids_written = set()
+
+        for start in range(0, len(items_data), batch_size):
+            batch = list(enumerate(items_data[start:start + batch_size], start))
+
+            #Two set based lookups per batch instead of one per row
+            taken_names = set(db.session.scalars(
+                select(ItemModel.name).where(ItemModel.name.in_({row["name"] for _, row in batch}))
+            ))
+            store_ids = set(db.session.scalars(
+                select(StoreModel.id).where(StoreModel.id.in_({row["store_id"] for _, row in batch}))
+            ))
+
+            rows = []
+            for index, row in batch:
+                if row["name"] in taken_names or row["name"] in names_in_request:
+                    errors.append({"index":index,"message":"An item with that name already exists."})
+                elif row["store_id"] not in store_ids:
+                    errors.append({"index":index,"message":"Store not found."})
+                else:
+                    names_in_request.add(row["name"])
+                    store_ids_written.add(row["store_id"])
+                    rows.append((index, row))
+
+            #One INSERT per shard the rows go to (just the one without shards)
+            for shard, shard_rows in SHARDS.split(rows, lambda index_row: index_row[1]["store_id"]):
+                with SHARDS.use(shard):
+                    created.extend(_insert_item_batch(shard_rows, errors))
+
+        RESPONSE_CACHE.invalidate(*[f"store:{store_id}" for store_id in store_ids_written])
+        errors.sort(key=lambda error: error["index"])
+        created.sort() #(index, id), back in request order
+        return {"created":[item_id for _, item_id in created],"errors":errors}
+
+    @jwt_required(fresh=True)
+    @blp.arguments(ItemUpsertBulkSchema(many=True))
+    @blp.response(200, ItemUpsertBulkResultSchema)
+    def put(self,items_data):
+        #PUT /item/<id> for many items: each row is created at its id or updated (name and price).
+        #One INSERT ... ON CONFLICT DO UPDATE and one commit per batch of BULK_INSERT_BATCH_SIZE rows.
+        batch_size = current_app.config["BULK_INSERT_BATCH_SIZE"]
+        upserted, errors = [], []
+        ids_in_request, names_in_request = set(), set()
+        cache_keys = set()
+
+        for start in range(0, len(items_data), batch_size):
+            batch = list(enumerate(items_data[start:start + batch_size], start))
+
+            #The name may already be taken, but only by another item: renaming an item to its own name is fine
+            name_owners = dict(db.session.execute(
+                select(ItemModel.name, ItemModel.id).where(ItemModel.name.in_({row["name"] for _, row in batch}))
+            ).all())
+            store_ids = set(db.session.scalars(
+                select(StoreModel.id).where(StoreModel.id.in_({row["store_id"] for _, row in batch}))
+            ))
+
+            rows = []
+            for index, row in batch:
+                if row["id"] in ids_in_request: #one statement can't write the same row twice
+                    errors.append({"index":index,"message":"The item is in the request more than once."})
+                elif name_owners.get(row["name"], row["id"]) != row["id"] or row["name"] in names_in_request:
+                    errors.append({"index":index,"message":"An item with that name already exists."})
+                elif row["store_id"] not in store_ids:
+                    errors.append({"index":index,"message":"Store not found."})
+                elif SHARDS.of_id(row["id"]) != SHARDS.of_id(row["store_id"]):
+                    errors.append({"index":index,"message":"That id is in the range of another shard than the store's."})
+                else:
+                    ids_in_request.add(row["id"])
+                    names_in_request.add(row["name"])
+                    rows.append((index, row))
+
+            for shard, shard_rows in SHARDS.split(rows, lambda index_row: index_row[1]["id"]):
+                with SHARDS.use(shard):
+                    written = _upsert_item_batch(shard_rows, errors)
+                upserted.extend(written)
+                cache_keys |= _written_items_cache_keys([(item_id, store_id) for _, item_id, store_id in written])
+
+        RESPONSE_CACHE.invalidate(*cache_keys)
+        errors.sort(key=lambda error: error["index"])
+        upserted.sort() #(index, id, store id), back in request order
+        return {"upserted":[item_id for _, item_id, _ in upserted],"errors":errors}
+
+
+def _insert_item_batch(rows, errors):
+    #rows is a list of (index, item_data), returns (index, new id) of the rows inserted and adds any failures to errors
+    items = ItemModel.__table__ #the table and not the model: the ORM can't run an executemany on a ShardedSession (shards.py)
+    try:
+        ids = db.session.scalars(
+            insert(items).returning(items.c.id, sort_by_parameter_order=True),
+            [row for _, row in rows]
+        ).all()
+        db.session.commit()
+        return [(index, item_id) for (index, _), item_id in zip(rows, ids)]
+    except IntegrityError:
+        #Somebody inserted a clashing row after our checks, fall back to one row at a time for this batch
+        db.session.rollback()
+
+    ids = []
+    for index, row in rows:
+        item = ItemModel(**row)
+        try:
+            db.session.add(item)
+            db.session.commit()
+            ids.append((index, item.id))
+        except IntegrityError:
+            db.session.rollback()
+            errors.append({"index":index,"message":"An item with that name already exists."})
+        except SQLAlchemyError:
+            db.session.rollback()
+            errors.append({"index":index,"message":"An error occured while inserting the item."})
+    return ids
+
+
+def _upsert_item_batch(rows, errors):
+    #rows is a list of (index, item_data), returns (index, id, store id) of the items written
+    items = ItemModel.__table__ #not the model, see _insert_item_batch
+    statement = upsert(items, ["id"], ["name", "price"], version=items.c.version + 1)
+    if statement is not None:
+        try:
+            written = db.session.execute(
+                statement.returning(items.c.id, items.c.store_id, sort_by_parameter_order=True),
+                [row for _, row in rows]
+            ).all()
+            advance_id_sequence(ItemModel, max(row["id"] for _, row in rows))
+            db.session.commit()
+            return [(index, item_id, store_id) for (index, _), (item_id, store_id) in zip(rows, written)]
+        except IntegrityError:
+            #A name taken after our checks, fall back to one row at a time for this batch
+            db.session.rollback()
+
+    written = []
+    for index, row in rows:
+        try:
+            item = _put_item(row["id"], {key: value for key, value in row.items() if key != "id"})
+            db.session.commit()
+            written.append((index, item.id, item.store_id))
+        except IntegrityError:
+            db.session.rollback()
+            errors.append({"index":index,"message":"An item with that name already exists."})
+        except SQLAlchemyError:
+            db.session.rollback()
+            errors.append({"index":index,"message":"An error occured while writing the item."})
+    return written
+
+
+def _written_items_cache_keys(written):
+    #What item_cache_keys gives for each of the items, with their tags read in one query instead of one per item
+    keys = {f"item:{item_id}" for item_id, _ in written} | {f"store:{store_id}" for _, store_id in written}
+    tags = db.session.execute(
+        select(TagModel.id, TagModel.store_id).distinct()
+        .join(ItemTags, ItemTags.tag_id == TagModel.id)
+        .where(ItemTags.item_id.in_([item_id for item_id, _ in written]))
+    )
+    for tag_id, store_id in tags:
+        keys |= {f"tag:{tag_id}", f"store_tags:{store_id}"}
+    return keys
+
+
+@blp.route("/item/import")
+class ItemImport(MethodView):
+    @jwt_required(fresh=True)
+    @blp.arguments(ImportArgsSchema, location="query")
+    @blp.arguments(ImportFileSchema, location="files")
+    @blp.response(200, ImportResultSchema)
+    def post(self,import_args,files):
+        #Same as `flask import-items`: streamed, committed in chunks, uploading the same file again resumes it
+        upload = files["file"]
+        try:
+            fmt = file_format(upload.filename or "", import_args.get("format"))
+        except ValueError as error:
+            abort(400, message=str(error))
+        summary = import_items(upload.stream, upload.filename, fmt, import_args.get("chunk_size"), import_args["create_missing"])
+        RESPONSE_CACHE.clear() #new items, tags and stores all over the place
+        return summary
+
+
+@blp.route("/item/export")
+class ItemExport(MethodView):
+    @jwt_required()
+    @blp.response(
+        200,
+        description="Every item as newline delimited JSON (one ItemSchema object per line), streamed in id order.",
+        content_type="application/x-ndjson"
+    )
+    def get(self):
+        #GET /item builds the whole page in memory, this one reads the table in chunks of EXPORT_CHUNK_SIZE
+        #and sends each item as soon as it is serialized, so memory stays flat however big the catalog is.
+        def generate():
+            schema = ItemSchema()
+            last_id = 0
+            while True:
+                chunk = (
+                    ItemModel.query.options(*ITEM_LOAD_OPTIONS)
+                    .filter(ItemModel.id > last_id)
+                    .order_by(ItemModel.id)
+                    .limit(EXPORT_CHUNK_SIZE)
+                    .all()
+                )
+                chunk = SHARDS.in_order(chunk, key=lambda item: item.id)[:EXPORT_CHUNK_SIZE] #a chunk from each shard
+                if not chunk:
+                    break
+                for item in chunk:
+                    yield current_app.json.dumps(schema.dump(item)) + "\n"
+                last_id = chunk[-1].id
+                db.session.expunge_all() #drop the chunk from the session so it can be garbage collected
+
+        #stream_with_context keeps the app context (and so db.session) alive while the generator runs
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
@@ -0,0 +1,33 @@
+from flask import Response
+from flask.views import MethodView
+from flask_smorest import Blueprint
+
+from cache import RESPONSE_CACHE
+import metrics
+from db import db, pool_status
+from replicas import REPLICAS
+from schemas import CacheStatsSchema, PoolStatsSchema
+
+blp = Blueprint("Stats",__name__,description="Runtime statistics of this worker process")
+
+
+@blp.route("/cache/stats")
+class CacheStats(MethodView):
+    @blp.response(200, CacheStatsSchema)
+    def get(self): #hit/miss counters of this worker process
+        return RESPONSE_CACHE.stats()
+
+
+@blp.route("/db/stats")
+class PoolStats(MethodView):
+    @blp.response(200, PoolStatsSchema)
+    def get(self): #connection pool usage of this worker process, and which read replicas it is using
+        return {**pool_status(db.engine), "replicas": REPLICAS.status()}
+
+
+@blp.route("/metrics")
+class Metrics(MethodView):
+    @blp.response(200, description="Prometheus metrics of all the worker processes.", content_type="text/plain")
+    def get(self):
+        body, content_type = metrics.render()
+        return Response(body, content_type=content_type)
@@ -1,25 +1,45 @@
 import uuid
-from flask import request
+from flask import request, jsonify
 from flask.views import MethodView #used for creating a class and the methods of the class route to specific endpoint.
 from flask_smorest import Blueprint,abort
 
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.orm import selectinload
 
+from aggregates import store_stats
 from db import db
+from cache import RESPONSE_CACHE, store_cache_keys
+from replicas import REPLICAS
+from shards import SHARDS
+from etags import conditional, check_if_match, store_etag
+from fieldsets import fieldset_schema, fieldset_load_options
 from models import StoreModel
-from schemas import StoreSchema
+from pagination import paginate
+from schemas import StoreSchema, StorePageSchema, PageArgsSchema, FieldsetArgsSchema, StoreStatsArgsSchema, StoreStatsSchema
 
 #A blueprint in flask_smorest is used to divide an API into mulltiple segments
 
 #Create blueprint
 blp = Blueprint("stores",__name__,description="Operations on stores")  #The name stores is going to be used later on to refer to if we ever wanna create a link between two blueprints
 
+#StoreSchema dumps all the items and tags of a store, load them in batches so GET /store and GET /store/<id>
+#are always 3 queries (stores, items, tags) no matter how many stores are in the page, plus the ETag query of GET /store/<id>.
+STORE_LOADERS = {"items": selectinload(StoreModel.items), "tags": selectinload(StoreModel.tags)}
+
 
 @blp.route("/store/<int:store_id>") #This connects flask_smorest with the below flask methodview, 
 class Store(MethodView):
+    @REPLICAS.read_only
+    @conditional(etag=store_etag) #a 304 without loading the store and its items, see etags.py
+    @RESPONSE_CACHE.cached("store")
+    @SHARDS.route("store_id")
+    @blp.arguments(FieldsetArgsSchema, location="query")
     @blp.response(200, StoreSchema)
-    def get(self,store_id):   #so now if we make a get request, then this method will run
-        store = StoreModel.query.get_or_404(store_id)
+    def get(self,fieldset,store_id):   #so now if we make a get request, then this method will run
+        schema = fieldset_schema(StoreSchema, fieldset) #?exclude=items skips loading the items altogether
+        store = StoreModel.query.options(*fieldset_load_options(StoreModel, schema, STORE_LOADERS)).get_or_404(store_id)
+        if schema:
+            return jsonify(schema.dump(store))
         return store
     
         '''
@@ -32,10 +52,15 @@ class Store(MethodView):
         '''
 
 
+    @SHARDS.route("store_id")
+    @blp.alt_response(412, description="Returned when If-Match doesn't match the current ETag of the store.")
     def delete(self,store_id): #so now if we send a delete request, then this method will run
         store = StoreModel.query.get_or_404(store_id)
+        check_if_match(lambda: store_etag(store_id)) #not a dump of all its items
+        cache_keys = store_cache_keys(store)
         db.session.delete(store)
         db.session.commit()
+        RESPONSE_CACHE.invalidate(*cache_keys)
         
         return {"message":"Store deleted"}
         '''
@@ -49,19 +74,41 @@ class Store(MethodView):
         '''
 
 
+@blp.route("/store/<int:store_id>/stats")
+class StoreStats(MethodView):
+    @REPLICAS.read_only
+    @conditional
+    @SHARDS.route("store_id")
+    @blp.arguments(StoreStatsArgsSchema, location="query")
+    @blp.response(200, StoreStatsSchema)
+    def get(self,stats_args,store_id):
+        #Counts and price stats for a dashboard, without dumping every item like GET /store/<id> does
+        db.session.query(StoreModel.id).filter(StoreModel.id == store_id).first() or abort(404, message="Store not found.")
+        return store_stats(store_id, stats_args["percentiles"])
+
+
 #Getting all stores and creating new store will go to another methodview since the route is different.
 @blp.route("/store")
 class StoreList(MethodView):
-    @blp.response(200, StoreSchema(many=True))
-    def get(self):
+    @REPLICAS.read_only
+    @conditional
+    @blp.arguments(PageArgsSchema, location="query")
+    @blp.arguments(FieldsetArgsSchema, location="query")
+    @blp.response(200, StorePageSchema)
+    def get(self,page_args,fieldset):
         #return stores.values()
-        return StoreModel.query.all()
+        schema = fieldset_schema(StoreSchema, fieldset, many=True)
+        query = StoreModel.query.options(*fieldset_load_options(StoreModel, schema, STORE_LOADERS))
+        stores, next_cursor = paginate(query, StoreModel, page_args["limit"], page_args.get("after"))
+        if schema:
+            return jsonify({"stores":schema.dump(stores),"next":next_cursor})
+        return {"stores":stores,"next":next_cursor}
     
     @blp.arguments(StoreSchema)  #So, whenever client sends a data it passes through StoreSchema and it validates it and returns and argument that is a validated dictionary(which is in store_data)
     @blp.response(200,StoreSchema)
     def post(self,store_data):
         #Inserting data into database model using db.session.add(store) and then db.session.commit()
-        store = StoreModel(**store_data)
+        store = StoreModel(**store_data) #goes to the shard of the hash of its name, so the unique index still covers it
         try:
             db.session.add(store)
             db.session.commit()
@@ -1,27 +1,55 @@
 #Adding new endpoints for tag
+from flask import current_app, jsonify
 from flask.views import MethodView #used for creating a class and the methods of the class route to specific endpoint.
 from flask_smorest import Blueprint,abort
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import delete, exists, insert, select
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.orm import selectinload
 
-from db import db
-from models import TagModel, StoreModel, ItemModel
-from schemas import TagSchema, TagAndItemSchema
+from db import db, insert_ignoring_conflicts
+from cache import RESPONSE_CACHE, tag_cache_keys
+from replicas import REPLICAS
+from shards import SHARDS
+from etags import conditional, check_if_match, tag_etag
+from fieldsets import fieldset_schema, fieldset_load_options
+from models import TagModel, StoreModel, ItemModel, ItemTags
+from resources.item import ITEM_LOAD_OPTIONS
+from schemas import TagSchema, TagAndItemSchema, FieldsetArgsSchema, TagLinkBulkSchema, TagLinkBulkResultSchema
 
 
 blp = Blueprint("Tags",__name__,description="Operations on tags")
 
+#TagSchema dumps the store and the items of a tag. With these options GET /tag/<id> is 4 queries (ETag, tag, store, items)
+#and GET /store/<id>/tag is 4 (the store check plus the same 3) however many tags the store has.
+TAG_LOADERS = {"store": selectinload(TagModel.store), "items": selectinload(TagModel.items)}
+
 @blp.route("/store/<int:store_id>/tag")
 class TagsInStore(MethodView):
+    @REPLICAS.read_only
+    @conditional
+    @RESPONSE_CACHE.cached("store_tags")
+    @SHARDS.route("store_id")
+    @blp.arguments(FieldsetArgsSchema, location="query")
     @blp.response(200, TagSchema(many=True))
-    def get(self,store_id): #Gets a list of tags registered under the store id
-        store = StoreModel.query.get_or_404(store_id)
-
-        return store.tags.all()
+    def get(self,fieldset,store_id): #Gets a list of tags registered under the store id
+        StoreModel.query.get_or_404(store_id) #still 404 if the store doesn't exist
+
+        schema = fieldset_schema(TagSchema, fieldset, many=True)
+        tags = TagModel.query.filter(TagModel.store_id == store_id).options(*fieldset_load_options(TagModel, schema, TAG_LOADERS)).all()
+        if schema:
+            return jsonify(schema.dump(tags))
+        return tags
     
     #Creating tags for a store_id
+    @SHARDS.route("store_id")
     @blp.arguments(TagSchema)
     @blp.response(201,TagSchema)
     def post(self,tag_data,store_id):
+        #With shards the unique index on name only covers one of them (shards.py), so look at all of them first
+        if SHARDS.count() > 1:
+            with SHARDS.use(None):
+                if db.session.scalar(select(TagModel.id).where(TagModel.name == tag_data["name"])):
+                    abort(400, message="A tag with that name already exists.")
         tag = TagModel(**tag_data,store_id=store_id)
 
         try:
@@ -33,54 +61,157 @@ class TagsInStore(MethodView):
                 500,
                 message=str(e)
             )
+        RESPONSE_CACHE.invalidate(f"store:{store_id}", f"store_tags:{store_id}")
         return tag
 
 
+def _for_response(model, row_id, loaders):
+    #The row as it is after the commit, with the relationships its schema dumps loaded in one SELECT ... IN each
+    statement = select(model).where(model.id == row_id).options(*loaders)
+    return db.session.scalars(statement, execution_options={"populate_existing": True}).one()
+
+
+def linked(item_id, tag_id):
+    #One lookup in the unique (item_id, tag_id) index, however many tags the item or items the tag has
+    return db.session.scalar(select(exists().where(ItemTags.item_id == item_id, ItemTags.tag_id == tag_id)))
+
+
 @blp.route("/item/<int:item_id>/tag/<int:tag_id>")
 class LinkTagsToItem(MethodView):
+    @SHARDS.route("item_id")
     @blp.response(201,TagSchema)
     def post(self,item_id,tag_id): #This does not create a tag
-        item = ItemModel.query.get_or_404(item_id)
+        if SHARDS.of_id(tag_id) != SHARDS.current(): #the link row lives with the item, it can't point at another shard
+            abort(400, message="The item and the tag belong to different stores.")
+        ItemModel.query.get_or_404(item_id)
         tag = TagModel.query.get_or_404(tag_id)
 
-        item.tags.append(tag)
-
+        #We write the item_tags row ourselves instead of item.tags.append(tag), which loads every tag of the item first.
+        #item_tags is unique on (item_id, tag_id), linking twice is a no-op.
         try:
-            db.session.add(item)
+            if not linked(item_id, tag_id):
+                db.session.execute(insert(ItemTags).values(item_id=item_id, tag_id=tag_id))
             db.session.commit()
+        except IntegrityError: #somebody linked them at the same moment, same result
+            db.session.rollback()
         except SQLAlchemyError:
             abort(500, message="An error occured while inserting the tag")
+        RESPONSE_CACHE.invalidate(f"item:{item_id}", f"tag:{tag_id}", f"store_tags:{tag.store_id}")
         
-        return tag
+        return _for_response(TagModel, tag_id, TAG_LOADERS.values()) #with the new link
     
     #Unlinking items and tags
+    @SHARDS.route("item_id")
     @blp.response(200,TagAndItemSchema)
     def delete(self,item_id,tag_id):
-        item = ItemModel.query.get_or_404(item_id)
+        ItemModel.query.get_or_404(item_id)
         tag = TagModel.query.get_or_404(tag_id)
 
-        item.tags.remove(tag)
-
+        #Deletes the one item_tags row, item.tags.remove(tag) loaded all the tags of the item to do that
         try:
-            db.session.add(item)
+            unlinked = db.session.execute(
+                delete(ItemTags).where(ItemTags.item_id == item_id, ItemTags.tag_id == tag_id).execution_options(synchronize_session=False)
+            ).rowcount
             db.session.commit()
 
         except SQLAlchemyError:
             abort(500,message="An error occured while inserting the tag.")
+        if not unlinked:
+            abort(404, message="The item is not linked to this tag.")
+        RESPONSE_CACHE.invalidate(f"item:{item_id}", f"tag:{tag_id}", f"store_tags:{tag.store_id}")
         
-        return {"message":"Item removed from tag","item":item,"tag":tag}
+        item = _for_response(ItemModel, item_id, ITEM_LOAD_OPTIONS)
+        return {"message":"Item removed from tag","item":item,"tag":_for_response(TagModel, tag_id, TAG_LOADERS.values())}
+
+
+
+@blp.route("/item/tag/bulk")
+class LinkTagsToItemsBulk(MethodView):
+    @blp.arguments(TagLinkBulkSchema)
+    @blp.response(200,TagLinkBulkResultSchema)
+    def post(self,link_data):
+        #Many links in one request and one transaction. Items or tags that don't exist and pairs from two different
+        #stores go to "errors", pairs that are already linked to "already_linked", all the others get linked.
+        pairs = _link_pairs(link_data)
+        batch_size = current_app.config["BULK_INSERT_BATCH_SIZE"]
+        item_ids = sorted({item_id for item_id, _ in pairs})
+        tag_ids = sorted({tag_id for _, tag_id in pairs})
+
+        #Set based lookups, a few queries however many pairs there are
+        item_stores, tag_stores, existing = {}, {}, set()
+        for start in range(0, len(item_ids), batch_size):
+            chunk = item_ids[start:start + batch_size]
+            item_stores.update(db.session.execute(select(ItemModel.id, ItemModel.store_id).where(ItemModel.id.in_(chunk))).all())
+            existing.update(db.session.execute(
+                select(ItemTags.item_id, ItemTags.tag_id).where(ItemTags.item_id.in_(chunk), ItemTags.tag_id.in_(tag_ids))
+            ).all())
+        for start in range(0, len(tag_ids), batch_size):
+            chunk = tag_ids[start:start + batch_size]
+            tag_stores.update(db.session.execute(select(TagModel.id, TagModel.store_id).where(TagModel.id.in_(chunk))).all())
+
+        linked, already_linked, errors = [], [], []
+        for index, pair in enumerate(pairs):
+            item_id, tag_id = pair
+            if item_id not in item_stores:
+                errors.append({"index":index,"message":"Item not found."})
+            elif tag_id not in tag_stores:
+                errors.append({"index":index,"message":"Tag not found."})
+            elif item_stores[item_id] != tag_stores[tag_id]:
+                errors.append({"index":index,"message":"The item and the tag belong to different stores."})
+            elif pair in existing:
+                already_linked.append({"item_id":item_id,"tag_id":tag_id})
+            else:
+                existing.add(pair) #the same pair twice in the request is linked once
+                linked.append({"item_id":item_id,"tag_id":tag_id})
+
+        #ON CONFLICT DO NOTHING: a pair somebody linked since our lookup is skipped instead of failing everything
+        #The links of an item live on its shard, one transaction per shard
+        try:
+            statement = insert_ignoring_conflicts(ItemTags.__table__) #the table, an ORM executemany can't be sharded (shards.py)
+            for shard, shard_links in SHARDS.split(linked, lambda link: link["item_id"]):
+                with SHARDS.use(shard):
+                    for start in range(0, len(shard_links), batch_size):
+                        db.session.execute(statement, shard_links[start:start + batch_size])
+                    db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(500, message="An error occured while linking the tags.")
 
+        RESPONSE_CACHE.invalidate(
+            *{f"item:{link['item_id']}" for link in linked},
+            *{f"tag:{link['tag_id']}" for link in linked},
+            *{f"store_tags:{tag_stores[link['tag_id']]}" for link in linked},
+        )
+        return {"linked":linked,"already_linked":already_linked,"errors":errors}
+
+
+def _link_pairs(link_data):
+    #The three shapes of the request body as one list of (item_id, tag_id)
+    if "links" in link_data:
+        return [(link["item_id"], link["tag_id"]) for link in link_data["links"]]
+    if "tag_ids" in link_data:
+        return [(link_data["item_id"], tag_id) for tag_id in link_data["tag_ids"]]
+    return [(item_id, link_data["tag_id"]) for item_id in link_data["item_ids"]]
 
 
 @blp.route("/tag/<int:tag_id>")
 class Tag(MethodView):
     #Getting tags based on tag id
+    @REPLICAS.read_only
+    @conditional(etag=tag_etag) #a 304 without loading the tag and its items, see etags.py
+    @RESPONSE_CACHE.cached("tag")
+    @SHARDS.route("tag_id")
+    @blp.arguments(FieldsetArgsSchema, location="query")
     @blp.response(200, TagSchema)
-    def get(self,tag_id):
-        tag = TagModel.query.get_or_404(tag_id)
+    def get(self,fieldset,tag_id):
+        schema = fieldset_schema(TagSchema, fieldset)
+        tag = TagModel.query.options(*fieldset_load_options(TagModel, schema, TAG_LOADERS)).get_or_404(tag_id)
+        if schema:
+            return jsonify(schema.dump(tag))
         return tag
     
     #Deleting a tag
+    @SHARDS.route("tag_id")
     @blp.response(
         202,
         description="Deletes any tag if no item is tagged with it.",
@@ -90,12 +221,16 @@ class Tag(MethodView):
     @blp.alt_response(
         400,
         description="Returned if the tag is assigned to one or more items. In this case, the tag is not deleted.")
+    @blp.alt_response(412, description="Returned when If-Match doesn't match the current ETag of the tag.")
     def delete(self,tag_id):
         tag = TagModel.query.get_or_404(tag_id)
+        check_if_match(lambda: tag_etag(tag_id))
 
-        if not tag.items:
+        if not db.session.scalar(select(exists().where(ItemTags.tag_id == tag_id))): #not tag.items, without loading them
+            cache_keys = tag_cache_keys(tag)
             db.session.delete(tag)
             db.session.commit()
+            RESPONSE_CACHE.invalidate(*cache_keys)
             return {"message":"Tag deleted."}
         abort(
             400,
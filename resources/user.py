@@ -1,10 +1,14 @@
 from flask.views import MethodView 
 from flask_smorest import Blueprint,abort
-from passlib.hash import pbkdf2_sha256  #SHA 256 is a hashing algorithm, to hash the password that client sends us
 from flask_jwt_extended import create_access_token,create_refresh_token,get_jwt_identity, jwt_required, get_jwt #Access token is a combination of numbers and characters that we are going to generate in the server, we're going to send it to the client. (And only way to get this access token is by providing correct username and password)
 
 from db import db
 from blocklist import BLOCKLIST
+from passwords import PASSWORDS #hashes in a small thread pool, see passwords.py
+from ratelimit import RATE_LIMITS
+from admission import ADMISSION
+from replicas import REPLICAS
+from etags import conditional, check_if_match, current_etag
 from models import UserModel
 from schemas import UserSchema
 
@@ -14,14 +18,17 @@ blp = Blueprint("Users",__name__,description="Operations on users")
 #User registration endpoint
 @blp.route("/register")
 class UserRegister(MethodView):
+    @ADMISSION.limit("auth")
     @blp.arguments(UserSchema)
+    @blp.alt_response(429, description="Too many registrations from this IP, see the Retry-After header.")
     def post(self, user_data):
+        RATE_LIMITS.hit_client("REGISTER_LIMIT_PER_IP") #before the query and the pbkdf2
         if UserModel.query.filter(UserModel.username == user_data["username"]).first():
             abort(409, message="A user with that username already exists.")
         
         user = UserModel(   
             username = user_data["username"],
-            password = pbkdf2_sha256.hash(user_data["password"]) 
+            password = PASSWORDS.hash(user_data["password"]) 
         ) #hash the password before sending to the database.
 
         db.session.add(user)
@@ -32,16 +39,25 @@ class UserRegister(MethodView):
 #Login endpoint
 @blp.route("/login")
 class UserLogin(MethodView):
+    @ADMISSION.limit("auth")
     @blp.arguments(UserSchema)
+    @blp.alt_response(429, description="Too many attempts for this username or from this IP, see the Retry-After header.")
     def post(self, user_data):
+        #Every attempt counts, a wrong password costs us as much pbkdf2 as a right one
+        RATE_LIMITS.hit_client("LOGIN_LIMIT_PER_IP")
+        RATE_LIMITS.hit("LOGIN_LIMIT_PER_USERNAME", user_data["username"])
         user = UserModel.query.filter(
             UserModel.username == user_data["username"]
         ).first()
 
-        if user and pbkdf2_sha256.verify(user_data["password"],user.password):  #checks if the password that user sent us can be hashed exactly as the password already in the database, match or not
-            access_token = create_access_token(identity=user.id,fresh=True)
+        matches, new_hash = PASSWORDS.verify(user_data["password"],user.password) if user else (False, None)
+        if matches:  #checks if the password that user sent us can be hashed exactly as the password already in the database, match or not
+            if new_hash: #the stored hash was made with old settings, replace it now that we know the password
+                user.password = new_hash
+                db.session.commit()
+            access_token = create_access_token(identity=str(user.id),fresh=True) #"sub" has to be a string, PyJWT checks it
             #a refresh token
-            refresh_token = create_refresh_token(identity=user.id)
+            refresh_token = create_refresh_token(identity=str(user.id))
             return {"access_token":access_token,"refresh_token":refresh_token} #access_token in our case is JWT and it is encoded, so we can decode it.
         
         abort(401,message="Invalid credentials.")
@@ -53,8 +69,8 @@ class TokenRefresh(MethodView):
     def post(self):
         current_user = get_jwt_identity()
         new_token = create_access_token(identity=current_user,fresh=False)
-        jti = get_jwt()["jti"]
-        BLOCKLIST.add(jti)
+        jwt = get_jwt()
+        BLOCKLIST.add(jwt["jti"], jwt.get("exp")) #the blocklist entry can go once the token has expired
         return {"access_token":new_token}
 
 
@@ -63,8 +79,8 @@ class TokenRefresh(MethodView):
 class UserLogout(MethodView):
     @jwt_required()
     def post(self):
-        jti = get_jwt()["jti"]
-        BLOCKLIST.add(jti)
+        jwt = get_jwt()
+        BLOCKLIST.add(jwt["jti"], jwt.get("exp"))
         return {"message": "Successfully logged out."}
 
 
@@ -72,14 +88,18 @@ class UserLogout(MethodView):
 @blp.route("/user/<int:user_id>")
 class User(MethodView):
     #To get user by his id
+    @REPLICAS.read_only
+    @conditional
     @blp.response(200,UserSchema)
     def get(self, user_id):
         user = UserModel.query.get_or_404(user_id)
         return user
     
     #To delete a user by his id
+    @blp.alt_response(412, description="Returned when If-Match doesn't match the current ETag of the user.")
     def delete(self,user_id):
         user = UserModel.query.get_or_404(user_id)
+        check_if_match(lambda: current_etag(user, UserSchema()))
         db.session.delete(user)
         db.session.commit()
         return {"message":"User deleted"},200
@@ -1,5 +1,33 @@
 #We write our marshmallow schemas here
-from marshmallow import Schema, fields
+from flask import current_app
+from marshmallow import Schema, ValidationError, fields, pre_load, validate, validates_schema
+from webargs.fields import DelimitedList
+
+from aggregates import DEFAULT_PERCENTILES
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from serializers import FAST_SERIALIZER
+from timing import REQUEST_TIMING
+
+MAX_BULK_LINKS = 10000 #pairs per POST /item/tag/bulk
+
+
+#All our schemas inherit this so the request timing (timing.py) can see how long dumping takes,
+#and so big lists can go through the compiled serializer (serializers.py)
+class BaseSchema(Schema):
+    def dump(self, obj, *, many=None):
+        if not REQUEST_TIMING.enabled:
+            return self._fast_or_marshmallow_dump(obj, many)
+        REQUEST_TIMING.dump_started()
+        try:
+            return self._fast_or_marshmallow_dump(obj, many)
+        finally:
+            REQUEST_TIMING.dump_finished()
+
+    def _fast_or_marshmallow_dump(self, obj, many):
+        fast_dump = FAST_SERIALIZER.for_dump(self, obj, many) #None for small dumps, same output either way
+        if fast_dump is not None:
+            return fast_dump(obj)
+        return super().dump(obj, many=many)
 
 #We have defined the schema,
 #Now we gonna rename this to PlainItemSchema and remove store_id
@@ -12,13 +40,13 @@ class ItemSchema(Schema):
 
     #It will check the fields that have required=True are there or not and the price is a float or not.
 """
-class PlainItemSchema(Schema):
+class PlainItemSchema(BaseSchema):
     id = fields.Int(dump_only=True) #we only want to use it when returning data
     name = fields.Str(required=True) #because it is something we recieve in the JSON payload of a request
     price = fields.Float(required=True)
     
 
-class ItemUpdateSchema(Schema):
+class ItemUpdateSchema(BaseSchema):
     #When we update, we need to make sure that name and price are there.
     name = fields.Str() 
     price = fields.Float()  #they dont have to send both price and name
@@ -30,12 +58,12 @@ class StoreSchema(Schema):
     id = fields.Str(dump_only=True)
     name = fields.Str(required=True)
 """
-class PlainStoreSchema(Schema):
+class PlainStoreSchema(BaseSchema):
     id = fields.Int(dump_only=True)
     name = fields.Str(required=True)
 
 
-class PlainTagSchema(Schema):
+class PlainTagSchema(BaseSchema):
     id = fields.Int(dump_only=True)
     name = fields.Str()
 
@@ -46,6 +74,65 @@ class ItemSchema(PlainItemSchema):
     store = fields.Nested(PlainStoreSchema(),dump_only=True) #this will be used only when returning data from client
     tags = fields.List(fields.Nested(PlainTagSchema()),dump_only=True)
 
+#One row of PUT /item/bulk: everything a PUT /item/<id> needs to create the item
+class ItemUpsertSchema(PlainItemSchema):
+    id = fields.Int(required=True,validate=validate.Range(min=1))
+    store_id = fields.Int(required=True) #only used when the item is created, an existing item keeps its store
+
+#The bodies of POST and PUT /item/bulk: lists of those rows, at most BULK_MAX_ITEMS of them. Checked before any
+#row is validated, so an oversized request is refused without going through it.
+def _at_most_bulk_max_items(data, many):
+    if many and isinstance(data, list):
+        validate.Length(max=current_app.config["BULK_MAX_ITEMS"])(data)
+    return data
+
+class ItemBulkSchema(ItemSchema):
+    @pre_load(pass_collection=True)
+    def limit_rows(self, data, many, **kwargs):
+        return _at_most_bulk_max_items(data, many)
+
+class ItemUpsertBulkSchema(ItemUpsertSchema):
+    @pre_load(pass_collection=True)
+    def limit_rows(self, data, many, **kwargs):
+        return _at_most_bulk_max_items(data, many)
+
+class TagLinkSchema(BaseSchema):
+    item_id = fields.Int(required=True)
+    tag_id = fields.Int(required=True)
+
+#POST /item/tag/bulk takes one of: {"links": [{"item_id": 1, "tag_id": 2}, ...]},
+#{"item_id": 1, "tag_ids": [2, 3]} or {"tag_id": 2, "item_ids": [1, 4]}
+class TagLinkBulkSchema(BaseSchema):
+    links = fields.List(fields.Nested(TagLinkSchema()),validate=validate.Length(min=1,max=MAX_BULK_LINKS))
+    item_id = fields.Int()
+    tag_ids = fields.List(fields.Int(),validate=validate.Length(min=1,max=MAX_BULK_LINKS))
+    tag_id = fields.Int()
+    item_ids = fields.List(fields.Int(),validate=validate.Length(min=1,max=MAX_BULK_LINKS))
+
+    @validates_schema
+    def validate_one_form(self, data, **kwargs):
+        forms = [("links" in data), ("item_id" in data or "tag_ids" in data), ("tag_id" in data or "item_ids" in data)]
+        complete = ["links" in data, "item_id" in data and "tag_ids" in data, "tag_id" in data and "item_ids" in data]
+        if forms.count(True) != 1 or forms != complete:
+            raise ValidationError("Send either links, or item_id with tag_ids, or tag_id with item_ids.")
+
+class BulkErrorSchema(BaseSchema):
+    index = fields.Int() #position of the failed row in the request array
+    message = fields.Str()
+
+class ItemBulkResultSchema(BaseSchema):
+    created = fields.List(fields.Int()) #ids of the items that were inserted, in request order
+    errors = fields.List(fields.Nested(BulkErrorSchema()))
+
+class ItemUpsertBulkResultSchema(BaseSchema):
+    upserted = fields.List(fields.Int()) #ids of the items that were created or updated, in request order
+    errors = fields.List(fields.Nested(BulkErrorSchema()))
+
+class TagLinkBulkResultSchema(BaseSchema):
+    linked = fields.List(fields.Nested(TagLinkSchema())) #pairs this request linked
+    already_linked = fields.List(fields.Nested(TagLinkSchema())) #pairs that were linked before (or twice in the request), left as they are
+    errors = fields.List(fields.Nested(BulkErrorSchema())) #index into the list of pairs, in the order they were sent
+
 class StoreSchema(PlainStoreSchema):
     items = fields.List(fields.Nested(PlainItemSchema()),dump_only=True)
     tags = fields.List(fields.Nested(PlainTagSchema),dump_only=True)
@@ -55,13 +142,119 @@ class TagSchema(PlainTagSchema):
     store = fields.Nested(PlainStoreSchema(),dump_only=True)
     items = fields.List(fields.Nested(PlainItemSchema()),dump_only=True)
 
-class TagAndItemSchema(Schema):
+class TagAndItemSchema(BaseSchema):
     message = fields.Str()
     item = fields.Nested(ItemSchema)
     tag = fields.Nested(TagSchema)
     
 
-class UserSchema(Schema):
+class UserSchema(BaseSchema):
     id = fields.Int(dump_only=True)
     username = fields.Str(required=True)
-    password = fields.Str(required=True,load_only=True)
\ No newline at end of file
+    password = fields.Str(required=True,load_only=True)
+
+
+#Query string arguments for sparse fieldsets (GET /item?fields=id,name or ?exclude=tags), see fieldsets.py
+class FieldsetArgsSchema(BaseSchema):
+    only = DelimitedList(fields.Str(), data_key="fields") #comma separated, nested fields with a dot: store.name
+    exclude = DelimitedList(fields.Str())
+
+#Query string arguments for the paginated list endpoints (GET /item?limit=50&after=<cursor>)
+class PageArgsSchema(BaseSchema):
+    limit = fields.Int(load_default=DEFAULT_PAGE_SIZE,validate=validate.Range(min=1,max=MAX_PAGE_SIZE))
+    after = fields.Str() #the "next" cursor from the previous page, leave it out for the first page
+
+#GET /item/search, every filter is optional and they are combined with AND
+class ItemSearchArgsSchema(PageArgsSchema):
+    q = fields.Str(validate=[validate.Length(max=200),validate.Regexp(r"\s*\S",error="q needs at least one word.")]) #words that all have to be in the name
+    name = fields.Str(validate=validate.Length(min=1,max=80)) #name starts with this (case sensitive, uses the unique index on name)
+    min_price = fields.Float()
+    max_price = fields.Float()
+    store_id = fields.Int()
+    tags = DelimitedList(fields.Int()) #tag ids, the item must have all of them
+    sort = fields.Str(load_default="id",validate=validate.OneOf(["id","-id","name","-name","price","-price"])) #"-" for descending
+
+    @validates_schema
+    def validate_price_range(self, data, **kwargs):
+        if "min_price" in data and "max_price" in data and data["min_price"] > data["max_price"]:
+            raise ValidationError("min_price can't be bigger than max_price.", "min_price")
+
+#POST /item/import, multipart upload of a CSV or NDJSON file, see importer.py
+class ImportFileSchema(BaseSchema):
+    file = fields.Raw(required=True,metadata={"type":"string","format":"binary"})
+
+class ImportArgsSchema(BaseSchema):
+    format = fields.Str(validate=validate.OneOf(["csv","ndjson"])) #default: from the file name
+    chunk_size = fields.Int(validate=validate.Range(min=1,max=100000)) #default: IMPORT_CHUNK_SIZE
+    create_missing = fields.Bool(load_default=True) #create stores and tags that don't exist yet
+
+class ImportErrorSchema(BaseSchema):
+    line = fields.Int()
+    message = fields.Str()
+
+class ImportResultSchema(BaseSchema):
+    job_id = fields.Int()
+    source = fields.Str()
+    finished = fields.Bool()
+    already_imported = fields.Bool() #the same file was imported completely before, nothing was done
+    resumed_from_row = fields.Int() #rows an earlier interrupted upload of the same file had already committed
+    rows = fields.Int() #rows read by this request
+    items_created = fields.Int() #this and errors are totals for the file, earlier attempts included
+    errors = fields.Int()
+    error_samples = fields.List(fields.Nested(ImportErrorSchema())) #the first 100
+    seconds = fields.Float()
+    rows_per_second = fields.Int()
+
+class ItemPageSchema(BaseSchema):
+    items = fields.List(fields.Nested(ItemSchema()))
+    next = fields.Str(allow_none=True) #None when there are no more pages
+
+class StorePageSchema(BaseSchema):
+    stores = fields.List(fields.Nested(StoreSchema()))
+    next = fields.Str(allow_none=True)
+
+#GET /store/<id>/stats?percentiles=50,95, see aggregates.py
+class StoreStatsArgsSchema(BaseSchema):
+    percentiles = DelimitedList(fields.Float(validate=validate.Range(min=0,max=100)),load_default=lambda: list(DEFAULT_PERCENTILES),validate=validate.Length(min=1,max=20))
+
+class PriceStatsSchema(BaseSchema):
+    min = fields.Float(allow_none=True) #all None when the store has no items
+    max = fields.Float(allow_none=True)
+    mean = fields.Float(allow_none=True)
+    percentiles = fields.Dict(keys=fields.Str(),values=fields.Float(allow_none=True)) #{"p50": 9.99, "p90": ...}
+
+class TagItemCountSchema(BaseSchema):
+    id = fields.Int()
+    name = fields.Str()
+    item_count = fields.Int()
+
+class StoreStatsSchema(BaseSchema):
+    store_id = fields.Int()
+    item_count = fields.Int()
+    tag_count = fields.Int()
+    price = fields.Nested(PriceStatsSchema())
+    tags = fields.List(fields.Nested(TagItemCountSchema()))
+
+class CacheStatsSchema(BaseSchema):
+    enabled = fields.Bool()
+    size = fields.Int() #entries currently cached
+    hits = fields.Int()
+    misses = fields.Int()
+    invalidations = fields.Int()
+
+class ReplicaStatusSchema(BaseSchema):
+    index = fields.Int() #position in DATABASE_REPLICA_URLS
+    healthy = fields.Bool()
+    retry_in_seconds = fields.Float() #0 unless it failed recently
+
+class PoolStatsSchema(BaseSchema):
+    pool = fields.Str() #pool class, QueuePool unless we are on an in-memory SQLite database
+    checkouts = fields.Int()
+    timeouts = fields.Int()
+    wait_seconds_total = fields.Float()
+    wait_seconds_max = fields.Float()
+    size = fields.Int() #the fields below are only there for a QueuePool
+    checked_out = fields.Int()
+    checked_in = fields.Int()
+    overflow = fields.Int()
+    replicas = fields.List(fields.Nested(ReplicaStatusSchema())) #empty without DATABASE_REPLICA_URLS
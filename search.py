@@ -0,0 +1,79 @@
+"""
+search.py
+
+Full-text and prefix matching on item names for GET /item/search?q=... and ?name=...
+
+SQLite: an FTS5 table, items_fts, over items.name. It is an "external content" table so the
+names are not stored twice, the triggers below keep it in sync with items.
+Postgres: a GIN index on to_tsvector('simple', name), searched with plainto_tsquery.
+Any other database falls back to LIKE '%word%', which reads the whole table.
+
+The migration creates all of this, and install() makes db.create_all() (benchmarks, local
+scripts) do the same. Careful with batch_alter_table("items") in a future migration: on SQLite
+it recreates the table, which drops the triggers, so that migration has to create them again.
+"""
+from sqlalchemy import DDL, and_, column, event, func, literal_column, table
+
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE items_fts USING fts5(name, content='items', content_rowid='id')",
+    """CREATE TRIGGER items_fts_insert AFTER INSERT ON items BEGIN
+        INSERT INTO items_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER items_fts_delete AFTER DELETE ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER items_fts_update AFTER UPDATE OF name ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO items_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+)
+
+POSTGRES_DDL = (
+    "CREATE INDEX ix_items_name_tsv ON items USING gin (to_tsvector('simple', name))",
+    "CREATE INDEX ix_items_name_pattern ON items (name text_pattern_ops)", #LIKE 'prefix%' with any collation
+)
+
+POSTGRES_INDEXES = ("ix_items_name_tsv", "ix_items_name_pattern")
+
+items_fts = table("items_fts", column("rowid"), column("items_fts"))
+
+
+def install(items_table):
+    #Runs the statements above right after CREATE TABLE items, only on the matching database
+    for statement in SQLITE_DDL:
+        event.listen(items_table, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+    for statement in POSTGRES_DDL:
+        event.listen(items_table, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+
+def include_name(name, type_, parent_names):
+    #For flask db migrate (Migrate in app.py): none of this is in the models, autogenerate must not drop it
+    if type_ == "table" and name.startswith("items_fts"): #FTS5 adds items_fts_data, items_fts_idx...
+        return False
+    return not (type_ == "index" and name in POSTGRES_INDEXES)
+
+
+def match_names(query, model, text, dialect):
+    #Keeps the items whose name has every word of text (in any order, case insensitive).
+    #Returns the query and the id column to order and paginate by.
+    words = text.split()
+    if dialect == "sqlite":
+        #Each word in double quotes so FTS5 treats it as a plain string and not as query syntax (AND, NEAR, *...)
+        fts_query = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+        #Joined and ordered by the FTS rowid: FTS5 hands the matches out in rowid order and stops after the page,
+        #"id IN (SELECT rowid ...)" or ORDER BY items.id collects every match first (300ms for a word in all names of 1M items)
+        query = query.join(items_fts, items_fts.c.rowid == model.id).filter(items_fts.c.items_fts.match(fts_query))
+        return query, items_fts.c.rowid
+    if dialect == "postgresql":
+        #'simple' inlined, not a parameter, so the expression is the one of the index
+        config = literal_column("'simple'")
+        return query.filter(func.to_tsvector(config, model.name).op("@@")(func.plainto_tsquery(config, " ".join(words)))), model.id
+    return query.filter(*(func.lower(model.name).contains(word.lower(), autoescape=True) for word in words)), model.id
+
+
+def name_starts_with(name_column, prefix, dialect):
+    if dialect == "sqlite":
+        #LIKE is case insensitive on SQLite and can't use the index on name, a range can
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return and_(name_column >= prefix, name_column < upper)
+    return name_column.startswith(prefix, autoescape=True)
@@ -0,0 +1,166 @@
+"""
+seed.py
+
+`flask seed` fills the database with generated stores, items, tags, item <-> tag links and users,
+for benchmarks and load tests. The same --seed always gives the same data.
+
+Rows get explicit ids (after the biggest id already in each table) and go in with plain
+executemany INSERTs of --batch-size rows, so millions of rows take seconds. All the seeded
+users share one password hash, hashing pbkdf2 a million times would take hours.
+
+With shards (shards.py), --shard picks the one the stores, items and tags go to. Their ids
+start at the shard's id range, users always go to shard 0. A store has to be on the shard its
+name hashes to (that is where POST /store looks for a duplicate name), so a seeded store name
+gets a suffix until it hashes to --shard, e.g. "store-100000001-3".
+
+    flask seed --stores 1000 --items-per-store 1000 --tags-per-store 20 --tags-per-item 3
+"""
+import random
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, inspect, select, text
+
+from db import db
+from models import StoreModel, ItemModel, TagModel, ItemTags, UserModel
+from passwords import PASSWORDS
+from shards import SHARDS, ID_SPAN
+
+SEED_PASSWORD = "password" #every seeded user can log in with this
+
+
+def _next_id(model, floor=0):
+    return max(db.session.scalar(select(func.max(model.id))) or 0, floor) + 1
+
+
+def _store_name(store_id):
+    #"store-<id>", or with shards the first "store-<id>-<n>" that hashes to the shard we are seeding
+    name, suffix = f"store-{store_id}", 0
+    while SHARDS.count() > 1 and SHARDS.for_store_name(name) != SHARDS.current():
+        suffix += 1
+        name = f"store-{store_id}-{suffix}"
+    return name
+
+
+class _BatchWriter:
+    #Collects rows for one table and INSERTs them batch_size at a time. Rows of the tables in "before"
+    #are written first, so a foreign key never points at a row that isn't in the database yet.
+    def __init__(self, connection, model, batch_size, before=()):
+        self.connection = connection
+        self.table = model.__table__
+        self.batch_size = batch_size
+        self.before = before
+        self.rows = []
+        self.count = 0
+        self.statement = None
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for writer in self.before:
+            writer.flush()
+        if not self.rows:
+            return
+        if self.statement is None:
+            self.statement = self.table.insert().compile(dialect=self.connection.dialect, column_keys=list(self.rows[0]))
+        #Straight to the driver's executemany, building SQLAlchemy parameters for millions of rows costs more than the INSERT
+        if self.statement.positional:
+            params = [tuple(row[key] for key in self.statement.positiontup) for row in self.rows]
+        else:
+            params = self.rows
+        self.connection.exec_driver_sql(self.statement.string, params)
+        self.count += len(self.rows)
+        self.rows = []
+
+
+def generate(stores, items_per_store, tags_per_store=0, tags_per_item=0, users=0, seed=0, batch_size=10000, shard=0):
+    #Returns how many rows went into each table
+    with SHARDS.use(shard):
+        return _generate(stores, items_per_store, tags_per_store, tags_per_item, users, seed, batch_size, shard * ID_SPAN)
+
+
+def _generate(stores, items_per_store, tags_per_store, tags_per_item, users, seed, batch_size, id_floor):
+    rng = random.Random(seed)
+    tags_per_item = min(tags_per_item, tags_per_store)
+    first_store, first_item, first_tag, first_user = (
+        _next_id(StoreModel, id_floor), _next_id(ItemModel, id_floor), _next_id(TagModel, id_floor), _next_id(UserModel)
+    )
+    connection = db.session.connection() #the shard in use
+    users_connection = db.session.connection(bind_arguments={"mapper": inspect(UserModel)}) #shard 0, the same one without shards
+    stores_writer = _BatchWriter(connection, StoreModel, batch_size)
+    tags_writer = _BatchWriter(connection, TagModel, batch_size, before=[stores_writer])
+    items_writer = _BatchWriter(connection, ItemModel, batch_size, before=[stores_writer, tags_writer])
+    writers = {
+        StoreModel: stores_writer,
+        TagModel: tags_writer,
+        ItemModel: items_writer,
+        ItemTags: _BatchWriter(connection, ItemTags, batch_size, before=[items_writer]),
+        UserModel: _BatchWriter(users_connection, UserModel, batch_size),
+    }
+
+    item_id = first_item
+    for store_number in range(stores):
+        store_id = first_store + store_number
+        writers[StoreModel].add({"id": store_id, "name": _store_name(store_id)})
+        store_first_tag = first_tag + store_number * tags_per_store
+        for tag_id in range(store_first_tag, store_first_tag + tags_per_store):
+            writers[TagModel].add({"id": tag_id, "name": f"tag-{tag_id}", "store_id": store_id})
+
+        for _ in range(items_per_store):
+            writers[ItemModel].add({
+                "id": item_id, "name": f"item-{item_id}", "price": round(rng.uniform(1, 500), 2), "store_id": store_id
+            })
+            for tag_id in rng.sample(range(store_first_tag, store_first_tag + tags_per_store), tags_per_item):
+                writers[ItemTags].add({"item_id": item_id, "tag_id": tag_id})
+            item_id += 1
+
+    if users:
+        password = PASSWORDS.hash(SEED_PASSWORD)
+        for user_id in range(first_user, first_user + users):
+            writers[UserModel].add({"id": user_id, "username": f"user-{user_id}", "password": password})
+
+    for writer in writers.values(): #in dict order, which is also foreign key order
+        writer.flush()
+
+    #We wrote the ids ourselves, move the sequences past them so the next INSERT doesn't clash
+    for model, model_connection in ((StoreModel, connection), (TagModel, connection), (ItemModel, connection), (UserModel, users_connection)):
+        if model_connection.dialect.name == "postgresql":
+            table = model.__tablename__
+            model_connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))"
+            ))
+
+    db.session.commit()
+    return {
+        "stores": writers[StoreModel].count,
+        "tags": writers[TagModel].count,
+        "items": writers[ItemModel].count,
+        "item_tags": writers[ItemTags].count,
+        "users": writers[UserModel].count,
+    }
+
+
+@click.command("seed")
+@click.option("--stores", default=10, show_default=True, help="Stores to create.")
+@click.option("--items-per-store", default=100, show_default=True)
+@click.option("--tags-per-store", default=10, show_default=True)
+@click.option("--tags-per-item", default=2, show_default=True, help="Tags linked to every item, picked from its store's tags.")
+@click.option("--users", default=0, show_default=True, help=f"Users to create, all with the password {SEED_PASSWORD!r}.")
+@click.option("--seed", "seed_value", default=0, show_default=True, help="Random seed, same seed same data.")
+@click.option("--batch-size", default=10000, show_default=True, help="Rows per INSERT.")
+@click.option("--shard", default=0, show_default=True, help="Shard for the stores, items and tags, see shards.py.")
+@with_appcontext
+def seed_command(stores, items_per_store, tags_per_store, tags_per_item, users, seed_value, batch_size, shard):
+    """Generate stores, items, tags, links and users."""
+    if not 0 <= shard < SHARDS.count():
+        raise click.BadParameter(f"there are {SHARDS.count()} shards", param_hint="--shard")
+    start = time.perf_counter()
+    counts = generate(stores, items_per_store, tags_per_store, tags_per_item, users, seed_value, batch_size, shard)
+    seconds = time.perf_counter() - start
+    total = sum(counts.values())
+    click.echo(", ".join(f"{count} {table}" for table, count in counts.items()))
+    click.echo(f"{total} rows in {seconds:.2f}s ({total / seconds if seconds else 0:.0f} rows/s)")
@@ -0,0 +1,150 @@
+"""
+serializers.py
+
+A fast path for dumping big lists. Marshmallow goes through every field of every object
+with a few method calls each (serialize -> get_value -> _serialize -> _format_num...), which
+is most of the time of a GET /item with 500 items and their store and tags.
+
+compile_schema() turns a schema instance into a plain function obj -> dict once: for each
+field the attribute to read, the key to write and the conversion to apply (int, float, str,
+or the compiled function of a nested schema). The dicts it builds are equal to what
+schema.dump() returns, so jsonify turns them into exactly the same bytes. Only the field
+types our schemas use are compiled (Int, Float, Str, Nested, List of those); a schema with
+anything else, or with pre_dump/post_dump hooks, keeps using marshmallow.
+
+BaseSchema.dump (schemas.py) asks FAST_SERIALIZER whether to use it: only for dumps with at
+least FAST_SERIALIZER_MIN_ROWS rows, a many=True dump or a page like {"items": [...]}.
+Small dumps are not worth it and stay on the path everybody knows.
+"""
+import functools
+
+from marshmallow import fields, missing
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+
+DEFAULT_MIN_ROWS = 100
+
+
+class NotCompilable(Exception):
+    pass
+
+
+def _text(value):
+    #same as marshmallow's String field
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return str(value)
+
+
+SCALARS = {
+    fields.Integer: int,
+    fields.Float: float,
+    fields.String: _text,
+}
+
+
+def _list_of(convert):
+    return lambda values: [convert(value) for value in values]
+
+
+def _compile_field(field):
+    #The conversion for one field, None values are handled by the caller like marshmallow does
+    kind = type(field)
+    if kind in SCALARS:
+        if getattr(field, "as_string", False):
+            raise NotCompilable(field)
+        return SCALARS[kind]
+    if kind is fields.Nested:
+        schema = field.schema #already carries only/exclude, also the ones from the parent (fields=store.name)
+        dump_one = compile_schema(schema)
+        if schema.many or field.many:
+            return _list_of(dump_one)
+        return dump_one
+    if kind is fields.List:
+        inner = _compile_field(field.inner)
+        return lambda values: [None if value is None else inner(value) for value in values]
+    raise NotCompilable(field)
+
+
+def compile_schema(schema):
+    #Returns a function that dumps ONE object like schema.dump(obj, many=False) would
+    if schema._hooks[PRE_DUMP] or schema._hooks[POST_DUMP]:
+        raise NotCompilable(schema)
+
+    accessors = []
+    list_attributes = [] #what FastSerializer.rows counts for a single object, e.g. "items" of a page
+    for name, field in schema.dump_fields.items():
+        attribute = field.attribute or name
+        if "." in attribute or field.dump_default is not missing:
+            raise NotCompilable(field)
+        key = field.data_key if field.data_key is not None else name
+        accessors.append((key, attribute, _compile_field(field)))
+        if type(field) is fields.List or (type(field) is fields.Nested and (field.many or field.schema.many)):
+            list_attributes.append(attribute)
+    accessors = tuple(accessors)
+
+    def dump_one(obj):
+        #SQLAlchemy keeps the loaded columns and relationships in the instance __dict__, reading them
+        #from there skips the instrumented attribute. Anything else (not loaded yet, a property) goes
+        #through getattr like marshmallow does. Our envelopes ({"items": ..., "next": ...}) are dicts.
+        values = obj if isinstance(obj, dict) else obj.__dict__
+        data = {}
+        for key, attribute, convert in accessors:
+            value = values.get(attribute, missing)
+            if value is missing:
+                value = getattr(obj, attribute, missing)
+                if value is missing: #marshmallow leaves the key out
+                    continue
+            data[key] = None if value is None else convert(value)
+        return data
+
+    dump_one.list_attributes = tuple(list_attributes)
+    return dump_one
+
+
+def schema_key(schema):
+    #Two schemas with the same key dump the same fields the same way. fieldsets.py builds a new instance for every
+    #request with ?fields=, so the instance itself (or its id(), which gets reused) is no good as a key.
+    only = None if schema.only is None else frozenset(schema.only)
+    return type(schema), only, frozenset(schema.exclude), schema.many
+
+
+class FastSerializer:
+    def __init__(self):
+        self.min_rows = DEFAULT_MIN_ROWS
+        self.compiled = {} #schema_key(schema) -> dump_one, or None when it can't be compiled
+
+    def init_app(self, app):
+        self.min_rows = app.config.get("FAST_SERIALIZER_MIN_ROWS", DEFAULT_MIN_ROWS) #0 turns it off
+
+    def _compiled(self, schema):
+        key = schema_key(schema)
+        if key in self.compiled:
+            return self.compiled[key]
+        try:
+            dump_one = compile_schema(schema)
+        except NotCompilable:
+            dump_one = None
+        if len(self.compiled) < 1000: #one per fieldset asked for, a client trying every combination doesn't fill the memory
+            self.compiled[key] = dump_one
+        return dump_one
+
+    def rows(self, dump_one, obj, many):
+        if many:
+            return len(obj) if hasattr(obj, "__len__") else 0
+        get = obj.get if isinstance(obj, dict) else functools.partial(getattr, obj)
+        return sum(len(get(attribute, None) or ()) for attribute in dump_one.list_attributes)
+
+    def for_dump(self, schema, obj, many):
+        #The function to use instead of marshmallow for this dump, None to let marshmallow do it
+        if self.min_rows <= 0 or obj is None:
+            return None
+        many = schema.many if many is None else bool(many)
+        dump_one = self._compiled(schema)
+        if dump_one is None or self.rows(dump_one, obj, many) < self.min_rows:
+            return None
+        if many:
+            return lambda objs: [dump_one(each) for each in objs]
+        return dump_one
+
+
+FAST_SERIALIZER = FastSerializer()
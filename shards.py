@@ -0,0 +1,224 @@
+"""
+shards.py
+
+Optional horizontal sharding. With DATABASE_SHARD_URLS set (comma separated), stores are spread
+over several databases and their items, tags and item <-> tag links live with them. Shard 0 is
+DATABASE_URL, shard 1 the first of DATABASE_SHARD_URLS and so on. Users, revoked tokens and
+import jobs only live on shard 0.
+
+Shard k hands out the ids from k * ID_SPAN + 1 (`flask shards init` sets that up), so the id of
+a store, item or tag says which shard holds it, nothing has to be looked up. A new store goes
+to the shard picked by a hash of its name, which keeps store names unique across shards with
+the unique index of that one shard. Items and tags go to the shard of their store.
+
+Where statements run (db.RoutingSession is a SQLAlchemy ShardedSession asking this router):
+- handlers about one store, item or tag are decorated with @SHARDS.route("<id argument>"),
+  everything they run goes to the shard of that id
+- any other SELECT on these tables runs on every shard and the rows are concatenated. The list
+  endpoints put them back in order with SHARDS.in_order() (see pagination.py), every shard
+  returns at most one page so that is never more than shards x page size rows
+- lazy loads and refreshes go to the shard the object was loaded from
+- writes have to say their shard (SHARDS.use()), one that doesn't is an error, not a guess
+- read replicas (replicas.py) are copies of shard 0, the other shards are always read directly
+
+What shards don't give: item and tag names are unique per shard only (POST /item, POST
+/store/<id>/tag and the imports still check all shards first), a request writing to several shards commits them one
+after the other and not atomically, and migrations only run on shard 0. `flask shards init`
+creates the tables of the other shards from the models.
+
+Locally, with three SQLite files:
+    DATABASE_URL=sqlite:///data.db DATABASE_SHARD_URLS=sqlite:///shard1.db,sqlite:///shard2.db
+    flask db upgrade && flask shards init
+"""
+import zlib
+from contextlib import contextmanager
+from functools import wraps
+
+import click
+from flask import current_app, g, has_app_context
+from flask.cli import with_appcontext
+from flask_smorest import abort
+from sqlalchemy import create_engine, text
+
+from db import db, engine_options, configure_engine
+
+#Ids per shard. Postgres integer columns top out at 2^31, so this allows 21 shards of 100M rows per table.
+#Never change it once there is data, the ids already handed out would point at the wrong shard.
+ID_SPAN = 100_000_000
+SHARDED_TABLES = ("stores", "items", "tags", "item_tags")
+ID_TABLES = ("stores", "items", "tags") #the tables whose ids tell the shard
+
+
+class ShardRouter:
+    def init_app(self, app):
+        engines = []
+        for url in app.config["DATABASE_SHARD_URLS"]:
+            engine = create_engine(url, **engine_options(url)) #same pool settings as the primary
+            configure_engine(engine)
+            engines.append(engine)
+        app.extensions["shard_engines"] = engines
+        app.extensions["shards"] = self #db.RoutingSession finds us here
+        app.cli.add_command(shards_command)
+
+    def count(self):
+        return 1 + len(current_app.extensions["shard_engines"])
+
+    def engine(self, shard):
+        return current_app.extensions["shard_engines"][shard - 1] #shard 0 is db.engine
+
+    def of_id(self, row_id):
+        #The shard of a store, item or tag id, None when no shard has that range
+        if self.count() == 1:
+            return 0
+        shard = row_id // ID_SPAN
+        return shard if 0 <= shard < self.count() else None
+
+    def for_store_name(self, name):
+        return zlib.crc32(name.encode()) % self.count()
+
+    def current(self):
+        return g.get("shard") if has_app_context() else None
+
+    @contextmanager
+    def use(self, shard):
+        previous = g.get("shard")
+        g.shard = shard
+        try:
+            yield
+        finally:
+            g.shard = previous
+
+    def route(self, id_argument):
+        #For the handlers about one store, item or tag: runs them on the shard of the id in the URL
+        resource = id_argument.split("_")[0].capitalize()
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                shard = self.of_id(kwargs[id_argument])
+                if shard is None:
+                    abort(404, message=f"{resource} not found.")
+                with self.use(shard):
+                    return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def split(self, rows, id_of):
+        #(shard, its rows) for the shards of id_of(row), rows in the order they came. The ids must be valid.
+        groups = {}
+        for row in rows:
+            groups.setdefault(self.of_id(id_of(row)), []).append(row)
+        return groups.items()
+
+    def in_order(self, rows, key, reverse=False):
+        #Rows of a query that ran on every shard come one shard after the other, sort them again.
+        #One database already sorted them, and with its own collation, so they are left alone then.
+        if self.count() == 1:
+            return rows
+        return sorted(rows, key=key, reverse=reverse)
+
+    #The three choosers of db.RoutingSession
+
+    def shard_for_instance(self, mapper, instance, clause=None):
+        #Where a new row goes, or where a statement about mapper runs when it has no instance
+        table = mapper.local_table.name
+        if table not in SHARDED_TABLES or self.count() == 1:
+            return 0
+        if instance is None:
+            return self.current() or 0
+        if table == "stores":
+            shard = self.of_id(instance.id) if instance.id else self.for_store_name(instance.name)
+        elif table == "item_tags":
+            shard = self.of_id(instance.item_id)
+        else:
+            shard = self.of_id(instance.store_id)
+        if shard is None: #the handlers check ids before writing, this would quietly land on shard 0
+            raise ValueError(f"No shard holds the ids of {instance!r}")
+        return shard
+
+    def shards_for_identity(self, mapper, primary_key, *, lazy_loaded_from=None, **kwargs):
+        #Where session.get() looks for a primary key
+        if lazy_loaded_from is not None:
+            return [lazy_loaded_from.identity_token]
+        table = mapper.local_table.name
+        if table in ID_TABLES:
+            shard = self.of_id(primary_key[0])
+            return [] if shard is None else [shard]
+        return range(self.count()) if table in SHARDED_TABLES else [0]
+
+    def shards_for_statement(self, orm_context):
+        if orm_context.is_select and orm_context.lazy_loaded_from is not None:
+            return [orm_context.lazy_loaded_from.identity_token]
+        if self.count() == 1:
+            return [0]
+        mapper = orm_context.bind_mapper
+        if mapper is not None:
+            table = mapper.local_table.name
+        elif orm_context.is_insert or orm_context.is_update or orm_context.is_delete:
+            table = orm_context.statement.table.name #insert(ItemModel.__table__) and the like
+        else: #text() or a Core SELECT, it runs where we are
+            return [self.current() or 0]
+        if table not in SHARDED_TABLES:
+            return [0]
+        shard = self.current()
+        if shard is not None:
+            return [shard]
+        if orm_context.is_select:
+            return range(self.count())
+        raise RuntimeError(f"No shard chosen for a write to {table}, see SHARDS.use()")
+
+
+SHARDS = ShardRouter()
+
+
+def set_id_floor(connection, table, floor):
+    #The next id of table will be bigger than floor, whatever is (or isn't) in the table yet
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        #The models ask for AUTOINCREMENT on SQLite, without it an empty table starts at 1 again whatever we do
+        sql = connection.scalar(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :table"), {"table": table})
+        if "AUTOINCREMENT" not in sql.upper():
+            raise click.ClickException(f"{table} was created without AUTOINCREMENT, let flask shards init create the tables.")
+        connection.execute(
+            text("INSERT INTO sqlite_sequence (name, seq) SELECT :table, 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :table)"),
+            {"table": table}
+        )
+        connection.execute(text("UPDATE sqlite_sequence SET seq = :floor WHERE name = :table AND seq < :floor"), {"table": table, "floor": floor})
+    elif dialect == "postgresql":
+        connection.execute(
+            text(f"SELECT setval(pg_get_serial_sequence(:table, 'id'), GREATEST(:floor, (SELECT COALESCE(MAX(id), 0) FROM {table})))"),
+            {"table": table, "floor": floor}
+        )
+    else:
+        raise click.ClickException(f"Sharding supports SQLite and Postgres, not {dialect}.")
+
+
+@click.group("shards")
+def shards_command():
+    """Sharding of stores, items and tags, see shards.py."""
+
+
+@shards_command.command("init")
+@with_appcontext
+def init_command():
+    """Create the tables on shards 1 and up and give each shard its id range."""
+    if SHARDS.count() == 1:
+        raise click.ClickException("No shards, set DATABASE_SHARD_URLS.")
+    tables = [db.metadata.tables[name] for name in SHARDED_TABLES]
+    for shard in range(1, SHARDS.count()):
+        engine = SHARDS.engine(shard)
+        db.metadata.create_all(engine, tables=tables) #full-text search included, see search.install()
+        with engine.begin() as connection:
+            for table in ID_TABLES:
+                set_id_floor(connection, table, shard * ID_SPAN)
+        click.echo(f"shard {shard}: ids from {shard * ID_SPAN + 1}")
+
+
+@shards_command.command("status")
+@with_appcontext
+def status_command():
+    """How many stores, items and tags each shard holds."""
+    for shard in range(SHARDS.count()):
+        engine = db.engine if shard == 0 else SHARDS.engine(shard)
+        with engine.connect() as connection:
+            counts = {table: connection.scalar(text(f"SELECT COUNT(*) FROM {table}")) for table in ID_TABLES}
+        click.echo(f"shard {shard}: " + ", ".join(f"{count} {table}" for table, count in counts.items()))
@@ -0,0 +1,74 @@
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from db import db
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    #A fresh SQLite file per test, and nothing from a local .env that would change the numbers
+    monkeypatch.setenv("JWT_BLOCKLIST_BACKEND", "memory")
+    monkeypatch.setenv("PASSWORD_HASH_ROUNDS", "1000")
+    monkeypatch.setenv("RESPONSE_CACHE_ENABLED", "0")
+    app = create_app(f"sqlite:///{tmp_path / 'test.db'}")
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth(client):
+    #Headers with a fresh access token
+    client.post("/register", json={"username": "tester", "password": "secret"})
+    token = client.post("/login", json={"username": "tester", "password": "secret"}).json["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = [] #SQL sent to any engine
+        self.loaded = [] #ORM objects the sessions loaded from those rows
+
+    def __len__(self):
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        counter.statements.append(statement)
+
+    def loaded_as_persistent(session, instance):
+        counter.loaded.append(instance)
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Session, "loaded_as_persistent", loaded_as_persistent)
+    try:
+        yield counter
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+        event.remove(Session, "loaded_as_persistent", loaded_as_persistent)
+
+
+@pytest.fixture
+def queries():
+    return count_queries
@@ -0,0 +1,19 @@
+import jwt as pyjwt
+
+
+def test_tokens_carry_a_string_subject(app, client, auth):
+    token = auth["Authorization"].split()[1]
+    claims = pyjwt.decode(token, app.config["JWT_SECRET_KEY"], algorithms=["HS256"]) #verifies "sub" too
+    assert claims["sub"] == "1"
+    assert claims["is_admin"] is True
+
+
+def test_refresh_and_logout(client):
+    client.post("/register", json={"username": "someone", "password": "pw"})
+    tokens = client.post("/login", json={"username": "someone", "password": "pw"}).json
+    refreshed = client.post("/refresh", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert refreshed.status_code == 200
+    access = {"Authorization": f"Bearer {refreshed.json['access_token']}"}
+    assert client.get("/item", headers=access).status_code == 200
+    assert client.post("/logout", headers=access).status_code == 200
+    assert client.get("/item", headers=access).status_code == 401
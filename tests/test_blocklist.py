@@ -0,0 +1,40 @@
+import threading
+import time
+
+from blocklist import Blocklist, MemoryBlocklist
+
+
+def test_caches_survive_concurrent_sweeps():
+    #With a tiny cache every call sweeps, from 8 threads at once like a gthread worker
+    blocklist = Blocklist()
+    blocklist.max_cached = 5
+    blocklist.cache_seconds = 0.001
+    errors = []
+
+    def work(thread):
+        try:
+            for number in range(2000):
+                jti = f"{thread}-{number}"
+                if number % 3:
+                    blocklist.is_revoked(jti)
+                else:
+                    blocklist.add(jti, time.time() + (-1 if number % 2 else 60))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=work, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert blocklist.is_revoked("0-0")
+
+
+def test_memory_backend_drops_expired_tokens():
+    backend = MemoryBlocklist()
+    backend.add("old", time.time() - 1)
+    backend.add("new", time.time() + 60)
+    assert not backend.contains("old")
+    assert backend.contains("new")
+    assert "old" not in backend.tokens
@@ -0,0 +1,98 @@
+import threading
+
+from db import db
+from models import ItemModel
+from resources.item import _claim_version, _put_item
+
+
+def create_item(client, auth, name="chair"):
+    store_id = client.post("/store", json={"name": "store"}).json["id"]
+    return client.post("/item", json={"name": name, "price": 10, "store_id": store_id}, headers=auth).json
+
+
+def test_conditional_get(client, auth):
+    item = create_item(client, auth)
+    first = client.get(f"/item/{item['id']}", headers=auth)
+    again = client.get(f"/item/{item['id']}", headers={**auth, "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_put_with_a_stale_etag_is_refused(client, auth):
+    item = create_item(client, auth)
+    etag = client.get(f"/item/{item['id']}", headers=auth).headers["ETag"]
+    assert client.put(f"/item/{item['id']}", json={"price": 11}, headers={"If-Match": etag}).status_code == 200
+    assert client.put(f"/item/{item['id']}", json={"price": 12}, headers={"If-Match": etag}).status_code == 412
+    assert client.delete(f"/item/{item['id']}", headers={**auth, "If-Match": etag}).status_code == 412
+
+
+def test_delete_after_a_write_since_the_check_is_refused(app, client, auth):
+    item = create_item(client, auth)
+    with app.app_context():
+        version = db.session.get(ItemModel, item["id"]).version
+        assert _claim_version(item["id"], version) #what DELETE with If-Match does before deleting
+        assert not _claim_version(item["id"], version) #a second one holding the same ETag
+
+
+def test_write_after_the_check_loses(app, client, auth):
+    #The ETag matched, then somebody else wrote before our UPDATE: the version no longer matches
+    item = create_item(client, auth)
+    with app.app_context():
+        version = db.session.get(ItemModel, item["id"]).version
+        assert _put_item(item["id"], {"price": 20}) is not None
+        assert _put_item(item["id"], {"price": 30}, version) is None
+        db.session.commit()
+        assert db.session.get(ItemModel, item["id"]).price == 20
+
+
+def test_concurrent_puts_with_the_same_etag(client, auth):
+    item = create_item(client, auth)
+    etag = client.get(f"/item/{item['id']}", headers=auth).headers["ETag"]
+    statuses = []
+    barrier = threading.Barrier(8)
+
+    def put(number):
+        barrier.wait()
+        response = client.application.test_client().put(
+            f"/item/{item['id']}", json={"price": 100 + number}, headers={"If-Match": etag}
+        )
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=put, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(statuses) == [200] + [412] * 7, statuses
+
+
+def test_not_modified_without_loading_the_resource(client, auth, queries):
+    item = create_item(client, auth)
+    for path in (f"/item/{item['id']}", f"/store/{item['store']['id']}"):
+        etag = client.get(path, headers=auth).headers["ETag"]
+        with queries() as counted:
+            response = client.get(path, headers={**auth, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert len(counted) == 1 and counted.loaded == [], counted.statements #just the ETag query
+
+
+def test_etag_follows_the_body(client, auth):
+    item = create_item(client, auth)
+    path = f"/item/{item['id']}"
+    first = client.get(path, headers=auth).headers["ETag"]
+    assert client.get(path, query_string={"fields": "name"}, headers=auth).headers["ETag"] != first
+    tag = client.post(f"/store/{item['store']['id']}/tag", json={"name": "red"}).json
+    client.post(f"/item/{item['id']}/tag/{tag['id']}", headers=auth) #a new tag in the body, the item row is the same
+    linked = client.get(path, headers={**auth, "If-None-Match": first})
+    assert linked.status_code == 200 and linked.headers["ETag"] != first
+
+
+def test_store_and_tag_delete_with_if_match(client, auth):
+    item = create_item(client, auth)
+    store_path = f"/store/{item['store']['id']}"
+    tag = client.post(f"{store_path}/tag", json={"name": "red"}).json
+    store_etag = client.get(store_path).headers["ETag"]
+    tag_etag = client.get(f"/tag/{tag['id']}").headers["ETag"]
+    client.put(f"/item/{item['id']}", json={"price": 11}) #changes the store's body, not the tag's
+    assert client.delete(store_path, headers={"If-Match": store_etag}).status_code == 412
+    assert client.delete(f"/tag/{tag['id']}", headers={"If-Match": tag_etag}).status_code == 202
+    assert client.delete(store_path, headers={"If-Match": client.get(store_path).headers["ETag"]}).status_code == 200
@@ -0,0 +1,36 @@
+#POST /item/import commits chunk by chunk, a chunk that clashes with a concurrent write stops the run
+#like an interruption would, and uploading the file again carries on from that chunk.
+import io
+
+from sqlalchemy import insert
+
+import importer
+from db import db
+from models import ItemModel
+
+
+def upload(client, auth, body):
+    data = {"file": (io.BytesIO(body), "catalog.csv")}
+    return client.post("/item/import", data=data, query_string={"chunk_size": 2}, headers=auth, content_type="multipart/form-data")
+
+
+def test_concurrent_write_stops_the_import(client, auth, monkeypatch):
+    body = ("name,price,store\n" + "".join(f"item {number},{number},store\n" for number in range(1, 7))).encode()
+    write_chunk, calls = importer.write_chunk, []
+
+    def clashing(job, chunk, errors):
+        #Like another request creating the first item of the file between our name check and our INSERT
+        calls.append(chunk)
+        if len(calls) == 2:
+            db.session.execute(insert(ItemModel.__table__).values(name="item 1", price=1, store_id=1))
+        return write_chunk(job, chunk, errors)
+
+    monkeypatch.setattr(importer, "write_chunk", clashing)
+    response = upload(client, auth, body)
+    assert response.status_code == 200
+    assert (response.json["finished"], response.json["items_created"]) == (False, 2)
+    assert [error["line"] for error in response.json["error_samples"]] == [4] #lines 4 and 5, the second chunk
+
+    monkeypatch.setattr(importer, "write_chunk", write_chunk)
+    again = upload(client, auth, body)
+    assert (again.json["finished"], again.json["resumed_from_row"], again.json["items_created"]) == (True, 2, 6)
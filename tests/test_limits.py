@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from admission import ADMISSION
+from ratelimit import RATE_LIMITS, FileBuckets, parse_limit
+
+
+def test_login_limit_per_username(app, client):
+    RATE_LIMITS.limits["LOGIN_LIMIT_PER_USERNAME"] = parse_limit("3/60")
+    client.post("/register", json={"username": "victim", "password": "right"})
+    statuses = [client.post("/login", json={"username": "victim", "password": "wrong"}).status_code for _ in range(4)]
+    assert statuses == [401, 401, 401, 429]
+    limited = client.post("/login", json={"username": "victim", "password": "right"}, environ_base={"REMOTE_ADDR": "10.0.0.9"})
+    assert limited.status_code == 429 and int(limited.headers["Retry-After"]) > 0
+
+
+def test_file_buckets_are_shared(tmp_path):
+    #Two backends on the same file, like two gunicorn workers: 40 tokens are handed out once in total
+    path = str(tmp_path / "buckets.db")
+    granted = []
+
+    def take():
+        backend = FileBuckets(path)
+        for _ in range(50):
+            granted.append(backend.take("key", 40, 0.0001) == 0)
+
+    threads = [threading.Thread(target=take) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(granted) == 40
+
+
+def test_only_the_auth_budget_is_on_by_default(app):
+    assert ADMISSION.budgets == {"all": 0, "writes": 0, "auth": 4}
+
+
+def test_auth_budget_sheds_with_retry_after(app, client):
+    client.post("/register", json={"username": "someone", "password": "pw"})
+    ADMISSION.in_flight["auth"] = ADMISSION.budgets["auth"] #as if that many logins were hashing right now
+    try:
+        response = client.post("/login", json={"username": "someone", "password": "pw"})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert client.get("/store").status_code == 200 #the GETs still go through
+    finally:
+        ADMISSION.in_flight["auth"] = 0
+
+
+@pytest.mark.parametrize("value, expected", [("10/60", (10, 60.0)), ("0", None), ("", None)])
+def test_parse_limit(value, expected):
+    assert parse_limit(value) == expected
@@ -0,0 +1,51 @@
+#GET /item/search?sort=... pages with a cursor holding the sort value and the id of the last row
+import pytest
+
+from db import db
+from pagination import encode_sort_cursor
+from seed import generate
+
+
+@pytest.fixture
+def seeded(app):
+    with app.app_context():
+        generate(stores=2, items_per_store=10, tags_per_store=1, tags_per_item=1)
+        db.session.remove()
+
+
+def test_sorted_pages(client, auth, seeded):
+    seen, after = [], None
+    while True:
+        query = {"sort": "-price", "limit": 7, **({"after": after} if after else {})}
+        page = client.get("/item/search", query_string=query, headers=auth).get_json()
+        seen += [item["price"] for item in page["items"]]
+        after = page["next"]
+        if not after:
+            break
+    assert len(seen) == 20
+    assert seen == sorted(seen, reverse=True)
+
+
+@pytest.mark.parametrize("sort, cursor", [
+    ("price", encode_sort_cursor("item 5", 5)), #a sort=name cursor replayed with sort=price
+    ("name", encode_sort_cursor(10.5, 5)),
+    ("price", encode_sort_cursor(None, 5)),
+    ("price", "not base64!"),
+])
+def test_invalid_sort_cursor(client, auth, seeded, sort, cursor):
+    response = client.get("/item/search", query_string={"sort": sort, "after": cursor}, headers=auth)
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Invalid pagination cursor."
+
+
+def test_int_cursor_for_price(client, auth, seeded):
+    response = client.get("/item/search", query_string={"sort": "price", "after": encode_sort_cursor(0, 0)}, headers=auth)
+    assert response.status_code == 200
+    assert len(response.get_json()["items"]) == 20
+
+
+def test_sorted_page_with_a_fieldset_loads_the_sort_column(client, auth, seeded, queries):
+    with queries() as counted:
+        page = client.get("/item/search", query_string={"sort": "price", "fields": "name", "limit": 5}, headers=auth).get_json()
+    assert list(page["items"][0]) == ["name"] and page["next"]
+    assert len(counted) == 1, counted.statements #the page, no lazy load of price per row for the cursor
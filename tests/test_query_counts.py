@@ -0,0 +1,59 @@
+#The list and detail endpoints load their nested relationships in batches (selectinload), so the number
+#of queries doesn't grow with the number of rows. With 5 stores of 10 items and 3 tags each:
+import pytest
+
+from db import db
+from seed import generate
+
+
+@pytest.fixture
+def seeded(app):
+    with app.app_context():
+        generate(stores=5, items_per_store=10, tags_per_store=3, tags_per_item=2)
+        db.session.remove()
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("/item", 3), #items, their stores, their tags
+    ("/item/1", 4), #the ETag query (etags.py), then the same 3
+    ("/store", 3), #stores, their items, their tags
+    ("/store/1", 4),
+    ("/tag/1", 4), #the ETag query, tag, its store, its items
+    ("/store/1/tag", 4), #the store exists check, then the same 3 as /tag/<id>
+])
+def test_query_count(client, auth, seeded, queries, path, expected):
+    with queries() as counted:
+        response = client.get(path, headers=auth)
+    assert response.status_code == 200
+    assert len(counted) == expected, counted.statements
+
+
+def test_list_query_count_does_not_grow_with_rows(app, client, auth, seeded, queries):
+    with queries() as small:
+        client.get("/store", headers=auth)
+    with app.app_context():
+        generate(stores=20, items_per_store=10, tags_per_store=3, tags_per_item=2)
+        db.session.remove()
+    with queries() as large:
+        response = client.get("/store", headers=auth)
+    assert len(response.json["stores"]) == 25
+    assert len(large) == len(small)
+
+
+def test_store_stats_percentiles_are_one_query(client, auth, seeded, queries):
+    #store check, count/min/max/avg, all the percentiles, tag counts: asking for more percentiles costs nothing
+    with queries() as few:
+        response = client.get("/store/1/stats?percentiles=50", headers=auth)
+    with queries() as many:
+        response = client.get("/store/1/stats?percentiles=0,10,25,50,75,90,99,100", headers=auth)
+    assert len(few) == len(many) == 4, many.statements
+
+    prices = sorted(item["price"] for item in client.get("/store/1", headers=auth).json["items"])
+    def percentile_cont(fraction): #what Postgres would answer
+        position = fraction * (len(prices) - 1)
+        lower = int(position)
+        upper = min(lower + 1, len(prices) - 1)
+        return prices[lower] + (prices[upper] - prices[lower]) * (position - lower)
+    percentiles = response.json["price"]["percentiles"]
+    for percentile in (0, 10, 25, 50, 75, 90, 99, 100):
+        assert percentiles[f"p{percentile}"] == pytest.approx(percentile_cont(percentile / 100))
@@ -0,0 +1,61 @@
+#EXPLAIN of the queries behind the store detail page, the tag endpoints, the item <-> tag links and the /item/search
+#filters, on a database built by the migrations: none of them may scan its whole table. Runs on a SQLite file, set
+#QUERY_PLAN_DATABASE_URL to an empty Postgres database to check the plans there too.
+import os
+
+import pytest
+from flask_migrate import upgrade
+from sqlalchemy import text
+
+from app import create_app
+from db import db
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+#name -> (table that must not be scanned, query)
+HOT_QUERIES = {
+    "items of a store": ("items", "SELECT id, name, price FROM items WHERE store_id = 1"),
+    "tags of a store": ("tags", "SELECT id, name FROM tags WHERE store_id = 1"),
+    "tags of an item": ("item_tags", "SELECT tag_id FROM item_tags WHERE item_id = 1"),
+    "items of a tag": ("item_tags", "SELECT item_id FROM item_tags WHERE tag_id = 1"),
+    "is the item linked to the tag": ("item_tags", "SELECT 1 FROM item_tags WHERE item_id = 1 AND tag_id = 1"),
+    "search: price range": ("items", "SELECT id FROM items WHERE price >= 10 AND price <= 20"),
+    "search: store sorted by price": ("items", "SELECT id FROM items WHERE store_id = 1 ORDER BY price, id LIMIT 50"),
+    "search: name prefix": ("items", "SELECT id FROM items WHERE name >= 'abc' AND name < 'abd'"),
+}
+
+
+@pytest.fixture(scope="module")
+def plans(tmp_path_factory):
+    #name -> the lines of its plan, with the dialect
+    db_url = os.getenv("QUERY_PLAN_DATABASE_URL") or f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}"
+    app = create_app(db_url)
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+        with db.engine.connect() as connection:
+            dialect = connection.dialect.name
+            if dialect == "postgresql":
+                #Empty tables are cheaper to scan, make the planner show us whether it *can* use an index
+                connection.execute(text("SET enable_seqscan = off"))
+            plans = {name: explain(connection, query) for name, (_, query) in HOT_QUERIES.items()}
+        db.engine.dispose()
+    return dialect, plans
+
+
+def explain(connection, query):
+    if connection.dialect.name == "sqlite":
+        return [row[-1] for row in connection.execute(text("EXPLAIN QUERY PLAN " + query))]
+    return [row[0] for row in connection.execute(text("EXPLAIN " + query))]
+
+
+def is_full_scan(dialect, table, plan):
+    if dialect == "sqlite":
+        return any(line.startswith(f"SCAN {table}") for line in plan)
+    return any(f"Seq Scan on {table}" in line for line in plan)
+
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_uses_an_index(plans, name):
+    dialect, plans = plans
+    table, _ = HOT_QUERIES[name]
+    assert not is_full_scan(dialect, table, plans[name]), plans[name]
@@ -0,0 +1,52 @@
+#GETs decorated with @REPLICAS.read_only run on a replica, and the per request instrumentation has to see
+#those queries and connections as well as the primary's.
+import shutil
+import sqlite3
+
+import pytest
+
+from app import create_app
+from db import db
+from metrics import DB_POOL_CHECKED_OUT
+from models import StoreModel
+
+
+@pytest.fixture
+def replicated(tmp_path, monkeypatch):
+    #A primary and a copy of it as the replica, where the store has another name so we can tell them apart
+    monkeypatch.setenv("JWT_BLOCKLIST_BACKEND", "memory")
+    monkeypatch.setenv("RESPONSE_CACHE_ENABLED", "0")
+    monkeypatch.setenv("REQUEST_TIMING_ENABLED", "1")
+    primary, replica = tmp_path / "primary.db", tmp_path / "replica.db"
+    app = create_app(f"sqlite:///{primary}")
+    with app.app_context():
+        db.create_all()
+        db.session.add(StoreModel(id=1, name="primary"))
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose() #the last connection closing puts the WAL back into the file
+    shutil.copy(primary, replica)
+    with sqlite3.connect(replica) as connection:
+        connection.execute("UPDATE stores SET name = 'replica'")
+
+    app = create_app(f"sqlite:///{primary}", replica_urls=[f"sqlite:///{replica}"])
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in [db.engine, *app.extensions["replicas"]]:
+            engine.dispose()
+
+
+def test_replica_queries_are_timed(replicated):
+    response = replicated.test_client().get("/store/1")
+    assert response.json["name"] == "replica"
+    db_timing = response.headers["Server-Timing"].split(", ")[0]
+    assert db_timing.endswith('desc="4 queries"'), db_timing #the ETag, the store, its items and its tags, each counted once
+
+
+def test_replica_connections_are_in_the_pool_gauge(replicated):
+    with replicated.app_context():
+        before = DB_POOL_CHECKED_OUT._value.get()
+        with replicated.extensions["replicas"][0].connect():
+            assert DB_POOL_CHECKED_OUT._value.get() == before + 1
+        assert DB_POOL_CHECKED_OUT._value.get() == before
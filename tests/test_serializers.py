@@ -0,0 +1,15 @@
+#The compiled serializers (serializers.py) are shared by every schema that dumps the same fields
+from fieldsets import fieldset_schema
+from schemas import ItemSchema
+from serializers import FastSerializer
+
+
+def test_compiled_once_per_fieldset():
+    fast = FastSerializer()
+    first = fast._compiled(fieldset_schema(ItemSchema, {"only": ["id", "name"]}, many=True))
+    for _ in range(50): #a new schema instance per request, like GET /item?fields=id,name
+        assert fast._compiled(fieldset_schema(ItemSchema, {"only": ["name", "id"]}, many=True)) is first
+    other = fast._compiled(fieldset_schema(ItemSchema, {"only": ["id", "price"]}, many=True))
+    assert other is not first
+    assert other({"id": 1, "name": "chair", "price": 2.5}) == {"id": 1, "price": 2.5}
+    assert len(fast.compiled) == 2
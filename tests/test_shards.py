@@ -0,0 +1,82 @@
+#Three databases: the primary (shard 0) and two shards. Stores go to the shard of the hash of their name,
+#an item lives on the shard of its id, see shards.py.
+import pytest
+
+from app import create_app
+from db import db
+from models import StoreModel
+from seed import generate
+from shards import ID_SPAN, SHARDS, shards_command
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    monkeypatch.setenv("JWT_BLOCKLIST_BACKEND", "memory")
+    monkeypatch.setenv("RESPONSE_CACHE_ENABLED", "0")
+    monkeypatch.setenv("REQUEST_TIMING_ENABLED", "1")
+    app = create_app(f"sqlite:///{tmp_path / 'shard0.db'}", shard_urls=[f"sqlite:///{tmp_path / f'shard{shard}.db'}" for shard in (1, 2)])
+    with app.app_context():
+        db.create_all()
+    assert app.test_cli_runner().invoke(shards_command, ["init"]).exit_code == 0
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in [db.engine, *app.extensions["shard_engines"]]:
+            engine.dispose()
+
+
+def store_on(app, shard):
+    #Creates a store whose name hashes to shard, returns its id
+    with app.app_context():
+        name = next(name for name in (f"store {number}" for number in range(100)) if SHARDS.for_store_name(name) == shard)
+    return app.test_client().post("/store", json={"name": name}).json["id"]
+
+
+def test_put_on_a_shard_dumps_the_store(sharded):
+    client = sharded.test_client()
+    store_id, item_id = store_on(sharded, 2), 2 * ID_SPAN + 5
+    assert store_id // ID_SPAN == 2
+
+    created = client.put(f"/item/{item_id}", json={"name": "chair", "price": 10, "store_id": store_id})
+    assert created.status_code == 200
+    assert created.json["store"]["id"] == store_id
+
+    updated = client.put(f"/item/{item_id}", json={"price": 11})
+    assert updated.status_code == 200
+    assert updated.json["price"] == 11
+    assert updated.json["store"]["id"] == store_id
+
+
+def test_shard_queries_are_timed(sharded):
+    client = sharded.test_client()
+    store_id = store_on(sharded, 2)
+    response = client.get(f"/store/{store_id}")
+    assert response.status_code == 200
+    assert response.headers["Server-Timing"].startswith('db;') and 'desc="0 queries"' not in response.headers["Server-Timing"]
+
+
+def test_put_with_a_store_of_another_shard(sharded):
+    client = sharded.test_client()
+    store_id, other_store_id, item_id = store_on(sharded, 2), store_on(sharded, 1), 2 * ID_SPAN + 5
+    body = {"name": "chair", "price": 10}
+
+    #Creating an item there would put it on another shard than its store
+    assert client.put(f"/item/{item_id}", json={**body, "store_id": other_store_id}).status_code == 400
+
+    #Updating one doesn't move it, an existing item keeps its store whatever store_id says
+    client.put(f"/item/{item_id}", json={**body, "store_id": store_id})
+    updated = client.put(f"/item/{item_id}", json={**body, "price": 12, "store_id": other_store_id})
+    assert updated.status_code == 200
+    assert updated.json["price"] == 12
+    assert updated.json["store"]["id"] == store_id
+
+
+def test_seeded_stores_are_on_the_shard_of_their_name(sharded):
+    with sharded.app_context():
+        generate(stores=5, items_per_store=1, shard=2)
+        with SHARDS.use(2):
+            names = db.session.scalars(db.select(StoreModel.name)).all()
+        assert len(names) == 5 and {SHARDS.for_store_name(name) for name in names} == {2}
+        db.session.remove()
+    #so the unique index of that shard still catches the same name again
+    assert sharded.test_client().post("/store", json={"name": names[0]}).status_code == 400
@@ -0,0 +1,58 @@
+#Linking and unlinking write the one item_tags row, and the tag or item in the response comes with its
+#links in one SELECT ... IN each, so the number of queries doesn't depend on how many tags the item has or
+#how many items the tag has. Item 1 has 200 tags, tag 1 has 200 items.
+#(The tables for the inserts, an ORM executemany can't be sharded, see shards.py)
+import pytest
+from sqlalchemy import insert
+
+from db import db
+from models import ItemModel, ItemTags, StoreModel, TagModel
+
+MANY = 200
+
+
+@pytest.fixture
+def crowded(app):
+    with app.app_context():
+        db.session.add(StoreModel(id=1, name="store"))
+        db.session.execute(insert(ItemModel.__table__), [{"id": i, "name": f"item {i}", "price": i, "store_id": 1} for i in range(1, MANY + 2)])
+        db.session.execute(insert(TagModel.__table__), [{"id": i, "name": f"tag {i}", "store_id": 1} for i in range(1, MANY + 2)])
+        links = [{"item_id": 1, "tag_id": i} for i in range(1, MANY + 1)]
+        links += [{"item_id": i, "tag_id": 1} for i in range(2, MANY + 1)]
+        db.session.execute(insert(ItemTags.__table__), links)
+        db.session.commit()
+        db.session.remove()
+
+
+def test_link(client, auth, crowded, queries):
+    #Item 1 and tag 1 have all the links, item 201 and tag 201 have none: the same number of queries
+    with queries() as busy:
+        response = client.post(f"/item/1/tag/{MANY + 1}", headers=auth)
+    assert response.status_code == 201
+    assert response.get_json()["id"] == MANY + 1
+    assert [item["id"] for item in response.get_json()["items"]] == [1]
+    with queries() as quiet:
+        assert client.post(f"/item/{MANY + 1}/tag/{MANY + 1}", headers=auth).status_code == 201
+    assert len(busy) == len(quiet) <= 8, busy.statements
+
+
+def test_link_twice(client, auth, crowded):
+    assert client.post("/item/1/tag/1", headers=auth).status_code == 201
+    with client.application.app_context():
+        assert db.session.query(ItemTags).filter_by(item_id=1, tag_id=1).count() == 1
+
+
+def test_unlink(client, auth, crowded, queries):
+    with queries() as busy:
+        response = client.delete("/item/1/tag/1", headers=auth)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["message"] == "Item removed from tag"
+    assert (body["item"]["id"], len(body["item"]["tags"])) == (1, MANY - 1)
+    assert (body["tag"]["id"], len(body["tag"]["items"])) == (1, MANY - 1)
+    assert client.delete("/item/1/tag/1", headers=auth).status_code == 404
+
+    client.post(f"/item/{MANY + 1}/tag/{MANY + 1}", headers=auth)
+    with queries() as quiet:
+        assert client.delete(f"/item/{MANY + 1}/tag/{MANY + 1}", headers=auth).status_code == 200
+    assert len(busy) == len(quiet) <= 10, busy.statements
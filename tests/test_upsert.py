@@ -0,0 +1,63 @@
+#PUT /item/<id> and PUT /item/bulk create an item that isn't there yet with one INSERT ... ON CONFLICT DO UPDATE,
+#so requests racing to create the same id end up as one row instead of an IntegrityError for all but the first.
+#The app fixture is a SQLite file, each thread gets its own connection.
+import threading
+
+from db import db
+from models import ItemModel
+
+THREADS = 8
+
+
+def race(client, request):
+    #Runs request(test_client, number) in THREADS threads started at the same moment, returns the responses
+    responses = []
+    barrier = threading.Barrier(THREADS)
+
+    def run(number):
+        barrier.wait()
+        responses.append(request(client.application.test_client(), number))
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def test_concurrent_puts_create_one_item(app, client):
+    store_id = client.post("/store", json={"name": "store"}).json["id"]
+    responses = race(client, lambda test_client, number: test_client.put(
+        "/item/42", json={"name": "chair", "price": 10 + number, "store_id": store_id}
+    ))
+    assert [response.status_code for response in responses] == [200] * THREADS, [response.json for response in responses]
+    assert {response.json["id"] for response in responses} == {42}
+    with app.app_context():
+        items = db.session.scalars(db.select(ItemModel)).all()
+        assert [(item.id, item.name) for item in items] == [(42, "chair")]
+        assert items[0].version == THREADS #created once, then updated by every other request
+
+
+def test_concurrent_bulk_puts_create_one_item_per_id(app, client, auth):
+    store_id = client.post("/store", json={"name": "store"}).json["id"]
+    rows = lambda number: [{"id": item_id, "name": f"item {item_id}", "price": number, "store_id": store_id} for item_id in range(10, 20)]
+    responses = race(client, lambda test_client, number: test_client.put("/item/bulk", json=rows(number), headers=auth))
+    assert [response.status_code for response in responses] == [200] * THREADS, [response.json for response in responses]
+    for response in responses:
+        assert response.json == {"upserted": list(range(10, 20)), "errors": []}
+    with app.app_context():
+        items = db.session.scalars(db.select(ItemModel).order_by(ItemModel.id)).all()
+        assert [item.id for item in items] == list(range(10, 20))
+        assert {item.version for item in items} == {THREADS}
+
+
+def test_bulk_requests_are_bounded(app, client, auth):
+    app.config["BULK_MAX_ITEMS"] = 3
+    store_id = client.post("/store", json={"name": "store"}).json["id"]
+    rows = [{"id": item_id, "name": f"item {item_id}", "price": 1, "store_id": store_id} for item_id in range(1, 5)]
+    assert client.post("/item/bulk", json=[{key: row[key] for key in ("name", "price", "store_id")} for row in rows], headers=auth).status_code == 422
+    assert client.put("/item/bulk", json=rows, headers=auth).status_code == 422
+    assert client.put("/item/bulk", json=rows[:3], headers=auth).status_code == 200
+    with app.app_context():
+        assert db.session.query(ItemModel).count() == 3
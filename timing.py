@@ -0,0 +1,102 @@
+"""
+timing.py
+
+Opt-in per request instrumentation (REQUEST_TIMING_ENABLED=1). For every request we measure
+  - db: how many SQL statements ran and how long they took
+  - serialize: time spent in marshmallow dumping the response (schemas.py BaseSchema)
+  - jwt: decoding and verifying the access token, blocklist check included
+  - total: the whole request
+and send them back in a Server-Timing header (browsers show it in the network tab) and log
+one JSON line per request on the "timing" logger.
+
+When it is off nothing is registered with SQLAlchemy or Flask, the only cost left is one
+attribute check per schema dump.
+"""
+import json
+import logging
+import time
+
+from flask import g, has_request_context, request
+from flask_jwt_extended.config import config as jwt_config
+from sqlalchemy import event
+
+logger = logging.getLogger("timing")
+
+
+class RequestTiming:
+    def __init__(self):
+        self.enabled = False
+
+    def init_app(self, app, jwt, engines):
+        self.enabled = app.config["REQUEST_TIMING_ENABLED"]
+        if not self.enabled:
+            return
+
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._before_query)
+            event.listen(engine, "after_cursor_execute", self._after_query)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+        @jwt.decode_key_loader
+        def start_jwt_timer(jwt_header, jwt_payload):
+            if has_request_context() and "timing" in g:
+                g.timing["jwt_start"] = time.perf_counter()
+            return jwt_config.decode_key #what flask_jwt_extended would have used anyway
+
+    def _start(self):
+        g.timing = {"start": time.perf_counter(), "queries": 0, "db": 0.0, "serialize": 0.0, "jwt": 0.0, "dump_depth": 0}
+
+    def _before_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_query(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        if has_request_context() and "timing" in g:
+            g.timing["queries"] += 1
+            g.timing["db"] += elapsed
+
+    def jwt_verified(self):
+        #Called at the end of the blocklist check, the last step of verifying a token
+        if self.enabled and "timing" in g and "jwt_start" in g.timing:
+            g.timing["jwt"] += time.perf_counter() - g.timing.pop("jwt_start")
+
+    def dump_started(self):
+        if self.enabled and has_request_context() and "timing" in g:
+            g.timing["dump_depth"] += 1
+            if g.timing["dump_depth"] == 1: #nested schemas dump too, only time the outermost one
+                g.timing["dump_start"] = time.perf_counter()
+
+    def dump_finished(self):
+        if self.enabled and has_request_context() and "timing" in g:
+            g.timing["dump_depth"] -= 1
+            if g.timing["dump_depth"] == 0:
+                g.timing["serialize"] += time.perf_counter() - g.timing.pop("dump_start")
+
+    def _finish(self, response):
+        timing = g.pop("timing", None)
+        if timing is None:
+            return response
+        total = time.perf_counter() - timing["start"]
+        ms = lambda seconds: round(seconds * 1000, 3)
+        response.headers["Server-Timing"] = ", ".join([
+            f'db;dur={ms(timing["db"])};desc="{timing["queries"]} queries"',
+            f'serialize;dur={ms(timing["serialize"])}',
+            f'jwt;dur={ms(timing["jwt"])}',
+            f'total;dur={ms(total)}',
+        ])
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "queries": timing["queries"],
+            "db_ms": ms(timing["db"]),
+            "serialize_ms": ms(timing["serialize"]),
+            "jwt_ms": ms(timing["jwt"]),
+            "total_ms": ms(total),
+        }))
+        return response
+
+
+REQUEST_TIMING = RequestTiming()